@@ -1,9 +1,9 @@
 ﻿from flask.views import MethodView
-from flask_jwt_extended import jwt_required, get_jwt_identity
+from flask_jwt_extended import jwt_required, get_jwt_identity, get_jwt
 from flask import request, jsonify
-from Server.database import get_db_cnx, get_email_from_id
-from Server.socket_manager import socketio
-from Server.socket_events import get_user_socket_id
+from Server.database import get_db_cnx
+from Server.contact_cache import bump_version
+from Server import outbox
 from . import api_bp
 
 class ContactRequestsView(MethodView):
@@ -11,7 +11,7 @@ class ContactRequestsView(MethodView):
     def get(self):
         # Get pending contact requests for current user
         user_id = get_jwt_identity()
-        cnx = get_db_cnx()
+        cnx = get_db_cnx(read_only=True)
         cursor = cnx.cursor(dictionary=True)
         try:
             cursor.execute(
@@ -47,7 +47,7 @@ class ContactRequestsView(MethodView):
         try:
             # Verify this request is for current user
             cursor.execute(
-                "SELECT * FROM contact_requests WHERE id = %s AND recipient_id = %s",
+                "SELECT requester_id FROM contact_requests WHERE id = %s AND recipient_id = %s",
                 (request_id, user_id)
             )
             req = cursor.fetchone()
@@ -58,17 +58,16 @@ class ContactRequestsView(MethodView):
                 "UPDATE contact_requests SET status = %s WHERE id = %s",
                 (status, request_id)
             )
+            outbox.enqueue(cursor, 'contact_request_response', {
+                'from': get_jwt()['email'],
+                'status': status
+            }, room=req['requester_id'])
             cnx.commit()
+            outbox.notify()
+            bump_version(user_id, req['requester_id'])
 
             print('acton taken is ', action)
             print('status is ', status)
-            requester_sid = get_user_socket_id(req['requester_id'])
-            if requester_sid:
-                recipient_email = get_email_from_id(user_id)
-                socketio.emit('contact_request_response', {
-                    'from': recipient_email,
-                    'status': status
-                }, room=requester_sid)
 
             return jsonify({'status': 'success', 'message': f'Request {status}'})
         finally:
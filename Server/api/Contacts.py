@@ -1,9 +1,9 @@
 # Python (Server/api/contact_view.py)
-from flask_jwt_extended import jwt_required, get_jwt_identity
-from Server.socket_manager import socketio
-from Server.socket_events import user_sessions, get_user_socket_id
-from Server.database import get_db_cnx, get_email_from_id
-from flask import request, jsonify
+from flask_jwt_extended import jwt_required, get_jwt_identity, get_jwt
+from Server.database import get_db_cnx
+from Server.contact_cache import get_version, bump_version, get_snapshot, store_snapshot, resolve_pair
+from Server import outbox
+from flask import request, jsonify, make_response
 from flask.views import MethodView
 from . import api_bp
 import mysql.connector
@@ -19,7 +19,7 @@ class ContactView(MethodView):
         cnx = get_db_cnx()
         cursor = cnx.cursor(dictionary=True)
         try:
-            cursor.execute("SELECT * FROM users WHERE email = %s", (user2_email,))
+            cursor.execute("SELECT id, email FROM users WHERE email = %s", (user2_email,))
             user_to_add = cursor.fetchone()
             if not user_to_add:
                 return jsonify({'status': 'error', 'message': 'User not found'}), 404
@@ -32,20 +32,23 @@ class ContactView(MethodView):
                 INSERT INTO contact_requests (requester_id, recipient_id)
                 VALUES (%s, %s)
                 ON DUPLICATE KEY UPDATE 
+                    id = LAST_INSERT_ID(id),
                     status = 'pending',
                     created_at = CURRENT_TIMESTAMP
                 """,
                 (user1_id, user_to_add['id'])
             )
-            cnx.commit()
+            request_id = cursor.lastrowid
 
-            # Notify recipient through socket
-            recipient_socket_id = get_user_socket_id(user_to_add['id'])
-            if recipient_socket_id:
-                sender_email = get_email_from_id(user1_id)
-                socketio.emit('contact_request', {
-                    'from': sender_email
-                }, room=recipient_socket_id)
+            # Notify recipient with the new request itself, so the client can
+            # update its list without refetching
+            outbox.enqueue(cursor, 'contact_request', {
+                'from': get_jwt()['email'],
+                'request_id': request_id
+            }, room=user_to_add['id'])
+            cnx.commit()
+            outbox.notify()
+            bump_version(user1_id, user_to_add['id'])
 
             return jsonify({
                 'status': 'success',
@@ -67,33 +70,30 @@ class ContactView(MethodView):
         cursor = cnx.cursor(dictionary=True)
 
         try:
-            cursor.execute("SELECT * FROM users WHERE email = %s", (user2_email,))
+            cursor.execute("SELECT id, email FROM users WHERE email = %s", (user2_email,))
             user_to_remove = cursor.fetchone()
             if not user_to_remove:
                 return jsonify({'status': 'error', 'message': 'User not found'}), 404
 
             # Mark contact as deleted. Here, we add a new entry with the status deleted 'deleted'.
-            # Insert with duplicate handling: update status to 'deleted' if the entry exists
+            # Insert with duplicate handling: update status to 'deleted' if the entry exists,
+            # and make it the pair's most recent row (see resolve_pair)
             cursor.execute(
                 """
                 INSERT INTO contact_requests (requester_id, recipient_id, status)
                 VALUES (%s, %s, 'deleted')
-                ON DUPLICATE KEY UPDATE status = 'deleted'
+                ON DUPLICATE KEY UPDATE status = 'deleted', created_at = CURRENT_TIMESTAMP
                 """,
                 (user1_id, user_to_remove['id'])
             )
-            cnx.commit()
 
             # Notify the other user via socket
-            from Server.socket_manager import socketio
-            from Server.socket_events import get_user_socket_id
-
-            recipient_socket_id = get_user_socket_id(user_to_remove['id'])
-            if recipient_socket_id:
-                sender_email = get_email_from_id(user1_id)
-                socketio.emit('contact_removed', {
-                    'from': sender_email
-                }, room=recipient_socket_id)
+            outbox.enqueue(cursor, 'contact_removed', {
+                'from': get_jwt()['email']
+            }, room=user_to_remove['id'])
+            cnx.commit()
+            outbox.notify()
+            bump_version(user1_id, user_to_remove['id'])
 
             return jsonify({
                 'status': 'success',
@@ -107,5 +107,81 @@ class ContactView(MethodView):
             cursor.close()
             cnx.close()
 
+
+class ContactSnapshotView(MethodView):
+
+    @jwt_required()
+    def get(self):
+        """Contacts plus pending requests, revalidated with ETag/If-None-Match."""
+        user_id = get_jwt_identity()
+        # Read the version before querying so a concurrent change is never
+        # cached under a version it does not belong to
+        version = get_version(user_id)
+        etag = f'{user_id}-{version}'
+
+        if request.if_none_match.contains(etag):
+            resp = make_response('', 304)
+        else:
+            snapshot = get_snapshot(user_id, version)
+            if snapshot is None:
+                snapshot = self._load(user_id)
+                snapshot['version'] = version
+                store_snapshot(user_id, version, snapshot)
+            resp = make_response(jsonify(snapshot))
+
+        resp.set_etag(etag)
+        resp.headers['Cache-Control'] = 'private, no-cache'
+        return resp
+
+    @staticmethod
+    def _load(user_id):
+        # Primary only: the result is cached and served behind an ETag until
+        # the next bump, and only the writer is pinned to the primary, so a
+        # lagging replica's view would stick for the other party
+        cnx = get_db_cnx()
+        cursor = cnx.cursor(dictionary=True)
+        try:
+            cursor.execute(
+                """
+                SELECT cr.id, cr.status, cr.created_at, 'outgoing' AS direction, u.email
+                FROM contact_requests cr
+                JOIN users u ON u.id = cr.recipient_id
+                WHERE cr.requester_id = %s
+                UNION ALL
+                SELECT cr.id, cr.status, cr.created_at, 'incoming' AS direction, u.email
+                FROM contact_requests cr
+                JOIN users u ON u.id = cr.requester_id
+                WHERE cr.recipient_id = %s
+                """,
+                (user_id, user_id)
+            )
+            rows = cursor.fetchall()
+        finally:
+            cursor.close()
+            cnx.close()
+
+        # A pair may have a row in each direction; the most recent one says
+        # where it stands, so a new request after a deletion shows up again
+        by_email = {}
+        for row in rows:
+            by_email.setdefault(row['email'], []).append(row)
+
+        snapshot = {'contacts': [], 'incoming': [], 'outgoing': []}
+        for email, pair_rows in by_email.items():
+            status, pending = resolve_pair(pair_rows)
+            if status == 'accepted':
+                snapshot['contacts'].append({'email': email})
+                continue
+            for row in pending:
+                key = 'requester_email' if row['direction'] == 'incoming' else 'recipient_email'
+                snapshot[row['direction']].append({
+                    'id': row['id'],
+                    key: email,
+                    'created_at': row['created_at'].isoformat()
+                })
+        return snapshot
+
+
 contact_view = ContactView.as_view('contact')
-api_bp.add_url_rule('/contact', view_func=contact_view, methods=['POST', 'DELETE'])
\ No newline at end of file
+api_bp.add_url_rule('/contact', view_func=contact_view, methods=['POST', 'DELETE'])
+api_bp.add_url_rule('/contacts/snapshot', view_func=ContactSnapshotView.as_view('contacts_snapshot'), methods=['GET'])
\ No newline at end of file
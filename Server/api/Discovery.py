@@ -0,0 +1,44 @@
+from flask.views import MethodView
+from flask_jwt_extended import jwt_required, get_jwt_identity
+from flask import request, jsonify
+from Server.database import find_registered
+from Server.rate_limit import limiter, too_many_requests
+from . import api_bp
+import os
+import re
+
+DISCOVERY_MAX_BATCH = int(os.getenv('DISCOVERY_MAX_BATCH', 10000))
+HASH_PATTERN = re.compile(r'[0-9a-f]{64}')
+
+
+class DiscoveryView(MethodView):
+
+    @jwt_required()
+    def post(self):
+        """Return which of the given email hashes belong to registered users."""
+        data = request.get_json(silent=True) or {}
+        hashes = data.get('hashes')
+
+        if not isinstance(hashes, list) or not hashes:
+            return jsonify({'status': 'error', 'message': 'A list of hashes is required'}), 400
+        if len(hashes) > DISCOVERY_MAX_BATCH:
+            return jsonify({'status': 'error', 'message': f'At most {DISCOVERY_MAX_BATCH} hashes per request'}), 400
+        if not all(isinstance(h, str) and HASH_PATTERN.fullmatch(h.lower()) for h in hashes):
+            return jsonify({'status': 'error', 'message': 'Hashes must be SHA-256 hex digests'}), 400
+        hashes = {h.lower() for h in hashes}
+
+        # The budget is counted in identifiers, so splitting a batch buys nothing
+        allowed, retry_after = limiter.hit('discover', get_jwt_identity(), cost=len(hashes))
+        if not allowed:
+            return too_many_requests(retry_after)
+
+        try:
+            registered = find_registered(list(hashes))
+        except Exception as e:
+            print(f"Error during contact discovery: {e}")
+            return jsonify({'status': 'error', 'message': 'Discovery failed'}), 500
+
+        return jsonify({'registered': sorted(registered)})
+
+
+api_bp.add_url_rule('/contacts/discover', view_func=DiscoveryView.as_view('contacts_discover'), methods=['POST'])
@@ -0,0 +1,106 @@
+from flask.views import MethodView
+from flask_jwt_extended import jwt_required, get_jwt_identity, get_jwt
+from flask import request, jsonify
+from Server.database import get_db_cnx
+from Server.rate_limit import limit_route
+from Server.socket_manager import socketio
+from . import api_bp
+import os
+
+GROUP_MAX_MEMBERS = int(os.getenv('GROUP_MAX_MEMBERS', 1000))
+
+
+class GroupsView(MethodView):
+
+    @jwt_required()
+    def get(self):
+        """List the current user's groups with their members."""
+        user_id = get_jwt_identity()
+        cnx = get_db_cnx(read_only=True)
+        cursor = cnx.cursor(dictionary=True)
+        try:
+            cursor.execute(
+                """
+                SELECT g.id, g.name, u.email
+                FROM group_members me
+                JOIN conversation_groups g ON g.id = me.group_id
+                JOIN group_members gm ON gm.group_id = g.id
+                JOIN users u ON u.id = gm.user_id
+                WHERE me.user_id = %s
+                ORDER BY g.id
+                """,
+                (user_id,)
+            )
+            groups = {}
+            for row in cursor.fetchall():
+                group = groups.setdefault(row['id'], {'id': row['id'], 'name': row['name'], 'members': []})
+                group['members'].append(row['email'])
+            return jsonify({'groups': list(groups.values())})
+        finally:
+            cursor.close()
+            cnx.close()
+
+    @jwt_required()
+    @limit_route('groups')
+    def post(self):
+        """Create a group with the current user and the given member emails."""
+        user_id = get_jwt_identity()
+        creator_email = get_jwt()['email']
+        data = request.get_json(silent=True) or {}
+        name = data.get('name')
+        requested = data.get('members')
+        if not isinstance(name, str) or not isinstance(requested, list) \
+                or not all(isinstance(email, str) for email in requested):
+            return jsonify({'status': 'error', 'message': 'Group name and a list of member emails are required'}), 400
+        name = name.strip()
+        # Compared lower-cased, as MySQL's collation does in the lookup below
+        member_emails = {email.strip().lower() for email in requested} - {creator_email.lower(), ''}
+
+        if not name or not member_emails:
+            return jsonify({'status': 'error', 'message': 'Group name and members are required'}), 400
+        if len(member_emails) + 1 > GROUP_MAX_MEMBERS:
+            return jsonify({'status': 'error', 'message': f'Groups are limited to {GROUP_MAX_MEMBERS} members'}), 400
+
+        cnx = get_db_cnx()
+        cursor = cnx.cursor()
+        try:
+            placeholders = ', '.join(['%s'] * len(member_emails))
+            cursor.execute(f"SELECT id, email FROM users WHERE email IN ({placeholders})", tuple(member_emails))
+            members = cursor.fetchall()
+            missing = member_emails - {email.lower() for _, email in members}
+            if missing:
+                return jsonify({'status': 'error', 'message': 'User not found', 'missing': sorted(missing)}), 404
+
+            cursor.execute(
+                "INSERT INTO conversation_groups (name, created_by) VALUES (%s, %s)",
+                (name, user_id)
+            )
+            group_id = cursor.lastrowid
+            cursor.executemany(
+                "INSERT INTO group_members (group_id, user_id) VALUES (%s, %s)",
+                [(group_id, user_id)] + [(group_id, member_id) for member_id, _ in members]
+            )
+            cnx.commit()
+        except Exception as e:
+            cnx.rollback()
+            print('Failed to create group', e)
+            return jsonify({'status': 'error', 'message': str(e)}), 500
+        finally:
+            cursor.close()
+            cnx.close()
+
+        for member_id, _ in members:
+            socketio.emit('group_added', {
+                'group_id': group_id,
+                'name': name,
+                'from': creator_email
+            }, room=str(member_id))
+
+        return jsonify({
+            'status': 'success',
+            'group_id': group_id,
+            'members': [creator_email] + [email for _, email in members]
+        }), 201
+
+
+api_bp.add_url_rule('/groups', view_func=GroupsView.as_view('groups'), methods=['GET', 'POST'])
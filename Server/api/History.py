@@ -0,0 +1,48 @@
+from flask.views import MethodView
+from flask_jwt_extended import jwt_required, get_jwt
+from flask import request, jsonify
+from Server.database import get_conversation_page, decode_cursor, HISTORY_MAX_PAGE
+from Server.rate_limit import limit_route
+from . import api_bp
+
+
+class HistoryView(MethodView):
+
+    @jwt_required()
+    @limit_route('history')
+    def get(self):
+        """Page through a conversation with ?contact=…&before=<cursor> or &after=<cursor>."""
+        user_email = get_jwt()['email']
+        contact_email = request.args.get('contact')
+        if not contact_email:
+            return jsonify({'status': 'error', 'message': 'Contact email is required'}), 400
+
+        before = request.args.get('before')
+        after = request.args.get('after')
+        try:
+            for cursor in (before, after):
+                if cursor is not None:
+                    decode_cursor(cursor)
+        except ValueError:
+            return jsonify({'status': 'error', 'message': 'Invalid cursor'}), 400
+
+        try:
+            limit = request.args.get('limit', 50, type=int)
+            messages = get_conversation_page(user_email, contact_email, before=before, after=after, limit=limit)
+        except Exception as e:
+            print(f"Error loading history: {e}")
+            return jsonify({'status': 'error', 'message': 'Failed to load history'}), 500
+
+        # Cursors for the neighbouring pages; None once a page comes back short
+        full = len(messages) == max(1, min(limit, HISTORY_MAX_PAGE))
+        if after is not None:
+            next_before = messages[0]['cursor'] if messages else after
+            next_after = messages[-1]['cursor'] if full else None
+        else:
+            next_before = messages[0]['cursor'] if full else None
+            next_after = messages[-1]['cursor'] if messages else before
+
+        return jsonify({'messages': messages, 'before': next_before, 'after': next_after})
+
+
+api_bp.add_url_rule('/messages/history', view_func=HistoryView.as_view('message_history'), methods=['GET'])
@@ -2,6 +2,10 @@
 from flask.views import MethodView
 from flask_jwt_extended import jwt_required, get_jwt
 from Server.database import get_db_cnx
+from Server.key_cache import get_key_bundle, bump_version
+from Server.sharding import get_shard_cnx
+from Server.rate_limit import limiter, limit_route
+from Server.xeddsa import verify_signed_prekey
 from . import api_bp
 
 # ─────────────────────────────────────────────
@@ -10,6 +14,7 @@ from . import api_bp
 class KeysApi(MethodView):
 
     @jwt_required()
+    @limit_route('keys')
     def post(self):
         # Get the current user's email from the JWT
         jwt_data = get_jwt()
@@ -21,38 +26,49 @@ class KeysApi(MethodView):
         if not contact_email:
             return jsonify({"error": "Contact email is required"}), 400
 
-        # Fetch the keys from the database
-        cnx = get_db_cnx()
-        cursor = cnx.cursor(dictionary=True)
+        # Identity and signed prekey come from the key-bundle cache, only the
+        # one-time prekey claim goes to the database (the user's shard)
         try:
-            # Get the contact's identity key and signed prekey
-            cursor.execute(
-                "SELECT identity_public_key, signed_prekey, signed_prekey_signature FROM users WHERE email = %s",
-                (contact_email,)
-            )
-            user_data = cursor.fetchone()
+            user_data = get_key_bundle(contact_email)
+        except Exception as e:
+            print(f"Error retrieving keys: {e}")
+            return jsonify({"error": "Failed to retrieve keys"}), 500
 
-            if not user_data:
-                return jsonify({"error": "User not found"}), 404
+        if not user_data:
+            return jsonify({"error": "User not found"}), 404
 
-            # Get an unused one-time prekey if available
-            cursor.execute(
-                """
-                SELECT prekey_id, prekey FROM prekeys
-                WHERE user_id = (SELECT id FROM users WHERE email = %s)
-                AND used = 0 LIMIT 1
-                """,
-                (contact_email,)
-            )
-            one_time_prekey = cursor.fetchone() or {"prekey_id": None, "prekey": None}
+        # Claims are also budgeted per target, so many callers (or accounts)
+        # can't drain one user's one-time prekeys. Past the budget the bundle
+        # comes without one, as when the user has none left; refusing it
+        # would let anyone block sessions with that user
+        one_time_prekey = {"prekey_id": None, "prekey": None}
+        claim, _ = limiter.hit('keys_target', user_data["id"])
 
-            # Mark the prekey as used if one was found
-            if one_time_prekey and one_time_prekey.get("prekey_id"):
+        cnx = None
+        cursor = None
+        try:
+            cnx = get_shard_cnx(user_data["id"], write=True)
+            cursor = cnx.cursor(dictionary=True)
+
+            # Claim an unused one-time prekey if available; SKIP LOCKED keeps
+            # two concurrent claims from handing out the same key
+            claimed = None
+            if claim:
                 cursor.execute(
-                    "UPDATE prekeys SET used = 1 WHERE prekey_id = %s",
-                    (one_time_prekey["prekey_id"],)
+                    """
+                    SELECT id, prekey_id, prekey FROM prekeys
+                    WHERE user_id = %s AND used = 0
+                    LIMIT 1 FOR UPDATE SKIP LOCKED
+                    """,
+                    (user_data["id"],)
                 )
-                cnx.commit()
+                claimed = cursor.fetchone()
+
+            # Mark the prekey as used if one was found
+            if claimed:
+                cursor.execute("UPDATE prekeys SET used = 1 WHERE id = %s", (claimed["id"],))
+                one_time_prekey = {"prekey_id": claimed["prekey_id"], "prekey": claimed["prekey"]}
+            cnx.commit()
 
             # Construct the prekey bundle
             prekey_bundle = {
@@ -73,8 +89,56 @@ class KeysApi(MethodView):
             if cnx: cnx.close()
 
 
+# ─────────────────────────────────────────────
+# 2.  /api/keys/signed_prekey
+# ─────────────────────────────────────────────
+class SignedPrekeyApi(MethodView):
+
+    @jwt_required()
+    @limit_route('signed_prekey')
+    def post(self):
+        """Rotate the current user's signed prekey."""
+        user_email = get_jwt()["email"]
+        data = request.get_json() or {}
+        signed_prekey = data.get('signed_prekey')
+        signature = data.get('signed_prekey_signature')
+
+        if not signed_prekey or not signature:
+            return jsonify({"error": "Signed prekey and signature are required"}), 400
+
+        bundle = get_key_bundle(user_email)
+        if not bundle:
+            return jsonify({"error": "User not found"}), 404
+        if not verify_signed_prekey(bundle["identity_public_key"], signed_prekey, signature):
+            return jsonify({"error": "Invalid signed prekey signature"}), 400
+
+        cnx = get_db_cnx()
+        cursor = cnx.cursor()
+        try:
+            cursor.execute(
+                "UPDATE users SET signed_prekey = %s, signed_prekey_signature = %s WHERE id = %s",
+                (signed_prekey, signature, bundle["id"])
+            )
+            cnx.commit()
+        except Exception as e:
+            cnx.rollback()
+            print(f"Error rotating signed prekey: {e}")
+            return jsonify({"error": "Failed to rotate signed prekey"}), 500
+        finally:
+            cursor.close()
+            cnx.close()
+
+        bump_version(user_email)
+        return jsonify({"status": "success"}), 200
+
+
 api_bp.add_url_rule(
     '/keys',
     view_func=KeysApi.as_view('keys_get'),
     methods=['POST']
+)
+api_bp.add_url_rule(
+    '/keys/signed_prekey',
+    view_func=SignedPrekeyApi.as_view('rotate_signed_prekey'),
+    methods=['POST']
 )
\ No newline at end of file
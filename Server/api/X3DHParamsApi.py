@@ -1,7 +1,9 @@
 ﻿from flask.views import MethodView
 from flask_jwt_extended import jwt_required, get_jwt
 from flask import request, jsonify
-from Server.database import get_db_cnx, get_id_from_email
+from Server.database import get_id_from_email
+from Server.key_cache import get_key_bundle
+from Server.handshake_store import save_handshake, load_handshake
 from . import api_bp
 from Server.socket_manager import socketio
 from Server.socket_events import get_user_socket_id
@@ -24,42 +26,39 @@ class EphemeralKeyApi(MethodView):
         if not recipient_email or not ephemeral_key:
             return jsonify({"error": "Missing required parameters"}), 400
 
-        cnx = get_db_cnx()
-        cursor = cnx.cursor()
         try:
-            cursor.execute(
-                """
-                INSERT INTO x3dh_params (sender_email, recipient_email, ephemeral_key, prekey_id, signed_prekey)
-                VALUES (%s, %s, %s, %s, %s)
-                ON DUPLICATE KEY UPDATE 
-                    sender_email = %s,
-                    recipient_email = %s,
-                    ephemeral_key = %s,
-                    prekey_id = %s,
-                    signed_prekey = %s
-                """,
-                (sender_email, recipient_email, ephemeral_key, prekey_id, signed_prekey, sender_email, recipient_email, ephemeral_key, prekey_id, signed_prekey)
-            )
-            cnx.commit()
-
-            # Notify recipient through socket
             recipient_id = get_id_from_email(recipient_email)
             recipient_socket_id = get_user_socket_id(recipient_id)
+
+            notification = {
+                'from': sender_email,
+                'ephemeral_key': ephemeral_key,
+                'their_signed_prekey': signed_prekey,
+                'prekey_id': prekey_id
+            }
+            params = {
+                'ephemeral_key': ephemeral_key,
+                'prekey_id': prekey_id,
+                'signed_prekey': signed_prekey
+            }
+
             if recipient_socket_id:
-                socketio.emit('ephemeral_key', {
-                    'from': sender_email,
-                    'ephemeral_key': ephemeral_key,
-                    'their_signed_prekey': signed_prekey,
-                    'prekey_id': prekey_id
-                }, room=recipient_socket_id)
+                # Recipient is connected here, so no outbox row is needed;
+                # the handshake is only written to the DB without Redis
+                save_handshake(sender_email, recipient_email, params)
+                socketio.emit('ephemeral_key', notification, room=str(recipient_id))
+            elif recipient_id:
+                # Written behind to the DB, and published by the outbox relay
+                # in case the recipient is connected to another worker
+                save_handshake(sender_email, recipient_email, params, persist=True,
+                               event=('ephemeral_key', notification, recipient_id))
+            else:
+                return jsonify({"error": "User not found"}), 404
             print(f"Ephemeral key sent to {recipient_email} from {sender_email}")
             return jsonify({"status": "success"}), 200
         except Exception as e:
             print(f"Error storing ephemeral key: {e}")
             return jsonify({"error": str(e)}), 500
-        finally:
-            if cursor: cursor.close()
-            if cnx: cnx.close()
 
 class RetrieveEphemeralKeyApi(MethodView):
     @jwt_required()
@@ -74,18 +73,8 @@ class RetrieveEphemeralKeyApi(MethodView):
         jwt_data = get_jwt()
         recipient_email = jwt_data["email"]
 
-        cnx = get_db_cnx()
-        cursor = cnx.cursor(dictionary=True)
         try:
-            cursor.execute(
-                """
-                SELECT ephemeral_key, prekey_id FROM x3dh_params
-                WHERE sender_email = %s AND recipient_email = %s
-                ORDER BY created_at DESC LIMIT 1
-                """,
-                (sender_email, recipient_email)
-            )
-            params = cursor.fetchone()
+            params = load_handshake(sender_email, recipient_email)
             if not params:
                 return jsonify({"error": "No ephemeral key found"}), 404
 
@@ -97,9 +86,6 @@ class RetrieveEphemeralKeyApi(MethodView):
         except Exception as e:
             print(f"Error retrieving ephemeral key: {e}")
             return jsonify({"error": str(e)}), 500
-        finally:
-            if cursor: cursor.close()
-            if cnx: cnx.close()
 
 # Identity key endpoint
 class IdentityKeyApi(MethodView):
@@ -112,24 +98,15 @@ class IdentityKeyApi(MethodView):
         if not email:
             return jsonify({"error": "Missing email"}), 400
 
-        cnx = get_db_cnx()
-        cursor = cnx.cursor(dictionary=True)
         try:
-            cursor.execute(
-                "SELECT identity_public_key AS identity_key FROM users WHERE email = %s",
-                (email,)
-            )
-            result = cursor.fetchone()
-            if not result:
+            bundle = get_key_bundle(email)
+            if not bundle:
                 return jsonify({"error": "User not found"}), 404
 
-            return jsonify({"identity_key": result['identity_key']}), 200
+            return jsonify({"identity_key": bundle['identity_public_key']}), 200
         except Exception as e:
             print(f"Error retrieving identity key: {e}")
             return jsonify({"error": str(e)}), 500
-        finally:
-            if cursor: cursor.close()
-            if cnx: cnx.close()
 
 
 
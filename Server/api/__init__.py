@@ -4,4 +4,4 @@ from flask import Blueprint
 api_bp = Blueprint('api', __name__, url_prefix='/api')
 
 # Import endpoint modules so their decorators run and register routes
-from . import Contacts, KeysApi, X3DHParamsApi, Contact_requests, refreshPrekeys
\ No newline at end of file
+from . import Contacts, KeysApi, X3DHParamsApi, Contact_requests, refreshPrekeys, Groups, History, Discovery
\ No newline at end of file
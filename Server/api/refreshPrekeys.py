@@ -2,7 +2,7 @@
 from flask.views import MethodView
 from flask import Blueprint, request, jsonify
 from flask_jwt_extended import jwt_required, get_jwt_identity
-from Server.database import get_db_cnx
+from Server.sharding import get_shard_cnx
 from . import api_bp
 
 class RefreshPrekeys(MethodView):
@@ -15,7 +15,7 @@ class RefreshPrekeys(MethodView):
         if 'prekeys' not in data or not isinstance(data['prekeys'], list):
             return jsonify({'status': 'error', 'message': 'invalid payload'}), 400
 
-        cnx    = get_db_cnx()
+        cnx    = get_shard_cnx(user_id, write=True)
         cursor = cnx.cursor()
         try:
             for pk in data['prekeys']:
@@ -53,7 +53,7 @@ class RefreshPrekeys(MethodView):
     @jwt_required()
     def get(self):
         user_id = get_jwt_identity()
-        cnx     = get_db_cnx()
+        cnx     = get_shard_cnx(user_id, read_only=True)
         cursor  = cnx.cursor()
         try:
             cursor.execute(
@@ -1,14 +1,18 @@
+import os
+from dotenv import load_dotenv
+
+# Load .env before importing Server modules, some of them read settings at import time
+load_dotenv()
+
 from flask import Flask
-from flask import render_template
+from flask import render_template, request, redirect, url_for, jsonify
 from flask_jwt_extended import JWTManager
 from flask_wtf import CSRFProtect
 from Server.socket_manager import socketio, init_socketio
-from Server.web import auth_bp, home_bp
+from Server.web import auth_bp, home_bp, ops_bp
+from Server.web.auth import refresh_session
 from Server.api import api_bp
-import os
-from dotenv import load_dotenv
-
-load_dotenv()
+from Server.warmup import start_warmup
 
 csrf = CSRFProtect()
 jwt  = JWTManager()
@@ -29,14 +33,33 @@ def create_app():
     app.register_blueprint(auth_bp)
     app.register_blueprint(home_bp)
     app.register_blueprint(api_bp)
+    app.register_blueprint(ops_bp)
 
 
     csrf.exempt(api_bp)
+    csrf.exempt(refresh_session)
+
+    # Pages opened with an expired (or already dropped) access token go
+    # through the refresh token instead of back to the login form
+    def resume_or_reject(message):
+        if request.method == 'GET' and not request.path.startswith('/api/'):
+            return redirect(url_for('auth.resume_session', next=request.full_path.rstrip('?')))
+        return jsonify({'msg': message}), 401
+
+    @jwt.expired_token_loader
+    def expired_token(jwt_header, jwt_payload):
+        return resume_or_reject('Token has expired')
+
+    @jwt.unauthorized_loader
+    def missing_token(reason):
+        return resume_or_reject(reason)
 
     @app.route('/')
     def index():
         return render_template('index.html')
 
+    start_warmup(app, socketio)
+
     return app
 
 if __name__ == '__main__':
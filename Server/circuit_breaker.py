@@ -0,0 +1,81 @@
+import threading
+import time
+
+from Server import metrics
+
+CLOSED, OPEN, HALF_OPEN = 'closed', 'open', 'half_open'
+_STATE_GAUGE = {CLOSED: 0, HALF_OPEN: 1, OPEN: 2}
+
+
+class CircuitBreaker:
+    """Consecutive-failure circuit breaker.
+
+    After `failure_threshold` failures in a row the breaker opens and callers
+    fail fast for `reset_timeout` seconds. It then lets a single trial call
+    through (half-open); its outcome closes or re-opens the breaker.
+    """
+
+    def __init__(self, name, failure_threshold=5, reset_timeout=30):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._state = CLOSED
+        self._failures = 0
+        self._opened_at = 0
+        self._trial_started = None
+        self._lock = threading.Lock()
+        metrics.set_gauge(f'breaker.{name}.state', _STATE_GAUGE[CLOSED])
+
+    @property
+    def state(self):
+        with self._lock:
+            if self._state == OPEN and time.monotonic() - self._opened_at >= self.reset_timeout:
+                return HALF_OPEN
+            return self._state
+
+    def allow(self):
+        """Return True if a call may go through right now."""
+        with self._lock:
+            if self._state == CLOSED:
+                return True
+            if self._state == OPEN and time.monotonic() - self._opened_at < self.reset_timeout:
+                return False
+            # Only one trial at a time; a trial that never reported back is
+            # considered lost after reset_timeout
+            now = time.monotonic()
+            if self._trial_started is not None and now - self._trial_started < self.reset_timeout:
+                return False
+            self._set_state(HALF_OPEN)
+            self._trial_started = now
+            return True
+
+    def record_success(self):
+        with self._lock:
+            self._failures = 0
+            self._trial_started = None
+            if self._state != CLOSED:
+                self._set_state(CLOSED)
+
+    def record_connected(self):
+        """A connection was opened: ends a trial, but in the closed state it
+        leaves failures recorded by queries alone, since a server can accept
+        connections and still stall every query."""
+        with self._lock:
+            if self._state != CLOSED:
+                self._failures = 0
+                self._trial_started = None
+                self._set_state(CLOSED)
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            self._trial_started = None
+            if self._state == HALF_OPEN or self._failures >= self.failure_threshold:
+                if self._state != OPEN:
+                    metrics.incr(f'breaker.{self.name}.opened')
+                self._opened_at = time.monotonic()
+                self._set_state(OPEN)
+
+    def _set_state(self, state):
+        self._state = state
+        metrics.set_gauge(f'breaker.{self.name}.state', _STATE_GAUGE[state])
@@ -0,0 +1,124 @@
+import threading
+import uuid
+from collections import OrderedDict
+
+from Server.database import get_db_cnx
+from Server.shared_store import get_redis
+
+# Local versions are only meaningful for this process, so they are prefixed
+# with a boot id to keep ETags from colliding across restarts.
+_boot_id = uuid.uuid4().hex[:8]
+_lock = threading.Lock()
+_versions = {}
+_snapshots = OrderedDict()
+_contact_sets = OrderedDict()
+MAX_SNAPSHOTS = 10000
+
+
+def get_version(user_id):
+    """Return the current contact-list version token for a user."""
+    client = get_redis()
+    if client:
+        return f"r{int(client.get(f'contacts:version:{user_id}') or 0)}"
+    with _lock:
+        return f'{_boot_id}.{_versions.get(str(user_id), 0)}'
+
+
+def bump_version(*user_ids):
+    """Invalidate the contact snapshot of every given user."""
+    client = get_redis()
+    for user_id in user_ids:
+        if client:
+            client.incr(f'contacts:version:{user_id}')
+        with _lock:
+            if not client:
+                _versions[str(user_id)] = _versions.get(str(user_id), 0) + 1
+            _snapshots.pop(str(user_id), None)
+            _contact_sets.pop(str(user_id), None)
+
+
+def get_snapshot(user_id, version):
+    """Return the cached snapshot for a user if it is still at `version`."""
+    with _lock:
+        cached = _snapshots.get(str(user_id))
+        if cached and cached[0] == version:
+            _snapshots.move_to_end(str(user_id))
+            return cached[1]
+    return None
+
+
+def store_snapshot(user_id, version, snapshot):
+    with _lock:
+        _snapshots[str(user_id)] = (version, snapshot)
+        _snapshots.move_to_end(str(user_id))
+        while len(_snapshots) > MAX_SNAPSHOTS:
+            _snapshots.popitem(last=False)
+
+
+def resolve_pair(pair_rows):
+    """Where two users stand, from their contact_requests rows (one per direction).
+
+    The most recent row (created_at, then id) decides: requesting again and
+    deleting both refresh created_at. Returns the status of that row and,
+    when it is 'pending', the requests made since the pair's last accept,
+    reject or delete, newest first.
+    """
+    pair_rows = sorted(pair_rows, key=lambda row: (row['created_at'], row['id']), reverse=True)
+    pending = []
+    for row in pair_rows:
+        if row['status'] != 'pending':
+            break
+        pending.append(row)
+    return pair_rows[0]['status'], pending
+
+
+def _load_contact_set(user_id):
+    # Primary only: this is cached until the next bump, so it must already
+    # include the change that caused the bump
+    cnx = get_db_cnx()
+    cursor = cnx.cursor(dictionary=True)
+    try:
+        cursor.execute(
+            """
+            SELECT cr.id, cr.status, cr.created_at, u.id AS contact_id, u.email FROM contact_requests cr
+            JOIN users u ON u.id = cr.recipient_id
+            WHERE cr.requester_id = %s
+            UNION ALL
+            SELECT cr.id, cr.status, cr.created_at, u.id AS contact_id, u.email FROM contact_requests cr
+            JOIN users u ON u.id = cr.requester_id
+            WHERE cr.recipient_id = %s
+            """,
+            (user_id, user_id)
+        )
+        rows = cursor.fetchall()
+    finally:
+        cursor.close()
+        cnx.close()
+
+    # Same rule as the snapshot
+    pairs = {}
+    for row in rows:
+        pairs.setdefault(row['email'], []).append(row)
+    return {
+        email: pair_rows[0]['contact_id']
+        for email, pair_rows in pairs.items()
+        if resolve_pair(pair_rows)[0] == 'accepted'
+    }
+
+
+def get_contact_set(user_id):
+    """Return {email: user id} of a user's accepted contacts, cached per version."""
+    version = get_version(user_id)
+    with _lock:
+        cached = _contact_sets.get(str(user_id))
+        if cached and cached[0] == version:
+            _contact_sets.move_to_end(str(user_id))
+            return cached[1]
+
+    contacts = _load_contact_set(user_id)
+    with _lock:
+        _contact_sets[str(user_id)] = (version, contacts)
+        _contact_sets.move_to_end(str(user_id))
+        while len(_contact_sets) > MAX_SNAPSHOTS:
+            _contact_sets.popitem(last=False)
+    return contacts
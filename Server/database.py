@@ -1,38 +1,144 @@
+import hashlib
 import mysql.connector
 import os
+import threading
+from datetime import datetime
+from mysql.connector import pooling
 from urllib.parse import urlparse
+from flask import has_request_context, request
+from flask_jwt_extended import get_jwt_identity
+from Server import socket_auth
+from Server.circuit_breaker import CircuitBreaker
+from Server.replicas import get_replica_pool, pin_to_primary, is_pinned
+from Server.sharding import get_router, get_shard_cnx
 
+# Opens after repeated connection or query failures so callers fail fast
+# instead of piling up on a stalled database (see Server/spool.py for the
+# fallback)
+db_breaker = CircuitBreaker(
+    'db',
+    failure_threshold=int(os.getenv('DB_BREAKER_THRESHOLD', 5)),
+    reset_timeout=int(os.getenv('DB_BREAKER_RESET', 30))
+)
 
-def get_db_cnx():
-    """Get a MySQL database connection using either a connection string or config dict."""
+# Connection-level errors: server gone, unreachable or timed out
+UNAVAILABLE_ERRNOS = {2003, 2005, 2006, 2013, 2055}
+
+
+class DatabaseUnavailable(mysql.connector.errors.InterfaceError):
+    """Raised without touching the network while the database breaker is open."""
+
+
+def is_db_unavailable(err):
+    """True for errors meaning the database cannot be reached, as opposed to a bad query."""
+    if isinstance(err, (DatabaseUnavailable, mysql.connector.errors.InterfaceError,
+                        mysql.connector.errors.OperationalError)):
+        return True
+    return isinstance(err, mysql.connector.Error) and err.errno in UNAVAILABLE_ERRNOS
+
+
+def _connect_args(conn_string):
+    # Parse connection string to keyword arguments
+    result = urlparse(conn_string)
+    return dict(
+        host=result.hostname,
+        user=result.username,
+        password=result.password,
+        database=result.path.strip('/'),
+        port=result.port or 3306,
+        connection_timeout=int(os.getenv('DB_CONNECT_TIMEOUT', 5))
+    )
+
+# Connections are pooled per server: closing a pooled connection hands it
+# back (with its session reset) instead of disconnecting. The pool is filled
+# when first used, which warm-up does before the app reports ready.
+POOL_SIZE = min(int(os.getenv('DB_POOL_SIZE', 5)), pooling.CNX_POOL_MAXSIZE)
+_pools = {}
+_pools_lock = threading.Lock()
+
+def get_pool(conn_string):
+    """Connection pool for a server, None when pooling is disabled."""
+    if POOL_SIZE <= 0:
+        return None
+    with _pools_lock:
+        pool = _pools.get(conn_string)
+        if pool is None:
+            pool = pooling.MySQLConnectionPool(
+                pool_name=f'pool{len(_pools)}',
+                pool_size=POOL_SIZE,
+                pool_reset_session=True,
+                **_connect_args(conn_string)
+            )
+            _pools[conn_string] = pool
+        return pool
+
+def open_connection(conn_string):
+    pool = get_pool(conn_string)
+    if pool:
+        try:
+            return pool.get_connection()
+        except mysql.connector.errors.PoolError:
+            # Every pooled connection is in use: fall back to a one-off one
+            pass
+    return mysql.connector.connect(**_connect_args(conn_string))
+
+
+def _current_user_id():
+    """JWT identity of the request or socket event being served, if any."""
+    if not has_request_context():
+        return None
+    sid = getattr(request, 'sid', None)
+    if sid:
+        user = socket_auth.identity(sid, allow_expired=True)
+        return user[0] if user else None
+    try:
+        return get_jwt_identity()
+    except Exception:
+        return None
+
+
+def get_db_cnx(read_only=False, pin=True):
+    """Get a MySQL database connection using either a connection string or config dict.
+
+    `read_only=True` may return a connection to a healthy read replica. Any
+    other connection is treated as a write and pins the current user's reads
+    to the primary for a few seconds, so they always see their own writes;
+    `pin=False` is for reads that need the primary but write nothing.
+    """
+    user_id = _current_user_id()
+    if read_only:
+        if not (user_id and is_pinned(user_id)):
+            pool = get_replica_pool()
+            replica = pool.pick()
+            if replica:
+                try:
+                    return open_connection(replica['dsn'])
+                except mysql.connector.Error as err:
+                    print(f"Replica connection error, using primary: {err}")
+                    pool.mark_down(replica)
+    elif user_id and pin:
+        pin_to_primary(user_id)
+
+    if not db_breaker.allow():
+        raise DatabaseUnavailable('Database circuit breaker is open')
     try:
         # Try using connection string if provided in environment
         conn_string = os.getenv('DB_CONNECTION_STRING')
         if conn_string:
-            # Parse connection string to keyword arguments
-            result = urlparse(conn_string)
-            username = result.username
-            password = result.password
-            database = result.path.strip('/')
-            hostname = result.hostname
-            port = result.port or 3306
-
-            return mysql.connector.connect(
-                host=hostname,
-                user=username,
-                password=password,
-                database=database,
-                port=port
-            )
+            cnx = open_connection(conn_string)
+            db_breaker.record_connected()
+            return cnx
         else:
             raise Exception('No database connection string')
     except mysql.connector.Error as err:
+        if is_db_unavailable(err):
+            db_breaker.record_failure()
         print(f"Database connection error: {err}")
         raise
 
 def get_id_from_email(email):
     """Get user ID from email."""
-    cnx = get_db_cnx()
+    cnx = get_db_cnx(read_only=True)
     cursor = cnx.cursor()
     try:
         cursor.execute("SELECT id FROM users WHERE email = %s", (email,))
@@ -44,7 +150,7 @@ def get_id_from_email(email):
 
 def get_email_from_id(user_id):
     """Get user email from ID."""
-    cnx = get_db_cnx()
+    cnx = get_db_cnx(read_only=True)
     cursor = cnx.cursor()
     try:
         cursor.execute("SELECT email FROM users WHERE id = %s", (user_id,))
@@ -54,26 +160,59 @@ def get_email_from_id(user_id):
         cursor.close()
         cnx.close()
 
+def email_hash(email):
+    """Identifier used by contact discovery: SHA-256 hex of the normalised email."""
+    return hashlib.sha256(email.strip().lower().encode()).hexdigest()
+
+def find_registered(hashes):
+    """Return the subset of the given email hashes that belong to registered users."""
+    if not hashes:
+        return set()
+    cnx = get_db_cnx(read_only=True)
+    cursor = cnx.cursor()
+    try:
+        # One lookup on the unique email_hash index for the whole batch
+        placeholders = ', '.join(['%s'] * len(hashes))
+        cursor.execute(f"SELECT email_hash FROM users WHERE email_hash IN ({placeholders})", tuple(hashes))
+        return {row[0] for row in cursor.fetchall()}
+    finally:
+        cursor.close()
+        cnx.close()
+
+def get_shard_cnx_for_email(email, write=False, read_only=False):
+    """Connection to the shard holding the messages received by `email`."""
+    router = get_router()
+    if not router.sharded:
+        return get_shard_cnx(None, write=write, read_only=read_only)
+    user_id = get_id_from_email(email)
+    if user_id is None:
+        raise ValueError(f'Unknown user {email}')
+    return get_shard_cnx(user_id, write=write, read_only=read_only)
+
 def messaging_waiting(user_email, contact_email):
+    cnx = None
+    cur = None
     try:
-        cnx = get_db_cnx()
+        # Messages are stored on the recipient's shard
+        cnx = get_shard_cnx_for_email(user_email, write=True)
         cur = cnx.cursor(dictionary=True)
 
         # Requête pour récupérer les messages non livrés pour ce contact
         cur.execute("""
-            SELECT content, timestamp
+            SELECT id, content, timestamp, group_id
             FROM messages
             WHERE sender_email = %s AND receiver_email = %s AND is_delivered = FALSE
         """, (contact_email, user_email))
 
         messages = cur.fetchall()
 
-        cur. execute(
-            """UPDATE messages
-                SET is_delivered = TRUE
-                WHERE sender_email = %s AND receiver_email = %s AND is_delivered = FALSE;
-                )"""
-        , (contact_email, user_email))
+        if messages:
+            placeholders = ', '.join(['%s'] * len(messages))
+            cur.execute(
+                f"UPDATE messages SET is_delivered = TRUE WHERE id IN ({placeholders})",
+                tuple(message['id'] for message in messages)
+            )
+            cnx.commit()
         for message in messages:
             message['timestamp'] = message['timestamp'].isoformat()
 
@@ -90,7 +229,7 @@ def messaging_waiting(user_email, contact_email):
 
 def mark_messages_as_read_in_db(user_email, contact_email):
     """Met à jour le statut 'is_read' des messages reçus."""
-    cnx = get_db_cnx()
+    cnx = get_shard_cnx_for_email(user_email, write=True)
     cursor = cnx.cursor()
     try:
         cursor.execute(
@@ -103,3 +242,227 @@ def mark_messages_as_read_in_db(user_email, contact_email):
     finally:
         cursor.close()
         cnx.close()
+
+def mark_message_delivered(user_id, user_email, message_id, sender_id=None):
+    """Mark a message received by the user as delivered and confirm it to its sender."""
+    from Server import outbox
+
+    cnx = get_shard_cnx(user_id, write=True)
+    cursor = cnx.cursor()
+    try:
+        cursor.execute(
+            "UPDATE messages SET is_delivered = TRUE WHERE id = %s AND receiver_email = %s",
+            (message_id, user_email)
+        )
+        # The sender may live on another shard: the confirmation goes through
+        # this shard's outbox and the relay publishes it to the sender's room
+        if sender_id is not None and cursor.rowcount:
+            outbox.enqueue(cursor, 'delivery_confirmation', {
+                "messageId": message_id,
+                "status": "delivered"
+            }, room=sender_id)
+        cnx.commit()
+        outbox.notify()
+    finally:
+        cursor.close()
+        cnx.close()
+
+def get_group_members(group_id):
+    """Map member email -> user id for a group."""
+    cnx = get_db_cnx(read_only=True)
+    cursor = cnx.cursor()
+    try:
+        cursor.execute(
+            """SELECT u.email, u.id
+               FROM group_members gm
+               JOIN users u ON u.id = gm.user_id
+               WHERE gm.group_id = %s""",
+            (group_id,)
+        )
+        return dict(cursor.fetchall())
+    finally:
+        cursor.close()
+        cnx.close()
+
+# auto_increment_increment of each server, read once: pooled connections
+# are handed out in new wrappers, so there is nothing per connection to
+# keep it on, and pool_reset_session puts session variables back to the
+# server's value anyway
+_id_steps = {}
+_id_steps_lock = threading.Lock()
+
+def _auto_increment_step(cnx):
+    key = (cnx.server_host, cnx.server_port)
+    with _id_steps_lock:
+        step = _id_steps.get(key)
+    if step is None:
+        cursor = cnx.cursor()
+        try:
+            cursor.execute("SELECT @@SESSION.auto_increment_increment")
+            step = int(cursor.fetchone()[0])
+        finally:
+            cursor.close()
+        with _id_steps_lock:
+            _id_steps[key] = step
+    return step
+
+def _insert_messages(cnx, rows):
+    """Insert (sender, receiver, content, group_id, spool_id, sent_at) rows in one statement; return their ids.
+
+    `sent_at` is a Unix time, or None for now.
+    """
+    step = _auto_increment_step(cnx)
+    cursor = cnx.cursor()
+    try:
+        # executemany() sends this as one multi-row INSERT. InnoDB reserves
+        # the ids of such an insert in one block, since it knows the row
+        # count up front: they start at lastrowid and go up by the server's
+        # auto_increment_increment
+        cursor.executemany(
+            "INSERT INTO messages (sender_email, receiver_email, content, group_id, spool_id, timestamp)"
+            " VALUES (%s, %s, %s, %s, %s, COALESCE(FROM_UNIXTIME(%s), CURRENT_TIMESTAMP(3)))",
+            rows
+        )
+        if cursor.rowcount != len(rows):
+            raise mysql.connector.errors.DataError(
+                f'Inserted {cursor.rowcount} messages instead of {len(rows)}, cannot tell their ids'
+            )
+        first_id = cursor.lastrowid
+        cnx.commit()
+        return [first_id + i * step for i in range(len(rows))]
+    except Exception:
+        cnx.rollback()
+        raise
+    finally:
+        cursor.close()
+
+def _by_recipient_shard(items, user_id_of):
+    """Group items by the shard of their recipient, refusing recipients being moved."""
+    router = get_router()
+    shards = {}
+    for position, item in enumerate(items):
+        name, moving = router.locate(user_id_of(item))
+        if moving:
+            raise DatabaseUnavailable('Recipient is being moved between shards')
+        shards.setdefault(name, []).append((position, item))
+    return router, shards
+
+def store_group_messages(sender_email, group_id, rows):
+    """Store one (receiver_email, receiver_id, content) row per member.
+
+    Rows are grouped by recipient shard and each group is written with a
+    single INSERT. Returns the new message ids in the same order as `rows`.
+    """
+    if not rows:
+        return []
+    router, shards = _by_recipient_shard(rows, lambda row: row[1])
+    ids = [None] * len(rows)
+    for name, items in shards.items():
+        cnx = router.connect(name)
+        try:
+            new_ids = _insert_messages(cnx, [
+                (sender_email, receiver_email, content, group_id, None, None)
+                for _, (receiver_email, _, content) in items
+            ])
+        finally:
+            cnx.close()
+        for (position, _), message_id in zip(items, new_ids):
+            ids[position] = message_id
+    return ids
+
+HISTORY_MAX_PAGE = 100
+CURSOR_FORMAT = '%Y%m%d%H%M%S%f'
+
+def encode_cursor(ts, msg_id):
+    """History cursor for a message: its timestamp and id, e.g. '20240101120000123000-42'."""
+    return f"{ts.strftime(CURSOR_FORMAT)}-{msg_id}"
+
+def decode_cursor(cursor):
+    """Parse a history cursor into (timestamp, id); raises ValueError if malformed."""
+    stamp, _, msg_id = cursor.partition('-')
+    return datetime.strptime(stamp, CURSOR_FORMAT), int(msg_id)
+
+def get_conversation_page(user_email, contact_email, before=None, after=None, limit=50):
+    """One page of a 1:1 conversation, paged by (timestamp, id) cursors (keyset, no OFFSET).
+
+    With `after` the page goes forward from that cursor, otherwise it goes
+    backwards from `before` (or from the newest message). Rows are returned
+    oldest first either way, each with the cursor pointing at it.
+
+    Ids can't be used for ordering: the two directions live on their
+    recipients' shards, which allocate ids from separate ranges.
+    """
+    limit = max(1, min(int(limit), HISTORY_MAX_PAGE))
+    cmp, order, start = ('>', 'ASC', after) if after is not None else ('<', 'DESC', before)
+    bound, params = '', ()
+    if start is not None:
+        bound_ts, bound_id = decode_cursor(start)
+        bound = f"AND (timestamp {cmp} %s OR (timestamp = %s AND id {cmp} %s))"
+        params = (bound_ts, bound_ts, bound_id)
+
+    # Each direction is a bounded range scan on idx_conversation and lives on
+    # the shard of its recipient; merging the two keeps the page cost
+    # independent of how far back the cursor is
+    query = f"""
+        SELECT id, sender_email, content, timestamp FROM messages
+        WHERE sender_email = %s AND receiver_email = %s AND group_id IS NULL {bound}
+        ORDER BY timestamp {order}, id {order} LIMIT %s
+    """
+    rows = []
+    for sender, receiver in ((user_email, contact_email), (contact_email, user_email)):
+        cnx = get_shard_cnx_for_email(receiver, read_only=True)
+        cursor = cnx.cursor()
+        try:
+            cursor.execute(query, (sender, receiver) + params + (limit,))
+            rows.extend(cursor.fetchall())
+        finally:
+            cursor.close()
+            cnx.close()
+
+    rows.sort(key=lambda row: (row[3], row[0]), reverse=order == 'DESC')
+    rows = rows[:limit]
+    if order == 'DESC':
+        rows.reverse()
+    return [
+        {'id': msg_id, 'out': sender == user_email, 'ts': ts.isoformat(), 'content': content,
+         'cursor': encode_cursor(ts, msg_id)}
+        for msg_id, sender, content, ts in rows
+    ]
+
+def insert_spooled_messages(records):
+    """Insert journaled messages, skipping spool ids already in the table.
+
+    Each message keeps the time it was sent rather than the time it is
+    replayed, so it sorts in its place in the conversation history.
+
+    Returns (record, message_id) pairs for the rows inserted by this call.
+    """
+    receiver_ids = {}
+    for record in records:
+        email = record['receiver_email']
+        if email not in receiver_ids:
+            receiver_ids[email] = get_id_from_email(email)
+            if receiver_ids[email] is None:
+                raise ValueError(f'Unknown recipient {email}')
+
+    router, shards = _by_recipient_shard(records, lambda record: receiver_ids[record['receiver_email']])
+    stored = []
+    for name, items in shards.items():
+        cnx = router.connect(name)
+        cursor = cnx.cursor()
+        try:
+            spool_ids = [record['spool_id'] for _, record in items]
+            placeholders = ', '.join(['%s'] * len(spool_ids))
+            cursor.execute(f"SELECT spool_id FROM messages WHERE spool_id IN ({placeholders})", tuple(spool_ids))
+            existing = {row[0] for row in cursor.fetchall()}
+            new = [record for _, record in items if record['spool_id'] not in existing]
+            if new:
+                new_ids = _insert_messages(cnx, [
+                    (r['sender_email'], r['receiver_email'], r['content'], None, r['spool_id'], r.get('sent_at'))
+                    for r in new
+                ])
+                stored.extend(zip(new, new_ids))
+        finally:
+            cursor.close()
+            cnx.close()
+    return stored
@@ -0,0 +1,39 @@
+-- Schema of a message shard (see DB_SHARD_CONNECTION_STRINGS). Users,
+-- contacts and groups stay on the primary, so the references to them are
+-- not enforced here. After creating a shard, run
+-- `python -m Server.rebalance --init` to give it its message id range.
+
+CREATE TABLE prekeys (
+    id INT AUTO_INCREMENT PRIMARY KEY,
+    user_id INT NOT NULL,
+    prekey_id INT NOT NULL,
+    prekey VARCHAR(255) NOT NULL,
+    used BOOLEAN NOT NULL DEFAULT 0,
+    KEY idx_user (user_id)
+);
+
+-- Rows live on the recipient's shard
+CREATE TABLE messages (
+    id BIGINT AUTO_INCREMENT PRIMARY KEY,
+    sender_email varchar(255) NOT NULL,
+    receiver_email varchar(255) NOT NULL,
+    group_id INT NULL,
+    content TEXT NOT NULL,
+    timestamp TIMESTAMP(3) DEFAULT CURRENT_TIMESTAMP(3),
+    is_delivered BOOLEAN DEFAULT FALSE,
+    is_read BOOLEAN DEFAULT FALSE,
+    spool_id CHAR(32) NULL,
+    UNIQUE KEY unique_spool (spool_id),
+    KEY idx_receiver (receiver_email),
+    KEY idx_conversation (sender_email, receiver_email, group_id, timestamp, id)
+);
+
+CREATE TABLE outbox (
+    id BIGINT AUTO_INCREMENT PRIMARY KEY,
+    event VARCHAR(64) NOT NULL,
+    room VARCHAR(64) NOT NULL,
+    payload TEXT NOT NULL,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    published_at TIMESTAMP NULL DEFAULT NULL,
+    KEY idx_pending (published_at, id)
+);
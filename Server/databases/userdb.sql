@@ -10,7 +10,10 @@ CREATE TABLE users (
     identity_public_key VARCHAR(240) NOT NULL,
     signed_prekey VARCHAR(240) NOT NULL,
     signed_prekey_signature VARCHAR(240) NOT NULL,
-    PRIMARY KEY (id)
+    -- Identifier matched by contact discovery (Server/database.py email_hash)
+    email_hash CHAR(64) AS (SHA2(LOWER(TRIM(email)), 256)) STORED,
+    PRIMARY KEY (id),
+    UNIQUE KEY unique_email_hash (email_hash)
 );
 
 CREATE TABLE contact_requests
@@ -18,7 +21,7 @@ CREATE TABLE contact_requests
     id INT AUTO_INCREMENT PRIMARY KEY,
     requester_id INT NOT NULL,
     recipient_id INT NOT NULL,
-    status ENUM ('pending', 'accepted', 'rejected') DEFAULT 'pending',
+    status ENUM ('pending', 'accepted', 'rejected', 'deleted') DEFAULT 'pending',
     created_at   TIMESTAMP                                DEFAULT CURRENT_TIMESTAMP,
     FOREIGN KEY (requester_id) REFERENCES users (id),
     FOREIGN KEY (recipient_id) REFERENCES users (id),
@@ -34,16 +37,45 @@ CREATE TABLE prekeys (
     FOREIGN KEY (user_id) REFERENCES users(id)
 );
 
-CREATE TABLE messages (
+CREATE TABLE conversation_groups (
     id INT AUTO_INCREMENT PRIMARY KEY,
+    name VARCHAR(255) NOT NULL,
+    created_by INT NOT NULL,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    FOREIGN KEY (created_by) REFERENCES users(id)
+);
+
+CREATE TABLE group_members (
+    group_id INT NOT NULL,
+    user_id INT NOT NULL,
+    joined_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    PRIMARY KEY (group_id, user_id),
+    KEY idx_member_groups (user_id),
+    FOREIGN KEY (group_id) REFERENCES conversation_groups(id) ON DELETE CASCADE,
+    FOREIGN KEY (user_id) REFERENCES users(id)
+);
+
+-- Group messages are stored as one row per recipient (each with its own
+-- ciphertext), so is_delivered / is_read track delivery state per member.
+CREATE TABLE messages (
+    id BIGINT AUTO_INCREMENT PRIMARY KEY,
     sender_email varchar(255) NOT NULL,
     receiver_email varchar(255) NOT NULL,
+    group_id INT NULL,
     content TEXT NOT NULL,
-    timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    timestamp TIMESTAMP(3) DEFAULT CURRENT_TIMESTAMP(3),
     is_delivered BOOLEAN DEFAULT FALSE,
     is_read BOOLEAN DEFAULT FALSE,
+    -- Set on messages replayed from the local spool, makes replay idempotent
+    spool_id CHAR(32) NULL,
+    UNIQUE KEY unique_spool (spool_id),
     FOREIGN KEY (sender_email) REFERENCES users(email),
-    FOREIGN KEY (receiver_email) REFERENCES users(email)
+    FOREIGN KEY (receiver_email) REFERENCES users(email),
+    FOREIGN KEY (group_id) REFERENCES conversation_groups(id) ON DELETE SET NULL,
+    -- One direction of a conversation in time order: serves keyset-paginated
+    -- history and the undelivered-messages lookup without a sort. Ids are not
+    -- time-ordered across shards, so history pages by (timestamp, id)
+    KEY idx_conversation (sender_email, receiver_email, group_id, timestamp, id)
 );
 
 CREATE TABLE x3dh_params (
@@ -58,3 +90,48 @@ CREATE TABLE x3dh_params (
     FOREIGN KEY (recipient_email) REFERENCES users(email),
     UNIQUE KEY unique_request (sender_email(100), recipient_email(100))
 );
+
+-- Socket notifications written in the same transaction as the change they
+-- describe, published by the relay in Server/outbox.py
+CREATE TABLE outbox (
+    id BIGINT AUTO_INCREMENT PRIMARY KEY,
+    event VARCHAR(64) NOT NULL,
+    room VARCHAR(64) NOT NULL,
+    payload TEXT NOT NULL,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    published_at TIMESTAMP NULL DEFAULT NULL,
+    KEY idx_pending (published_at, id)
+);
+
+-- Users moved off the shard the hash ring assigns them (Server/rebalance.py).
+-- While `moving` is set, writes to the user's messages and prekeys are refused.
+CREATE TABLE shard_directory (
+    user_id INT PRIMARY KEY,
+    shard VARCHAR(64) NOT NULL,
+    moving BOOLEAN NOT NULL DEFAULT FALSE,
+    FOREIGN KEY (user_id) REFERENCES users(id)
+);
+
+-- Bumped with every change to shard_directory; workers poll it to drop their
+-- cached directory entries (Server/sharding.py)
+CREATE TABLE shard_directory_version (
+    id TINYINT PRIMARY KEY,
+    version BIGINT NOT NULL
+);
+INSERT INTO shard_directory_version (id, version) VALUES (1, 0);
+
+-- Rotating refresh tokens (Server/refresh_tokens.py); one family per login
+CREATE TABLE refresh_tokens (
+    id BIGINT AUTO_INCREMENT PRIMARY KEY,
+    user_id INT NOT NULL,
+    family CHAR(32) NOT NULL,
+    token_hash CHAR(64) NOT NULL,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    expires_at TIMESTAMP NOT NULL,
+    used_at TIMESTAMP NULL DEFAULT NULL,
+    revoked_at TIMESTAMP NULL DEFAULT NULL,
+    UNIQUE KEY unique_token (token_hash),
+    KEY idx_family (family),
+    KEY idx_expiry (expires_at),
+    FOREIGN KEY (user_id) REFERENCES users(id)
+);
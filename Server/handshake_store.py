@@ -0,0 +1,148 @@
+import json
+import os
+
+from Server import outbox
+from Server.database import get_db_cnx
+from Server.shared_store import get_redis
+
+# X3DH ephemeral parameters are only useful while the recipient sets up the
+# session, so they live in Redis with a short TTL. They are only written to
+# the x3dh_params table when the recipient is offline.
+#
+# Without Redis the table is the only copy: a worker's memory can't be read
+# by the worker serving the recipient's next request, nor be told about a
+# newer handshake for the same pair saved on another worker.
+HANDSHAKE_TTL = int(os.getenv('HANDSHAKE_TTL', 300))
+HANDSHAKE_DB_TTL = int(os.getenv('HANDSHAKE_DB_TTL', 7 * 24 * 3600))
+SWEEP_INTERVAL = 60
+
+
+class RedisHandshakeStore:
+    """Handshakes shared by every worker, expired by Redis itself."""
+
+    def __init__(self, client, ttl=HANDSHAKE_TTL):
+        self.ttl = ttl
+        self._client = client
+
+    @staticmethod
+    def _key(sender_email, recipient_email):
+        return f'x3dh:{sender_email}:{recipient_email}'
+
+    def put(self, sender_email, recipient_email, params):
+        self._client.setex(self._key(sender_email, recipient_email), self.ttl, json.dumps(params))
+
+    def get(self, sender_email, recipient_email):
+        raw = self._client.get(self._key(sender_email, recipient_email))
+        return json.loads(raw) if raw else None
+
+
+_store = None
+
+
+def get_handshake_store():
+    """The shared handshake store, None without Redis."""
+    global _store
+    if _store is None:
+        client = get_redis()
+        if client:
+            _store = RedisHandshakeStore(client)
+    return _store
+
+
+def save_handshake(sender_email, recipient_email, params, persist=False, event=None):
+    """Store handshake parameters; `persist` also writes them behind to the DB.
+
+    Without a shared store they are always persisted. A handshake kept only
+    in the store deletes the pair's row, so the DB fallback can't return an
+    older handshake once the store entry expired.
+
+    When persisting, an optional outbox `event` (name, payload, room) is
+    queued in the same transaction as the write-behind row.
+    """
+    store = get_handshake_store()
+    if store:
+        store.put(sender_email, recipient_email, params)
+    else:
+        persist = True
+
+    cnx = get_db_cnx()
+    cursor = cnx.cursor()
+    try:
+        if persist:
+            cursor.execute(
+                """
+                INSERT INTO x3dh_params (sender_email, recipient_email, ephemeral_key, prekey_id, signed_prekey)
+                VALUES (%s, %s, %s, %s, %s)
+                ON DUPLICATE KEY UPDATE
+                    ephemeral_key = VALUES(ephemeral_key),
+                    prekey_id = VALUES(prekey_id),
+                    signed_prekey = VALUES(signed_prekey),
+                    created_at = CURRENT_TIMESTAMP
+                """,
+                (sender_email, recipient_email, params['ephemeral_key'], params['prekey_id'], params['signed_prekey'])
+            )
+            if event:
+                outbox.enqueue(cursor, *event)
+        else:
+            cursor.execute(
+                "DELETE FROM x3dh_params WHERE sender_email = %s AND recipient_email = %s",
+                (sender_email, recipient_email)
+            )
+        cnx.commit()
+        if persist and event:
+            outbox.notify()
+    finally:
+        cursor.close()
+        cnx.close()
+
+
+def load_handshake(sender_email, recipient_email):
+    """Return handshake parameters from the store, falling back to the DB."""
+    store = get_handshake_store()
+    params = store.get(sender_email, recipient_email) if store else None
+    if params:
+        return params
+
+    cnx = get_db_cnx()
+    cursor = cnx.cursor(dictionary=True)
+    try:
+        cursor.execute(
+            """
+            SELECT ephemeral_key, prekey_id, signed_prekey FROM x3dh_params
+            WHERE sender_email = %s AND recipient_email = %s
+            AND created_at > NOW() - INTERVAL %s SECOND
+            ORDER BY created_at DESC LIMIT 1
+            """,
+            (sender_email, recipient_email, HANDSHAKE_DB_TTL)
+        )
+        return cursor.fetchone()
+    finally:
+        cursor.close()
+        cnx.close()
+
+
+def purge_expired_handshakes():
+    """Drop expired handshakes from the write-behind table; Redis expires its own."""
+    cnx = get_db_cnx()
+    cursor = cnx.cursor()
+    try:
+        cursor.execute(
+            "DELETE FROM x3dh_params WHERE created_at < NOW() - INTERVAL %s SECOND",
+            (HANDSHAKE_DB_TTL,)
+        )
+        cnx.commit()
+    finally:
+        cursor.close()
+        cnx.close()
+
+
+def start_handshake_sweeper(socketio):
+    def sweep():
+        while True:
+            socketio.sleep(SWEEP_INTERVAL)
+            try:
+                purge_expired_handshakes()
+            except Exception as e:
+                print(f"Error purging handshakes: {e}")
+
+    socketio.start_background_task(sweep)
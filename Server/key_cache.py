@@ -0,0 +1,121 @@
+import os
+import threading
+import time
+import uuid
+from collections import OrderedDict
+
+from Server import metrics
+from Server.database import get_db_cnx
+from Server.shared_store import get_redis
+
+# Public key bundles (identity key and signed prekey) change only when a
+# user rotates their signed prekey, so they are cached per worker. Each entry
+# carries the version it was loaded at; rotating bumps the version, in Redis
+# when configured so every worker sees it, which makes the stale entries miss.
+# Without Redis only the worker handling the rotation hears of it, so entries
+# also expire after KEY_CACHE_TTL seconds, which bounds how long the others
+# keep handing out a rotated-away signed prekey. Keys are lower-cased emails.
+MAX_BUNDLES = int(os.getenv('KEY_CACHE_SIZE', 10000))
+KEY_CACHE_TTL = int(os.getenv('KEY_CACHE_TTL', 60))
+
+_boot_id = uuid.uuid4().hex[:8]
+_lock = threading.Lock()
+_versions = {}
+_bundles = OrderedDict()
+
+
+def get_version(email):
+    email = email.lower()
+    client = get_redis()
+    if client:
+        return f"r{int(client.get(f'keys:version:{email}') or 0)}"
+    with _lock:
+        return f'{_boot_id}.{_versions.get(email, 0)}'
+
+
+def bump_version(email):
+    """Invalidate a user's cached bundle on every worker."""
+    email = email.lower()
+    client = get_redis()
+    if client:
+        client.incr(f'keys:version:{email}')
+    with _lock:
+        if not client:
+            _versions[email] = _versions.get(email, 0) + 1
+        _bundles.pop(email, None)
+
+
+def _load(email):
+    # Read from the primary: a lagging replica could hand back the key that
+    # was just rotated away and have it cached under the new version
+    cnx = get_db_cnx()
+    cursor = cnx.cursor(dictionary=True)
+    try:
+        cursor.execute(
+            """
+            SELECT id, identity_public_key, signed_prekey, signed_prekey_signature
+            FROM users WHERE email = %s
+            """,
+            (email,)
+        )
+        return cursor.fetchone()
+    finally:
+        cursor.close()
+        cnx.close()
+
+
+def get_key_bundle(email):
+    """Return a user's id, identity key and signed prekey, or None if unknown."""
+    # The version is read before the row, so a rotation committed in between
+    # leaves the entry already outdated rather than stale under a new version
+    email = email.lower()
+    version = get_version(email)
+    with _lock:
+        cached = _bundles.get(email)
+        if cached and cached[0] == version and cached[2] > time.monotonic():
+            _bundles.move_to_end(email)
+            metrics.incr('key_cache.hit')
+            return cached[1]
+
+    metrics.incr('key_cache.miss')
+    bundle = _load(email)
+    if bundle:
+        with _lock:
+            _bundles[email] = (version, bundle, time.monotonic() + KEY_CACHE_TTL)
+            _bundles.move_to_end(email)
+            while len(_bundles) > MAX_BUNDLES:
+                _bundles.popitem(last=False)
+    return bundle
+
+
+def prime(emails):
+    """Load the bundles of the given users in one query; return how many were cached."""
+    emails = [email.lower() for email in emails if email]
+    if not emails:
+        return 0
+    # Same ordering as get_key_bundle: versions first, then the rows
+    versions = {email: get_version(email) for email in emails}
+    cnx = get_db_cnx()
+    cursor = cnx.cursor(dictionary=True)
+    try:
+        cursor.execute(
+            f"""
+            SELECT email, id, identity_public_key, signed_prekey, signed_prekey_signature
+            FROM users WHERE email IN ({', '.join(['%s'] * len(emails))})
+            """,
+            emails
+        )
+        rows = cursor.fetchall()
+    finally:
+        cursor.close()
+        cnx.close()
+
+    expires_at = time.monotonic() + KEY_CACHE_TTL
+    with _lock:
+        for row in rows[:MAX_BUNDLES]:
+            email = row.pop('email').lower()
+            if email in versions and email not in _bundles:
+                _bundles[email] = (versions[email], row, expires_at)
+        while len(_bundles) > MAX_BUNDLES:
+            _bundles.popitem(last=False)
+    return len(rows)
@@ -0,0 +1,25 @@
+import threading
+from collections import Counter
+
+# In-process counters and gauges, keyed by dotted metric name
+_lock = threading.Lock()
+_counters = Counter()
+_gauges = {}
+
+
+def incr(name, value=1):
+    """Increment a counter."""
+    with _lock:
+        _counters[name] += value
+
+
+def set_gauge(name, value):
+    """Set a gauge to its current value."""
+    with _lock:
+        _gauges[name] = value
+
+
+def snapshot():
+    """Return a copy of every counter and gauge."""
+    with _lock:
+        return {'counters': dict(_counters), 'gauges': dict(_gauges)}
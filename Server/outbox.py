@@ -0,0 +1,117 @@
+import json
+import os
+import threading
+
+from Server import metrics
+from Server.database import get_db_cnx
+from Server.sharding import get_router
+
+# Transactional outbox for socket notifications.
+#
+# Handlers write the notification with enqueue() using the same cursor (and
+# so the same transaction) as the state change it describes, then call
+# notify() after committing. The relay publishes pending rows through
+# Socket.IO, which goes over the message queue to every worker when one is
+# configured, and marks them published. Delivery is at-least-once: a crash
+# between emitting and marking can publish a batch twice.
+RELAY_BATCH = int(os.getenv('OUTBOX_RELAY_BATCH', 100))
+POLL_INTERVAL = float(os.getenv('OUTBOX_POLL_INTERVAL', 1.0))
+RETENTION_SECONDS = int(os.getenv('OUTBOX_RETENTION', 24 * 3600))
+
+_wakeup = threading.Event()
+
+
+def enqueue(cursor, event, payload, room):
+    """Queue a Socket.IO event inside the caller's transaction."""
+    cursor.execute(
+        "INSERT INTO outbox (event, room, payload) VALUES (%s, %s, %s)",
+        (event, str(room), json.dumps(payload))
+    )
+
+
+def notify():
+    """Wake the relay after a commit instead of waiting for its next poll."""
+    _wakeup.set()
+
+
+def _outbox_databases():
+    """Connect functions for every database holding an outbox: the primary and each shard."""
+    router = get_router()
+    return [get_db_cnx] + [
+        (lambda name=name: router.connect(name)) for name, dsn in router.shards.items() if dsn
+    ]
+
+
+def relay_batch(emit, connect=get_db_cnx):
+    """Publish one batch of pending events; returns how many were published."""
+    cnx = connect()
+    cursor = cnx.cursor()
+    try:
+        # SKIP LOCKED lets the relays of several workers share the table
+        cursor.execute(
+            """SELECT id, event, room, payload FROM outbox
+               WHERE published_at IS NULL
+               ORDER BY id LIMIT %s
+               FOR UPDATE SKIP LOCKED""",
+            (RELAY_BATCH,)
+        )
+        rows = cursor.fetchall()
+        for _, event, room, payload in rows:
+            emit(event, json.loads(payload), room=room)
+
+        if rows:
+            placeholders = ', '.join(['%s'] * len(rows))
+            cursor.execute(
+                f"UPDATE outbox SET published_at = CURRENT_TIMESTAMP WHERE id IN ({placeholders})",
+                tuple(row[0] for row in rows)
+            )
+        cnx.commit()
+        metrics.incr('outbox.published', len(rows))
+        return len(rows)
+    except Exception:
+        cnx.rollback()
+        raise
+    finally:
+        cursor.close()
+        cnx.close()
+
+
+def purge_published(connect=get_db_cnx):
+    cnx = connect()
+    cursor = cnx.cursor()
+    try:
+        cursor.execute(
+            "DELETE FROM outbox WHERE published_at < NOW() - INTERVAL %s SECOND LIMIT 10000",
+            (RETENTION_SECONDS,)
+        )
+        cnx.commit()
+    finally:
+        cursor.close()
+        cnx.close()
+
+
+def start_relay(socketio):
+    def run():
+        idle_polls = 0
+        while True:
+            busy = False
+            for connect in _outbox_databases():
+                try:
+                    busy |= relay_batch(socketio.emit, connect) == RELAY_BATCH
+                    if idle_polls * POLL_INTERVAL >= 3600:
+                        purge_published(connect)
+                except Exception as e:
+                    print(f"Outbox relay error: {e}")
+            if busy:
+                continue
+            idle_polls = 0 if idle_polls * POLL_INTERVAL >= 3600 else idle_polls + 1
+
+            # Sleep until notify() or the next poll, in small steps so this
+            # also works under eventlet/gevent
+            waited = 0
+            while not _wakeup.is_set() and waited < POLL_INTERVAL:
+                socketio.sleep(0.02)
+                waited += 0.02
+            _wakeup.clear()
+
+    socketio.start_background_task(run)
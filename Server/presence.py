@@ -0,0 +1,232 @@
+import os
+import threading
+import time
+import uuid
+from collections import OrderedDict
+
+from Server import metrics
+from Server.contact_cache import get_contact_set
+from Server.shared_store import get_redis
+
+# Typing indicators and online/offline presence, coalesced before they are
+# sent. Updates are queued per recipient, last value wins, and a flush every
+# PRESENCE_INTERVAL sends each recipient at most one 'presence' event holding
+# everything queued for them. A flush sends at most PRESENCE_MAX_EMITS per
+# second worth of events; whatever is left waits for the next one.
+#
+# Going offline is only published after PRESENCE_OFFLINE_GRACE seconds, so a
+# client that drops and reconnects in the meantime is never shown offline.
+# Both kinds of update only go to accepted contacts.
+#
+# With Redis, connections are counted per worker, and each worker refreshes
+# a heartbeat key every WORKER_TTL / 3 seconds. Counts held by a worker
+# whose heartbeat expired are ignored, and the next live worker to notice
+# drops them and publishes the users it had connected as offline. A worker
+# that finds its own heartbeat gone publishes its connections again.
+INTERVAL = float(os.getenv('PRESENCE_INTERVAL', 0.5))
+OFFLINE_GRACE = float(os.getenv('PRESENCE_OFFLINE_GRACE', 5))
+MAX_EMITS_PER_SECOND = int(os.getenv('PRESENCE_MAX_EMITS', 500))
+WORKER_TTL = int(os.getenv('PRESENCE_WORKER_TTL', 30))
+
+
+class PresenceTracker:
+    """Connection counts and published presence, shared through Redis when configured."""
+
+    def __init__(self, client=None):
+        self._client = client
+        self.worker_id = uuid.uuid4().hex
+        self._lock = threading.Lock()
+        # Held while a count changes here and in Redis, so both agree
+        self._connections_lock = threading.Lock()
+        # user id -> (connections on this worker, email)
+        self._connections = {}
+        self._online = set()
+        # user id -> (email, time the state should be published)
+        self._pending = {}
+        # recipient id -> {'online': {email: bool}, 'typing': {email: bool}}
+        self._outgoing = OrderedDict()
+
+    def _adjust_connections(self, user_id, email, delta):
+        with self._connections_lock:
+            count = self._connections.get(user_id, (0, email))[0] + delta
+            if count > 0:
+                self._connections[user_id] = (count, email)
+            else:
+                self._connections.pop(user_id, None)
+            if self._client:
+                self._share_connections(user_id, email, count)
+
+    def _share_connections(self, user_id, email, count):
+        # presence:connections:<user> holds a count per worker, and
+        # presence:users:<worker> the users a worker has connected
+        if count > 0:
+            self._client.hset(f'presence:connections:{user_id}', self.worker_id, count)
+            self._client.hset(f'presence:users:{self.worker_id}', user_id, email)
+        else:
+            self._client.hdel(f'presence:connections:{user_id}', self.worker_id)
+            self._client.hdel(f'presence:users:{self.worker_id}', user_id)
+
+    def _is_connected(self, user_id):
+        if self._client:
+            workers = [worker.decode() for worker, count in self._client.hgetall(f'presence:connections:{user_id}').items()
+                       if int(count) > 0]
+            return any(self._client.exists(f'presence:worker:{worker}') for worker in workers)
+        with self._connections_lock:
+            return user_id in self._connections
+
+    def heartbeat(self):
+        """Keep this worker's connections counted; settle those of workers that stopped."""
+        if not self._client:
+            return
+        if not self._client.expire(f'presence:worker:{self.worker_id}', WORKER_TTL):
+            # First beat, or a missed one got our connections dropped by
+            # another worker: publish them again
+            self._client.set(f'presence:worker:{self.worker_id}', 1, ex=WORKER_TTL)
+            now = time.monotonic()
+            with self._connections_lock:
+                for user_id, (count, email) in self._connections.items():
+                    self._share_connections(user_id, email, count)
+                    with self._lock:
+                        self._pending[user_id] = (email, now)
+        self._client.sadd('presence:workers', self.worker_id)
+
+        for worker in self._client.smembers('presence:workers'):
+            worker = worker.decode()
+            if worker == self.worker_id or self._client.exists(f'presence:worker:{worker}'):
+                continue
+            users = self._client.hgetall(f'presence:users:{worker}')
+            now = time.monotonic()
+            for user_id, email in users.items():
+                user_id = user_id.decode()
+                self._client.hdel(f'presence:connections:{user_id}', worker)
+                with self._lock:
+                    self._pending[user_id] = (email.decode(), now)
+            self._client.delete(f'presence:users:{worker}')
+            self._client.srem('presence:workers', worker)
+            metrics.incr('presence.workers_expired')
+            print(f"Presence: worker {worker} stopped, settling {len(users)} users")
+
+    def _publish_state(self, user_id, online):
+        """Record the published state; False if it already was (maybe by another worker)."""
+        if self._client:
+            if online:
+                return bool(self._client.sadd('presence:online', user_id))
+            return bool(self._client.srem('presence:online', user_id))
+        with self._lock:
+            if (user_id in self._online) == online:
+                return False
+            if online:
+                self._online.add(user_id)
+            else:
+                self._online.discard(user_id)
+            return True
+
+    def online_among(self, user_ids):
+        """Return the subset of `user_ids` currently shown as online."""
+        if not user_ids:
+            return set()
+        if self._client:
+            flags = self._client.smismember('presence:online', list(user_ids))
+            return {user_id for user_id, flag in zip(user_ids, flags) if flag}
+        with self._lock:
+            return self._online.intersection(user_ids)
+
+    def connected(self, user_id, email):
+        self._adjust_connections(str(user_id), email, 1)
+        with self._lock:
+            self._pending[str(user_id)] = (email, time.monotonic())
+
+    def disconnected(self, user_id, email):
+        self._adjust_connections(str(user_id), email, -1)
+        with self._lock:
+            self._pending[str(user_id)] = (email, time.monotonic() + OFFLINE_GRACE)
+
+    def _queue(self, recipient_id, kind, email, value):
+        # Caller holds the lock
+        updates = self._outgoing.get(recipient_id)
+        if updates is None:
+            updates = self._outgoing[recipient_id] = {'online': {}, 'typing': {}}
+        updates[kind][email] = value
+
+    def typing(self, user_id, email, contact_email, is_typing):
+        """Queue a typing update for a contact; ignored if they are not an accepted contact."""
+        contact_id = get_contact_set(user_id).get(contact_email)
+        if contact_id is None:
+            return False
+        with self._lock:
+            self._queue(str(contact_id), 'typing', email, bool(is_typing))
+        return True
+
+    def _settle(self):
+        """Turn due connection changes into queued presence updates."""
+        now = time.monotonic()
+        with self._lock:
+            due = [(user_id, email) for user_id, (email, at) in self._pending.items() if at <= now]
+            for user_id, _ in due:
+                del self._pending[user_id]
+
+        for user_id, email in due:
+            try:
+                contacts = {str(contact_id): contact_email for contact_email, contact_id in get_contact_set(user_id).items()}
+                online = self._is_connected(user_id)
+                if not self._publish_state(user_id, online):
+                    continue
+                online_contacts = self.online_among(list(contacts))
+            except Exception as e:
+                print(f"Error settling presence of user {user_id}: {e}")
+                continue
+            with self._lock:
+                for contact_id in online_contacts:
+                    self._queue(contact_id, 'online', email, online)
+                    if online:
+                        # Someone coming online also needs their contacts' state
+                        self._queue(user_id, 'online', contacts[contact_id], True)
+            metrics.incr('presence.changes')
+
+    def flush(self, emit, budget):
+        """Send up to `budget` queued 'presence' events; return how many were sent."""
+        self._settle()
+        with self._lock:
+            batch = []
+            while self._outgoing and len(batch) < budget:
+                batch.append(self._outgoing.popitem(last=False))
+            backlog = len(self._outgoing)
+
+        for recipient_id, updates in batch:
+            emit('presence', updates, room=recipient_id)
+        metrics.incr('presence.emits', len(batch))
+        metrics.set_gauge('presence.backlog', backlog)
+        return len(batch)
+
+
+_tracker = None
+
+
+def get_tracker():
+    global _tracker
+    if _tracker is None:
+        _tracker = PresenceTracker(get_redis())
+    return _tracker
+
+
+def start_presence_flusher(socketio):
+    tracker = get_tracker()
+    budget = max(1, int(MAX_EMITS_PER_SECOND * INTERVAL))
+
+    def run():
+        last_heartbeat = None
+        while True:
+            now = time.monotonic()
+            if last_heartbeat is None or now - last_heartbeat >= WORKER_TTL / 3:
+                try:
+                    tracker.heartbeat()
+                    last_heartbeat = now
+                except Exception as e:
+                    print(f"Presence heartbeat error: {e}")
+            socketio.sleep(INTERVAL)
+            try:
+                tracker.flush(socketio.emit, budget)
+            except Exception as e:
+                print(f"Presence flush error: {e}")
+
+    socketio.start_background_task(run)
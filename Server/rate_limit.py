@@ -0,0 +1,179 @@
+import math
+import os
+import threading
+import time
+from collections import OrderedDict
+from functools import wraps
+
+from flask import request, jsonify
+from flask_jwt_extended import get_jwt_identity
+from flask_socketio import emit
+
+from Server import metrics, socket_auth
+from Server.shared_store import get_redis
+
+# Default budgets as (capacity, period in seconds). A client may burst up to
+# `capacity` calls, then is refilled at capacity/period tokens per second.
+DEFAULT_BUDGETS = {
+    'send_message': (30, 10),
+    'send_group_message': (10, 10),
+    'groups': (10, 60),
+    'load_undelivered_messages': (10, 10),
+    'ratchet_response': (30, 10),
+    # The page only sends typing state changes
+    'typing': (20, 10),
+    'keys': (10, 60),
+    # One-time prekeys claimed from one user, whoever the callers are
+    'keys_target': (20, 3600),
+    'signed_prekey': (5, 3600),
+    'history': (60, 60),
+    # Counted per identifier looked up, not per request
+    'discover': (20000, 86400),
+}
+FALLBACK_BUDGET = (60, 60)
+
+
+def parse_budgets(spec):
+    """Parse 'name=capacity/period,...' (e.g. 'keys=5/60') into a budget dict."""
+    budgets = {}
+    for item in filter(None, (part.strip() for part in (spec or '').split(','))):
+        name, _, value = item.partition('=')
+        capacity, _, period = value.partition('/')
+        budgets[name.strip()] = (int(capacity), float(period or 1))
+    return budgets
+
+
+class MemoryBackend:
+    """Token buckets held in the local process (one worker).
+
+    Kept in least-recently-used order and capped at MAX_BUCKETS: the bucket
+    dropped is the one idle the longest, which has usually refilled anyway.
+    """
+
+    MAX_BUCKETS = 10000
+
+    def __init__(self):
+        self._buckets = OrderedDict()
+        self._lock = threading.Lock()
+
+    def consume(self, key, capacity, rate, cost=1):
+        now = time.monotonic()
+        with self._lock:
+            tokens, last, _, _ = self._buckets.get(key, (capacity, now, capacity, rate))
+            tokens = min(capacity, tokens + (now - last) * rate)
+            allowed = tokens >= cost
+            if allowed:
+                tokens -= cost
+            self._buckets[key] = (tokens, now, capacity, rate)
+            self._buckets.move_to_end(key)
+            while len(self._buckets) > self.MAX_BUCKETS:
+                self._buckets.popitem(last=False)
+        return allowed, 0 if allowed else (cost - tokens) / rate
+
+
+class RedisBackend:
+    """Token buckets shared by every worker through Redis."""
+
+    SCRIPT = """
+    local capacity = tonumber(ARGV[1])
+    local rate = tonumber(ARGV[2])
+    local cost = tonumber(ARGV[3])
+    local t = redis.call('TIME')
+    local now = tonumber(t[1]) + tonumber(t[2]) / 1000000
+    local state = redis.call('HMGET', KEYS[1], 'tokens', 'ts')
+    local tokens = tonumber(state[1]) or capacity
+    local last = tonumber(state[2]) or now
+    tokens = math.min(capacity, tokens + (now - last) * rate)
+    local allowed = 0
+    if tokens >= cost then
+        tokens = tokens - cost
+        allowed = 1
+    end
+    redis.call('HSET', KEYS[1], 'tokens', tostring(tokens), 'ts', tostring(now))
+    redis.call('PEXPIRE', KEYS[1], math.ceil(capacity / rate * 1000))
+    return {allowed, tostring(tokens)}
+    """
+
+    def __init__(self, client):
+        self._script = client.register_script(self.SCRIPT)
+
+    def consume(self, key, capacity, rate, cost=1):
+        allowed, tokens = self._script(keys=[f'ratelimit:{key}'], args=[capacity, rate, cost])
+        tokens = float(tokens)
+        return bool(allowed), 0 if allowed else (cost - tokens) / rate
+
+
+class RateLimiter:
+    """Token-bucket limiter keyed by (bucket name, user)."""
+
+    def __init__(self, backend=None, budgets=None):
+        self._backend = backend
+        self.budgets = dict(DEFAULT_BUDGETS)
+        self.budgets.update(budgets if budgets is not None else parse_budgets(os.getenv('RATE_LIMITS')))
+
+    @property
+    def backend(self):
+        if self._backend is None:
+            client = get_redis()
+            self._backend = RedisBackend(client) if client else MemoryBackend()
+        return self._backend
+
+    def hit(self, name, user, cost=1):
+        """Consume `cost` tokens; return (allowed, seconds until there are enough)."""
+        capacity, period = self.budgets.get(name, FALLBACK_BUDGET)
+        try:
+            allowed, retry_after = self.backend.consume(f'{name}:{user}', capacity, capacity / period, cost)
+        except Exception as e:
+            # Never turn a limiter outage into an application outage
+            print(f"Rate limiter error: {e}")
+            return True, 0
+
+        if not allowed:
+            metrics.incr(f'rate_limited.{name}')
+        return allowed, math.ceil(retry_after)
+
+
+limiter = RateLimiter()
+
+
+def _socket_user():
+    user = socket_auth.identity(request.sid, allow_expired=True)
+    return user[0] if user else request.sid
+
+
+def _http_user():
+    return get_jwt_identity() or request.remote_addr
+
+
+def too_many_requests(retry_after):
+    resp = jsonify({'status': 'error', 'message': 'Too many requests', 'retry_after': retry_after})
+    resp.status_code = 429
+    resp.headers['Retry-After'] = str(retry_after)
+    return resp
+
+
+def limit_event(name):
+    """Rate limit a Socket.IO handler; rejected calls get a `rate_limited` event."""
+    def decorator(f):
+        @wraps(f)
+        def wrapper(*args, **kwargs):
+            allowed, retry_after = limiter.hit(name, _socket_user())
+            if not allowed:
+                emit('rate_limited', {'error': 'rate_limited', 'event': name, 'retry_after': retry_after})
+                return None
+            return f(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def limit_route(name):
+    """Rate limit an HTTP view; rejected calls get a 429 with Retry-After."""
+    def decorator(f):
+        @wraps(f)
+        def wrapper(*args, **kwargs):
+            allowed, retry_after = limiter.hit(name, _http_user())
+            if not allowed:
+                return too_many_requests(retry_after)
+            return f(*args, **kwargs)
+        return wrapper
+    return decorator
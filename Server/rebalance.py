@@ -0,0 +1,211 @@
+import argparse
+import time
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+from Server.database import get_db_cnx  # noqa: E402
+from Server.sharding import get_router, bump_directory_version, DIRECTORY_REFRESH  # noqa: E402
+
+# Moves users between message shards, e.g. after adding a shard to
+# DB_SHARD_CONNECTION_STRINGS:
+#
+#   python -m Server.rebalance --init            give each shard its id range
+#   python -m Server.rebalance --all             move users to their ring shard
+#   python -m Server.rebalance --to shard2 12 13 move given user ids
+#
+# A batch is moved in three steps. It is first marked as moving, which makes
+# every worker refuse writes for those users (send_message spools them
+# meanwhile) once they have seen the directory version change. The rows are then copied to
+# the new shard, the directory switched over, and only after every worker
+# has picked up the switch are the rows deleted from the old shard.
+BATCH_SIZE = 100
+
+
+def _settle():
+    time.sleep(DIRECTORY_REFRESH + 1)
+
+
+def init_shards(router):
+    """Start each shard's message ids at the floor of its range."""
+    for name in router.shards:
+        cnx = router.connect(name)
+        cursor = cnx.cursor()
+        try:
+            cursor.execute("SELECT COALESCE(MAX(id), 0) FROM messages")
+            next_id = max(cursor.fetchone()[0] + 1, router.id_floor(name))
+            cursor.execute(f"ALTER TABLE messages AUTO_INCREMENT = {int(next_id)}")
+            print(f"{name}: message ids start at {next_id}")
+        finally:
+            cursor.close()
+            cnx.close()
+
+
+def _set_directory(users, shard, moving):
+    cnx = get_db_cnx()
+    cursor = cnx.cursor()
+    try:
+        cursor.executemany(
+            """
+            INSERT INTO shard_directory (user_id, shard, moving) VALUES (%s, %s, %s)
+            ON DUPLICATE KEY UPDATE shard = VALUES(shard), moving = VALUES(moving)
+            """,
+            [(user_id, shard, moving) for user_id, _ in users]
+        )
+        bump_directory_version(cursor)
+        cnx.commit()
+    finally:
+        cursor.close()
+        cnx.close()
+
+
+def _copy(router, users, source, target):
+    emails = [email for _, email in users]
+    user_ids = [user_id for user_id, _ in users]
+    src = router.connect(source)
+    dst = router.connect(target)
+    src_cursor = src.cursor()
+    dst_cursor = dst.cursor()
+    try:
+        placeholders = ', '.join(['%s'] * len(users))
+        src_cursor.execute(
+            f"""SELECT id, sender_email, receiver_email, group_id, content, timestamp,
+                       is_delivered, is_read, spool_id
+                FROM messages WHERE receiver_email IN ({placeholders})""",
+            tuple(emails)
+        )
+        messages = src_cursor.fetchall()
+        # Ids are kept: they are unique across shards and clients page by them
+        dst_cursor.executemany(
+            """
+            INSERT INTO messages (id, sender_email, receiver_email, group_id, content, timestamp,
+                                  is_delivered, is_read, spool_id)
+            VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s)
+            ON DUPLICATE KEY UPDATE is_delivered = VALUES(is_delivered), is_read = VALUES(is_read)
+            """,
+            messages
+        )
+
+        src_cursor.execute(
+            f"SELECT user_id, prekey_id, prekey, used FROM prekeys WHERE user_id IN ({placeholders})",
+            tuple(user_ids)
+        )
+        prekeys = src_cursor.fetchall()
+        # A retried move must not duplicate prekeys copied by the failed attempt
+        dst_cursor.execute(f"DELETE FROM prekeys WHERE user_id IN ({placeholders})", tuple(user_ids))
+        dst_cursor.executemany(
+            "INSERT INTO prekeys (user_id, prekey_id, prekey, used) VALUES (%s, %s, %s, %s)",
+            prekeys
+        )
+        dst.commit()
+        return len(messages), len(prekeys)
+    except Exception:
+        dst.rollback()
+        raise
+    finally:
+        src_cursor.close()
+        dst_cursor.close()
+        src.close()
+        dst.close()
+
+
+def _delete(router, users, shard):
+    placeholders = ', '.join(['%s'] * len(users))
+    cnx = router.connect(shard)
+    cursor = cnx.cursor()
+    try:
+        cursor.execute(
+            f"DELETE FROM messages WHERE receiver_email IN ({placeholders})",
+            tuple(email for _, email in users)
+        )
+        cursor.execute(
+            f"DELETE FROM prekeys WHERE user_id IN ({placeholders})",
+            tuple(user_id for user_id, _ in users)
+        )
+        cnx.commit()
+    finally:
+        cursor.close()
+        cnx.close()
+
+
+def move_batch(router, users, source, target):
+    """Move (user_id, email) pairs from one shard to another."""
+    _set_directory(users, source, True)
+    _settle()
+    try:
+        copied = _copy(router, users, source, target)
+    except Exception:
+        # Leave the users where they were, writable again
+        _set_directory(users, source, False)
+        raise
+    _set_directory(users, target, False)
+    _settle()
+    _delete(router, users, source)
+    print(f"Moved {len(users)} users from {source} to {target} ({copied[0]} messages, {copied[1]} prekeys)")
+
+
+def _load_users(user_ids=None):
+    cnx = get_db_cnx()
+    cursor = cnx.cursor()
+    try:
+        if user_ids:
+            placeholders = ', '.join(['%s'] * len(user_ids))
+            cursor.execute(f"SELECT id, email FROM users WHERE id IN ({placeholders})", tuple(user_ids))
+        else:
+            cursor.execute("SELECT id, email FROM users ORDER BY id")
+        return cursor.fetchall()
+    finally:
+        cursor.close()
+        cnx.close()
+
+
+def _load_directory():
+    # One scan rather than a lookup per user: this runs offline, over every user
+    cnx = get_db_cnx()
+    cursor = cnx.cursor()
+    try:
+        cursor.execute("SELECT user_id, shard FROM shard_directory")
+        return dict(cursor.fetchall())
+    finally:
+        cursor.close()
+        cnx.close()
+
+
+def plan_moves(router, users, target=None):
+    """Group users by (current shard, destination), skipping those already in place."""
+    directory = _load_directory() if router.sharded else {}
+    moves = {}
+    for user_id, email in users:
+        current = directory.get(user_id) or router.ring.lookup(user_id)
+        destination = target or router.ring.lookup(user_id)
+        if current != destination:
+            moves.setdefault((current, destination), []).append((user_id, email))
+    return moves
+
+
+def rebalance(router, users, target=None):
+    for (source, destination), batch_users in plan_moves(router, users, target).items():
+        for start in range(0, len(batch_users), BATCH_SIZE):
+            move_batch(router, batch_users[start:start + BATCH_SIZE], source, destination)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Move users between message shards')
+    parser.add_argument('--init', action='store_true', help='set each shard\'s message id range')
+    parser.add_argument('--all', action='store_true', help='move every user to the shard the ring assigns them')
+    parser.add_argument('--to', help='shard to move the given users to')
+    parser.add_argument('user_ids', nargs='*', type=int)
+    args = parser.parse_args()
+
+    router = get_router()
+    if args.init:
+        init_shards(router)
+    if args.to and args.to not in router.shards:
+        parser.error(f'Unknown shard {args.to}')
+    if args.all or args.user_ids:
+        rebalance(router, _load_users(args.user_ids), args.to)
+
+
+if __name__ == '__main__':
+    main()
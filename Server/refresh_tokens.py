@@ -0,0 +1,155 @@
+import hashlib
+import os
+import secrets
+
+from Server import metrics
+from Server.database import get_db_cnx
+
+# Rotating refresh tokens. Logging in starts a session (a token family);
+# every refresh trades the presented token for a new one in the same family.
+# Tokens are random, so the database only keeps their SHA-256: no slow hash
+# is needed, and a leaked table gives nothing that can be presented.
+#
+# Presenting a token that was already traded in means it was copied, so the
+# whole family is revoked, except within REUSE_GRACE seconds of the trade,
+# which is only two tabs refreshing at the same time.
+REFRESH_TOKEN_TTL = int(os.getenv('REFRESH_TOKEN_TTL', 14 * 24 * 3600))
+REUSE_GRACE = int(os.getenv('REFRESH_REUSE_GRACE', 10))
+
+
+class RefreshRaced(Exception):
+    """The token was traded in moments ago by a concurrent refresh (another tab).
+
+    The session is fine: the caller should retry with the cookie the other
+    refresh set, not end the session.
+    """
+
+
+def _digest(token):
+    return hashlib.sha256(token.encode()).hexdigest()
+
+
+def _insert(cursor, user_id, family):
+    token = secrets.token_urlsafe(32)
+    cursor.execute(
+        """
+        INSERT INTO refresh_tokens (user_id, family, token_hash, expires_at)
+        VALUES (%s, %s, %s, NOW() + INTERVAL %s SECOND)
+        """,
+        (user_id, family, _digest(token), REFRESH_TOKEN_TTL)
+    )
+    return token
+
+
+def issue(user_id):
+    """Start a new session for a user; return its first refresh token."""
+    cnx = get_db_cnx()
+    cursor = cnx.cursor()
+    try:
+        token = _insert(cursor, user_id, secrets.token_hex(16))
+        cnx.commit()
+        return token
+    finally:
+        cursor.close()
+        cnx.close()
+
+
+def rotate(token):
+    """Trade a refresh token for a new one.
+
+    Returns (user_id, email, new_token), or None if the token is unknown,
+    expired, revoked or reused. Raises RefreshRaced if it was traded in
+    within the last REUSE_GRACE seconds.
+    """
+    if not token:
+        return None
+    cnx = get_db_cnx()
+    cursor = cnx.cursor(dictionary=True)
+    try:
+        cursor.execute(
+            """
+            SELECT t.id, t.user_id, t.family, u.email,
+                   t.expires_at < NOW() AS expired,
+                   t.revoked_at IS NOT NULL AS revoked,
+                   t.used_at IS NOT NULL AS used,
+                   t.used_at > NOW() - INTERVAL %s SECOND AS recently_used
+            FROM refresh_tokens t JOIN users u ON u.id = t.user_id
+            WHERE t.token_hash = %s
+            FOR UPDATE OF t
+            """,
+            (REUSE_GRACE, _digest(token))
+        )
+        row = cursor.fetchone()
+        if not row or row['expired'] or row['revoked']:
+            cnx.rollback()
+            return None
+        if row['used']:
+            if not row['recently_used']:
+                cursor.execute(
+                    "UPDATE refresh_tokens SET revoked_at = NOW() WHERE family = %s AND revoked_at IS NULL",
+                    (row['family'],)
+                )
+                cnx.commit()
+                metrics.incr('auth.refresh_reuse')
+                print(f"Refresh token reuse for user {row['user_id']}, session revoked")
+                return None
+            cnx.rollback()
+            metrics.incr('auth.refresh_raced')
+            raise RefreshRaced()
+
+        cursor.execute("UPDATE refresh_tokens SET used_at = NOW() WHERE id = %s", (row['id'],))
+        new_token = _insert(cursor, row['user_id'], row['family'])
+        cnx.commit()
+        metrics.incr('auth.refresh')
+        return row['user_id'], row['email'], new_token
+    except Exception:
+        cnx.rollback()
+        raise
+    finally:
+        cursor.close()
+        cnx.close()
+
+
+def revoke(token):
+    """Revoke the session a refresh token belongs to (logout)."""
+    if not token:
+        return
+    cnx = get_db_cnx()
+    cursor = cnx.cursor()
+    try:
+        cursor.execute(
+            """
+            UPDATE refresh_tokens t
+            JOIN refresh_tokens presented ON presented.family = t.family
+            SET t.revoked_at = NOW()
+            WHERE presented.token_hash = %s AND t.revoked_at IS NULL
+            """,
+            (_digest(token),)
+        )
+        cnx.commit()
+    finally:
+        cursor.close()
+        cnx.close()
+
+
+def purge_expired():
+    cnx = get_db_cnx()
+    cursor = cnx.cursor()
+    try:
+        cursor.execute("DELETE FROM refresh_tokens WHERE expires_at < NOW() LIMIT 10000")
+        cnx.commit()
+    finally:
+        cursor.close()
+        cnx.close()
+
+
+def start_token_sweeper(socketio):
+    def sweep():
+        while True:
+            socketio.sleep(3600)
+            try:
+                purge_expired()
+            except Exception as e:
+                print(f"Error purging refresh tokens: {e}")
+
+    socketio.start_background_task(sweep)
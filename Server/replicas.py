@@ -0,0 +1,133 @@
+import itertools
+import os
+import threading
+import time
+
+from Server import metrics
+from Server.shared_store import get_redis
+
+# Read replicas, given as a comma-separated list of connection strings in the
+# same format as DB_CONNECTION_STRING. Only reads that ask for it
+# (get_db_cnx(read_only=True)) are routed here.
+REPLICA_MAX_LAG = int(os.getenv('DB_REPLICA_MAX_LAG', 5))
+CHECK_INTERVAL = int(os.getenv('DB_REPLICA_CHECK_INTERVAL', 5))
+# How long a user's reads stay on the primary after they wrote something
+PIN_SECONDS = int(os.getenv('DB_PIN_SECONDS', 5))
+
+
+class ReplicaPool:
+
+    def __init__(self, conn_strings):
+        self.replicas = [{'dsn': dsn, 'healthy': True, 'lag': None} for dsn in conn_strings]
+        self._counter = itertools.count()
+        self._lock = threading.Lock()
+
+    def pick(self):
+        """Round-robin over healthy replicas; None when there is none."""
+        with self._lock:
+            healthy = [replica for replica in self.replicas if replica['healthy']]
+            if not healthy:
+                return None
+            return healthy[next(self._counter) % len(healthy)]
+
+    def mark_down(self, replica):
+        with self._lock:
+            replica['healthy'] = False
+        self._update_gauges()
+
+    def check(self, connect):
+        """Probe every replica, excluding those unreachable or lagging too far behind."""
+        for index, replica in enumerate(self.replicas):
+            try:
+                cnx = connect(replica['dsn'])
+                try:
+                    lag = _replication_lag(cnx)
+                finally:
+                    cnx.close()
+                healthy = lag is None or lag <= REPLICA_MAX_LAG
+            except Exception as e:
+                print(f"Replica {index} health check failed: {e}")
+                lag, healthy = None, False
+
+            with self._lock:
+                replica['healthy'], replica['lag'] = healthy, lag
+            metrics.set_gauge(f'db.replica.{index}.lag', lag if lag is not None else -1)
+        self._update_gauges()
+
+    def _update_gauges(self):
+        metrics.set_gauge('db.replicas.healthy', sum(replica['healthy'] for replica in self.replicas))
+
+
+def _replication_lag(cnx):
+    """Seconds behind the primary, 0 if the server is not replicating, None if unknown."""
+    cursor = cnx.cursor(dictionary=True)
+    try:
+        try:
+            cursor.execute("SHOW REPLICA STATUS")
+        except Exception:
+            # MariaDB and MySQL < 8.0.22
+            cursor.execute("SHOW SLAVE STATUS")
+        status = cursor.fetchone()
+    except Exception as e:
+        # Typically missing the REPLICATION CLIENT privilege
+        print(f"Cannot read replication status: {e}")
+        return None
+    finally:
+        cursor.close()
+
+    if not status:
+        return 0
+    lag = status.get('Seconds_Behind_Source', status.get('Seconds_Behind_Master'))
+    # NULL means replication is stopped or broken
+    return lag if lag is not None else REPLICA_MAX_LAG + 1
+
+
+_pool = None
+
+
+def get_replica_pool():
+    global _pool
+    if _pool is None:
+        dsns = [dsn.strip() for dsn in os.getenv('DB_REPLICA_CONNECTION_STRINGS', '').split(',') if dsn.strip()]
+        _pool = ReplicaPool(dsns)
+    return _pool
+
+
+# Read-your-writes: after a write a user is pinned to the primary for a while
+_pins = {}
+_pins_lock = threading.Lock()
+
+
+def pin_to_primary(user_id):
+    client = get_redis()
+    if client:
+        client.setex(f'dbpin:{user_id}', PIN_SECONDS, 1)
+        return
+    with _pins_lock:
+        _pins[str(user_id)] = time.monotonic() + PIN_SECONDS
+        if len(_pins) > 10000:
+            now = time.monotonic()
+            for key, until in list(_pins.items()):
+                if until < now:
+                    del _pins[key]
+
+
+def is_pinned(user_id):
+    client = get_redis()
+    if client:
+        return bool(client.exists(f'dbpin:{user_id}'))
+    with _pins_lock:
+        return _pins.get(str(user_id), 0) > time.monotonic()
+
+
+def start_replica_monitor(socketio, connect):
+    pool = get_replica_pool()
+    if not pool.replicas:
+        return
+
+    def run():
+        while True:
+            pool.check(connect)
+            socketio.sleep(CHECK_INTERVAL)
+
+    socketio.start_background_task(run)
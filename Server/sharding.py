@@ -0,0 +1,222 @@
+import bisect
+import hashlib
+import os
+import threading
+import time
+from collections import OrderedDict
+
+import mysql.connector
+
+from Server.circuit_breaker import CircuitBreaker
+
+# Shard routing for the per-user tables (messages, prekeys, and the outbox
+# rows written alongside them).
+#
+# DB_SHARD_CONNECTION_STRINGS lists the shards as name=connection string
+# pairs, e.g. "shard0=mysql://…/userdb,shard1=mysql://…/userdb". Their
+# order is fixed: a shard's position gives the range its message ids are
+# allocated from, so ids stay unique when users move between shards. Without
+# this setting there is a single shard living on the primary database.
+#
+# A user lives on the shard chosen by a consistent-hash ring over their id,
+# unless the shard_directory table on the primary overrides it (users moved
+# by Server/rebalance.py). Directory entries are looked up per user and kept
+# in a bounded cache; every change to the directory bumps the counter in
+# shard_directory_version, which workers poll every DIRECTORY_REFRESH
+# seconds to drop their cached entries.
+SHARD_ID_BITS = 40
+VNODES = int(os.getenv('DB_SHARD_VNODES', 64))
+DIRECTORY_REFRESH = int(os.getenv('DB_SHARD_DIRECTORY_REFRESH', 5))
+DIRECTORY_CACHE_SIZE = int(os.getenv('DB_SHARD_DIRECTORY_CACHE', 100000))
+
+
+def _hash(key):
+    return int.from_bytes(hashlib.md5(key.encode()).digest()[:8], 'big')
+
+
+class HashRing:
+
+    def __init__(self, names, vnodes=VNODES):
+        points = sorted((_hash(f'{name}#{i}'), name) for name in names for i in range(vnodes))
+        self._keys = [point for point, _ in points]
+        self._names = [name for _, name in points]
+
+    def lookup(self, key):
+        index = bisect.bisect(self._keys, _hash(str(key))) % len(self._keys)
+        return self._names[index]
+
+
+def parse_shards(spec):
+    """Parse 'name=dsn,…' into an ordered list of (name, dsn) pairs."""
+    shards = []
+    for item in filter(None, (part.strip() for part in (spec or '').split(','))):
+        name, _, dsn = item.partition('=')
+        shards.append((name.strip(), dsn.strip()))
+    return shards
+
+
+class ShardRouter:
+
+    def __init__(self, shards):
+        # dsn None means the shard is the primary database itself
+        self.shards = dict(shards) if shards else {'shard0': None}
+        self.index = {name: i for i, name in enumerate(self.shards)}
+        self.ring = HashRing(self.shards)
+        self.breakers = {name: CircuitBreaker(f'shard.{name}') for name, dsn in self.shards.items() if dsn}
+        self._entries = OrderedDict()
+        self._generation = 0
+        self._version = None
+        self._checked_at = None
+        self._lock = threading.Lock()
+
+    @property
+    def sharded(self):
+        return len(self.shards) > 1
+
+    def _check_version(self):
+        if self._checked_at is not None and time.monotonic() - self._checked_at < DIRECTORY_REFRESH:
+            return
+        with self._lock:
+            if self._checked_at is not None and time.monotonic() - self._checked_at < DIRECTORY_REFRESH:
+                return
+            try:
+                version = _query_primary("SELECT version FROM shard_directory_version WHERE id = 1")
+                version = version[0] if version else 0
+            except Exception as e:
+                # Keep routing with the entries we have
+                print(f"Error checking shard directory version: {e}")
+            else:
+                if version != self._version:
+                    self._clear()
+                    self._version = version
+            self._checked_at = time.monotonic()
+
+    def _clear(self):
+        self._entries.clear()
+        self._generation += 1
+
+    def _lookup(self, user_id):
+        key = str(user_id)
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                return self._entries[key]
+            generation = self._generation
+        # Not caught: routing a moved user by the ring would put their rows
+        # on the wrong shard, so a failed lookup fails the operation
+        row = _query_primary("SELECT shard, moving FROM shard_directory WHERE user_id = %s", (user_id,))
+        entry = (row[0], bool(row[1])) if row else None
+        with self._lock:
+            # Not if the cache was dropped meanwhile: the row may predate the change
+            if generation == self._generation:
+                self._entries[key] = entry
+                while len(self._entries) > DIRECTORY_CACHE_SIZE:
+                    self._entries.popitem(last=False)
+        return entry
+
+    def invalidate(self):
+        with self._lock:
+            self._clear()
+            self._checked_at = None
+
+    def locate(self, user_id):
+        """Return (shard name, moving) for a user."""
+        if not self.sharded:
+            return next(iter(self.shards)), False
+        self._check_version()
+        return self._lookup(user_id) or (self.ring.lookup(user_id), False)
+
+    def connect(self, name, read_only=False):
+        from Server.database import get_db_cnx, open_connection, is_db_unavailable, DatabaseUnavailable
+
+        dsn = self.shards[name]
+        if not dsn:
+            return get_db_cnx(read_only=read_only)
+
+        breaker = self.breakers[name]
+        if not breaker.allow():
+            raise DatabaseUnavailable(f'Shard {name} circuit breaker is open')
+        try:
+            cnx = open_connection(dsn)
+        except mysql.connector.Error as err:
+            if is_db_unavailable(err):
+                breaker.record_failure()
+            raise
+        breaker.record_connected()
+        return cnx
+
+    def breaker(self, name):
+        """Circuit breaker of a shard; shards living on the primary share its breaker."""
+        if self.shards[name]:
+            return self.breakers[name]
+        from Server.database import db_breaker
+        return db_breaker
+
+    def id_floor(self, name):
+        """First message id of a shard's id range."""
+        return (self.index[name] << SHARD_ID_BITS) + 1
+
+
+def _query_primary(sql, params=()):
+    from Server.database import get_db_cnx
+
+    cnx = get_db_cnx(pin=False)
+    cursor = cnx.cursor()
+    try:
+        cursor.execute(sql, params)
+        return cursor.fetchone()
+    finally:
+        cursor.close()
+        cnx.close()
+
+
+def bump_directory_version(cursor):
+    """Make every worker drop its cached directory entries; call in the transaction changing them."""
+    cursor.execute(
+        "INSERT INTO shard_directory_version (id, version) VALUES (1, 1)"
+        " ON DUPLICATE KEY UPDATE version = version + 1"
+    )
+
+
+_router = None
+
+
+def get_router():
+    global _router
+    if _router is None:
+        _router = ShardRouter(parse_shards(os.getenv('DB_SHARD_CONNECTION_STRINGS')))
+    return _router
+
+
+def get_shard_cnx(user_id, write=False, read_only=False):
+    """Connection to the shard holding a user's messages and prekeys.
+
+    Writes for a user who is being moved between shards are refused with
+    DatabaseUnavailable, so callers fall back exactly as for an outage (e.g.
+    send_message spools the message until the move is done).
+    """
+    router = get_router()
+    name, moving = router.locate(user_id)
+    if write and moving:
+        from Server.database import DatabaseUnavailable
+        raise DatabaseUnavailable(f'User {user_id} is being moved between shards')
+    return router.connect(name, read_only=read_only)
+
+
+def shard_breaker(user_id):
+    """Circuit breaker of the shard holding a user's rows, for recording query outcomes."""
+    router = get_router()
+    return router.breaker(router.locate(user_id)[0])
+
+
+def group_by_shard(user_ids):
+    """Map shard name -> list of the given user ids living there."""
+    router = get_router()
+    shards = {}
+    for user_id in user_ids:
+        shards.setdefault(router.locate(user_id)[0], []).append(user_id)
+    return shards
+
+
+def all_shard_names():
+    return list(get_router().shards)
@@ -0,0 +1,22 @@
+import os
+
+_client = None
+
+
+def get_redis():
+    """Return a shared Redis client if REDIS_URL is configured, otherwise None."""
+    global _client
+    if _client is not None:
+        return _client
+
+    url = os.getenv('REDIS_URL')
+    if not url:
+        return None
+
+    try:
+        import redis
+    except ImportError:
+        raise RuntimeError('REDIS_URL is set but the redis package is not installed')
+
+    _client = redis.Redis.from_url(url)
+    return _client
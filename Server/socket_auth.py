@@ -0,0 +1,58 @@
+import threading
+import time
+
+from flask import current_app
+from itsdangerous import URLSafeTimedSerializer, BadSignature
+
+# Identity of each live Socket.IO connection, keyed by socket id. It is set
+# from the access token the connection was opened with and replaced when the
+# client refreshes its session ('reauthenticate'), so a connection outlives
+# its first token without reconnecting. Handlers read it from here: the
+# handshake cookies stay the same for the whole life of the connection.
+#
+# The refresh itself is an HTTP request authenticated by the refresh cookie.
+# Its answer carries a ticket for the socket instead of the HttpOnly access
+# token: signed with the app secret, valid for TICKET_MAX_AGE seconds, and
+# only for the connection it was issued to, so it is worthless over HTTP.
+TICKET_MAX_AGE = 60
+_connections = {}
+_lock = threading.Lock()
+
+
+def bind(sid, user_id, email, expires_at):
+    with _lock:
+        _connections[sid] = (str(user_id), email, expires_at)
+
+
+def unbind(sid):
+    """Forget a connection; return its (user id, email) if it was known."""
+    with _lock:
+        entry = _connections.pop(sid, None)
+    return entry[:2] if entry else None
+
+
+def identity(sid, allow_expired=False):
+    """Return (user id, email) of a connection, None if unknown or its token expired."""
+    with _lock:
+        entry = _connections.get(sid)
+    if not entry or (not allow_expired and entry[2] < time.time()):
+        return None
+    return entry[:2]
+
+
+def _serializer():
+    return URLSafeTimedSerializer(current_app.config['SECRET_KEY'], salt='socket-reauthenticate')
+
+
+def issue_ticket(sid, user_id, email, expires_at):
+    """Ticket letting connection `sid` take on a refreshed session."""
+    return _serializer().dumps({'sid': sid, 'sub': str(user_id), 'email': email, 'exp': expires_at})
+
+
+def redeem_ticket(sid, ticket):
+    """Return the claims of a ticket issued to this connection, None if forged, expired or for another one."""
+    try:
+        claims = _serializer().loads(ticket, max_age=TICKET_MAX_AGE)
+    except (BadSignature, TypeError):
+        return None
+    return claims if claims.get('sid') == sid else None
@@ -1,23 +1,54 @@
-﻿from flask import request
-from flask_jwt_extended import verify_jwt_in_request, get_jwt, get_jwt_identity, jwt_required
+from flask import request
+from flask_jwt_extended import verify_jwt_in_request, get_jwt, get_jwt_identity
 from flask_socketio import join_room, emit
-from Server.database import get_db_cnx, get_id_from_email, messaging_waiting, mark_messages_as_read_in_db
+from Server.database import (
+    get_id_from_email, messaging_waiting, mark_messages_as_read_in_db, mark_message_delivered,
+    get_group_members, store_group_messages, is_db_unavailable
+)
+from Server.sharding import get_shard_cnx, shard_breaker
+from Server.rate_limit import limit_event
+from Server.spool import spool_message
+from Server.presence import get_tracker
+from Server import outbox, socket_auth
 import json
 
 user_sessions = {} # Dictionary to store user sessions
 
+
+def _identity():
+    """(user id, email) of the connection serving this event; None, with an 'auth_expired' event, once its token expired."""
+    user = socket_auth.identity(request.sid)
+    if not user:
+        emit('auth_expired', {})
+    return user
+
+
 def register_handlers(socketio):
 
-    @jwt_required()
     @socketio.on('connect')
     def handle_connect():
         verify_jwt_in_request()
         user_id_str = str(get_jwt_identity())
+        claims = get_jwt()
         user_sessions[user_id_str] = request.sid
+        socket_auth.bind(request.sid, user_id_str, claims["email"], claims["exp"])
         join_room(user_id_str)
+        get_tracker().connected(user_id_str, claims["email"])
+        # Lets the page refresh its session before the token expires
+        emit('session', {'expires_at': claims["exp"]})
         print(f"User {user_id_str} connected with socket ID {request.sid}")
 
-    @jwt_required()
+    @socketio.on('reauthenticate')
+    def handle_reauthenticate(data):
+        """Take on the session the page just refreshed, without reconnecting."""
+        current = socket_auth.identity(request.sid, allow_expired=True)
+        claims = socket_auth.redeem_ticket(request.sid, (data or {}).get("ticket"))
+        if not current or not claims or claims["sub"] != current[0]:
+            emit('reauthenticated', {'status': 'error', 'error': 'Ticket does not match this connection'})
+            return
+        socket_auth.bind(request.sid, current[0], claims["email"], claims["exp"])
+        emit('reauthenticated', {'status': 'success', 'expires_at': claims["exp"]})
+
     @socketio.on('disconnect')
     def handle_disconnect():
         # Remove user from tracking
@@ -25,13 +56,31 @@ def register_handlers(socketio):
             if sid == request.sid:
                 del user_sessions[user_id]
                 break
+        user = socket_auth.unbind(request.sid)
+        if user:
+            # Published after a grace period, unless the user reconnects
+            get_tracker().disconnected(*user)
+
+    @socketio.on('typing')
+    @limit_event('typing')
+    def handle_typing(data):
+        """Queue a typing indicator for a contact; sent coalesced by the presence flusher."""
+        user = _identity()
+        contact_email = (data or {}).get("contact_email")
+        if not user or not contact_email:
+            return
+        try:
+            get_tracker().typing(user[0], user[1], contact_email, data.get("typing"))
+        except Exception as e:
+            print(f"Error queueing typing indicator: {e}")
 
-    @jwt_required()
     @socketio.on('send_message')
+    @limit_event('send_message')
     def handle_send_message(data):
-        verify_jwt_in_request()
-        jwt_data = get_jwt()
-        sender_email = jwt_data["email"]
+        user = _identity()
+        if not user:
+            return
+        sender_email = user[1]
         print(f"Sender email: {sender_email} - {request.sid} - {data}")
 
         receiver_email = data.get("receiver")
@@ -42,25 +91,38 @@ def register_handlers(socketio):
 
         cnx = None
         cur = None
+        breaker = None
+        committed = False
         try:
-            cnx = get_db_cnx()
+            receiver_id = get_id_from_email(receiver_email)
+            if receiver_id is None:
+                emit('message_sent', {'status': 'error', 'error': 'Recipient not found'})
+                return
+
+            # Stored on the recipient's shard, so their undelivered messages
+            # can be read from a single shard
+            cnx = get_shard_cnx(receiver_id, write=True)
+            breaker = shard_breaker(receiver_id)
             cur = cnx.cursor()
             cur.execute(
                 "INSERT INTO messages (sender_email, receiver_email, content)"
                 " VALUES (%s, %s, %s)",
                 (sender_email, receiver_email, encrypted_json)
             )
-            cnx.commit()
             message_id = cur.lastrowid
-            print(f"Message id: {message_id} trying to send to : {receiver_email}")
 
-            # Notify recipient through socket
-            socketio.emit('message', {
+            # Notify recipient through the outbox, committed with the message
+            outbox.enqueue(cur, 'message', {
                 "from": sender_email,
                 "ciphertext": encrypted_data,  # Preserve the original structure
                 "msg_type": msg_type,
                 "id": message_id
-            }, room=get_user_socket_id(get_id_from_email(receiver_email)))
+            }, room=receiver_id)
+            cnx.commit()
+            committed = True
+            breaker.record_success()
+            outbox.notify()
+            print(f"Message id: {message_id} trying to send to : {receiver_email}")
 
             # Acknowledge successful message sending
             emit('message_sent', {
@@ -68,49 +130,121 @@ def register_handlers(socketio):
                 "messageId": message_id
             })
         except Exception as e:
+            if breaker and is_db_unavailable(e):
+                # Connection failures are counted when connecting; this counts
+                # a database that accepts connections but stalls or drops queries
+                breaker.record_failure()
+            if not committed and is_db_unavailable(e):
+                # Database is down or stalled, or the recipient is being moved
+                # between shards: journal the message locally and acknowledge
+                # it as queued; the spool replayer delivers it later
+                try:
+                    spool_id = spool_message(sender_email, receiver_email, encrypted_json, msg_type)
+                except Exception as spool_error:
+                    print(f"Error spooling message: {spool_error}")
+                else:
+                    emit('message_sent', {
+                        "status": "queued",
+                        "spoolId": spool_id
+                    })
+                    return
             if cnx:
-                cnx.rollback()
+                try:
+                    cnx.rollback()
+                except Exception:
+                    pass
             print(f"Error sending message: {e}")
             emit('message_sent', {
                 'status': 'error',
                 'error': str(e)
             })
         finally:
-            if cur: cur.close()
+            if cur:
+                try:
+                    cur.close()
+                except Exception:
+                    pass
             if cnx: cnx.close()
 
+    @socketio.on('send_group_message')
+    @limit_event('send_group_message')
+    def handle_send_group_message(data):
+        """Store one ciphertext per group member in one INSERT and fan out in one pass."""
+        user = _identity()
+        if not user:
+            return
+        sender_email = user[1]
+
+        group_id = data.get("group_id")
+        ciphertexts = data.get("ciphertexts")  # {member_email: encrypted object}
+        msg_type = data.get("msg_type", "message")
+
+        if not group_id or not isinstance(ciphertexts, dict) or not ciphertexts:
+            emit('error', {"error": "Group id and ciphertexts are required"})
+            return
+
+        try:
+            members = get_group_members(group_id)
+            if sender_email not in members:
+                emit('error', {"error": "Not a member of this group"})
+                return
+
+            recipients = [
+                (email, members[email], ciphertext)
+                for email, ciphertext in ciphertexts.items()
+                if email in members and email != sender_email
+            ]
+            message_ids = store_group_messages(
+                sender_email, group_id,
+                [(email, user_id, json.dumps(ciphertext)) for email, user_id, ciphertext in recipients]
+            )
+        except Exception as e:
+            print(f"Error sending group message: {e}")
+            emit('group_message_sent', {'status': 'error', 'groupId': group_id, 'error': str(e)})
+            return
+
+        for (email, user_id, ciphertext), message_id in zip(recipients, message_ids):
+            socketio.emit('message', {
+                "from": sender_email,
+                "group_id": group_id,
+                "ciphertext": ciphertext,
+                "msg_type": msg_type,
+                "id": message_id
+            }, room=str(user_id))
+
+        emit('group_message_sent', {
+            "status": "success",
+            "groupId": group_id,
+            "messageIds": {email: message_id for (email, _, _), message_id in zip(recipients, message_ids)},
+            "missing": [email for email in members if email != sender_email and email not in ciphertexts]
+        })
+
     # socket_events.py - Add this new handler
-    @jwt_required()
     @socketio.on('message_received')
     def handle_message_received(data):
+        user = _identity()
+        if not user:
+            return
         message_id = data.get("messageId")
         sender_email = data.get("sender")
 
-        # Update message status in database
-        cnx = get_db_cnx()
+        # Update message status on our shard; the sender is notified through
+        # the outbox once the update is committed
         try:
-            cur = cnx.cursor()
-            cur.execute(
-                "UPDATE messages SET is_delivered = TRUE WHERE id = %s",
-                (message_id,)
+            mark_message_delivered(
+                user[0], user[1], message_id,
+                sender_id=get_id_from_email(sender_email)
             )
-            cnx.commit()
-
-            # Notify sender of delivery
-            socketio.emit('delivery_confirmation', {
-                "messageId": message_id,
-                "status": "delivered"
-            }, room=get_user_socket_id(get_id_from_email(sender_email)))
         except Exception as e:
             print(f"Error updating message status: {e}")
-        finally:
-            if cnx: cnx.close()
 
-    @jwt_required()
     @socketio.on('load_undelivered_messages')
+    @limit_event('load_undelivered_messages')
     def handle_load_undelivered_messages(data):
-        verify_jwt_in_request()
-        user_email = get_jwt()["email"]
+        user = _identity()
+        if not user:
+            return
+        user_email = user[1]
         contact_email = data.get("contact_email")
 
         if not contact_email:
@@ -121,11 +255,12 @@ def register_handlers(socketio):
         if undelivered_messages:
             emit('messages_load', {"messages": undelivered_messages})
 
-    @jwt_required()
     @socketio.on('mark_messages_as_read')
     def handle_mark_messages_as_read(data):
-        verify_jwt_in_request()
-        user_email = get_jwt()["email"]
+        user = _identity()
+        if not user:
+            return
+        user_email = user[1]
         contact_email = data.get("contact_email")
 
         if not contact_email:
@@ -134,24 +269,42 @@ def register_handlers(socketio):
         mark_messages_as_read_in_db(user_email, contact_email)
 
     @socketio.on('ratchet_response')
-    @jwt_required()
+    @limit_event('ratchet_response')
     def handle_ratchet_response(data):
-        sender_email = get_jwt()["email"]
+        user = _identity()
+        if not user:
+            return
+        sender_email = user[1]
         recipient_email = data.get('to')
         ratchet_key = data.get('ratchet_key')
         if not recipient_email or not ratchet_key:
             return
         print('ratchet_response', data)
 
+        # The user's room reaches their sockets on every worker
         recipient_id = get_id_from_email(recipient_email)
-        recipient_socket_id = get_user_socket_id(recipient_id)
-        if recipient_socket_id:
+        if recipient_id:
             socketio.emit(
                 'ratchet_response',
                 {'from': sender_email, 'ratchet_key': ratchet_key},
-                room=recipient_socket_id
+                room=str(recipient_id)
             )
 
+def deliver_spooled_message(record, message_id):
+    """Push a message replayed from the spool to its recipient and confirm it to the sender."""
+    from Server.socket_manager import socketio
+    socketio.emit('message', {
+        "from": record['sender_email'],
+        "ciphertext": json.loads(record['content']),
+        "msg_type": record['msg_type'],
+        "id": message_id
+    }, room=str(get_id_from_email(record['receiver_email'])))
+    socketio.emit('message_sent', {
+        "status": "success",
+        "messageId": message_id,
+        "spoolId": record['spool_id']
+    }, room=str(get_id_from_email(record['sender_email'])))
+
 def get_user_socket_id(user_id):
     return user_sessions.get(str(user_id))
 
@@ -1,3 +1,4 @@
+import os
 from flask_socketio import SocketIO
 
 # Create socketio instance but don't initialize yet
@@ -5,9 +6,35 @@ socketio = SocketIO()
 
 
 def init_socketio(app):
-    # Initialize with the app
-    socketio.init_app(app, cors_allowed_origins="*")
+    # Initialize with the app. With a message queue, emits from any worker
+    # (including the outbox relay) reach sockets connected to every worker.
+    socketio.init_app(
+        app,
+        cors_allowed_origins="*",
+        message_queue=os.getenv('SOCKETIO_MESSAGE_QUEUE') or os.getenv('REDIS_URL')
+    )
 
     # Import event handlers here to avoid circular imports
     from Server.socket_events import register_handlers
-    register_handlers(socketio)
\ No newline at end of file
+    register_handlers(socketio)
+
+    from Server.handshake_store import start_handshake_sweeper
+    start_handshake_sweeper(socketio)
+
+    from Server.database import insert_spooled_messages, is_db_unavailable
+    from Server.socket_events import deliver_spooled_message
+    from Server.spool import start_replayer
+    start_replayer(socketio, insert_spooled_messages, is_db_unavailable, deliver_spooled_message)
+
+    from Server.outbox import start_relay
+    start_relay(socketio)
+
+    from Server.database import open_connection
+    from Server.replicas import start_replica_monitor
+    start_replica_monitor(socketio, open_connection)
+
+    from Server.presence import start_presence_flusher
+    start_presence_flusher(socketio)
+
+    from Server.refresh_tokens import start_token_sweeper
+    start_token_sweeper(socketio)
@@ -0,0 +1,250 @@
+import json
+import os
+import struct
+import threading
+import time
+import uuid
+import zlib
+
+from Server import metrics
+
+# Append-only journal used to accept messages while the database is down.
+#
+# The journal is a directory of numbered segment files. Each record is
+#   <u32 payload length><u32 crc32 of payload><payload (JSON)>
+# and is fsync'd before the sender is acknowledged. The replayer only reads
+# sealed segments (the writer has moved on to a newer file) and deletes a
+# segment once every record in it has reached the database.
+#
+# A record failing its CRC is skipped on its own. A segment that can't be
+# read to its end (a torn tail, or a length that runs past the end of the
+# file) is moved to a quarantine directory after replay instead of being
+# deleted, since records past that point can no longer be framed.
+SPOOL_DIR = os.getenv('SPOOL_DIR', os.path.join(os.path.dirname(__file__), 'spool'))
+SEGMENT_BYTES = int(os.getenv('SPOOL_SEGMENT_BYTES', 4 * 1024 * 1024))
+REPLAY_BATCH = int(os.getenv('SPOOL_REPLAY_BATCH', 200))
+REPLAY_INTERVAL = float(os.getenv('SPOOL_REPLAY_INTERVAL', 0.5))
+
+HEADER = struct.Struct('<II')
+
+try:
+    import fcntl
+except ImportError:  # Windows: a single worker per spool directory
+    fcntl = None
+
+
+class Journal:
+
+    def __init__(self, directory):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+        self._lock = threading.Lock()
+        self._active = None
+        self._active_path = None
+        self._active_size = 0
+        self._seq = max(self._sequences(), default=0)
+
+    def _sequences(self):
+        return sorted(int(name[:-4]) for name in os.listdir(self.directory) if name.endswith('.seg'))
+
+    def _path(self, seq):
+        return os.path.join(self.directory, f'{seq:08d}.seg')
+
+    def _open_next(self):
+        if self._active:
+            self._active.close()
+        self._seq += 1
+        self._active_path = self._path(self._seq)
+        self._active = open(self._active_path, 'ab')
+        self._active_size = 0
+        # Make the new file itself durable, not just its contents
+        if hasattr(os, 'O_DIRECTORY'):
+            fd = os.open(self.directory, os.O_DIRECTORY)
+            try:
+                os.fsync(fd)
+            finally:
+                os.close(fd)
+
+    def append(self, record):
+        """Durably append one record; returns once it is on disk."""
+        payload = json.dumps(record, separators=(',', ':')).encode()
+        data = HEADER.pack(len(payload), zlib.crc32(payload)) + payload
+        with self._lock:
+            if self._active is None or self._active_size + len(data) > SEGMENT_BYTES:
+                self._open_next()
+            self._active.write(data)
+            self._active.flush()
+            os.fsync(self._active.fileno())
+            self._active_size += len(data)
+        metrics.incr('spool.appended')
+        self._update_gauges()
+
+    def sealed_segments(self):
+        """Seal the active segment if it has data and return every sealed segment path."""
+        with self._lock:
+            if self._active is not None and self._active_size:
+                self._active.close()
+                self._active = None
+            active_seq = self._seq if self._active is not None else None
+            return [self._path(seq) for seq in self._sequences() if seq != active_seq]
+
+    @staticmethod
+    def scan(path):
+        """Read a segment; returns (records, intact).
+
+        Records failing their CRC are skipped. `intact` is False when reading
+        stopped before the end of the file, at a torn or untrustworthy header.
+        """
+        records = []
+        with open(path, 'rb') as f:
+            size = os.fstat(f.fileno()).st_size
+            while True:
+                offset = f.tell()
+                header = f.read(HEADER.size)
+                if not header:
+                    return records, True
+                if len(header) < HEADER.size:
+                    print(f"Spool: torn header at offset {offset} in {path}")
+                    return records, False
+                length, crc = HEADER.unpack(header)
+                if length > size - f.tell():
+                    print(f"Spool: record at offset {offset} in {path} runs past the end of the file")
+                    return records, False
+                payload = f.read(length)
+                try:
+                    if zlib.crc32(payload) != crc:
+                        raise ValueError('CRC mismatch')
+                    records.append(json.loads(payload))
+                except ValueError as e:
+                    metrics.incr('spool.corrupt_records')
+                    print(f"Spool: skipping corrupt record at offset {offset} in {path}: {e}")
+
+    @staticmethod
+    def read(path):
+        """The records of a segment that could be read back intact."""
+        return Journal.scan(path)[0]
+
+    def remove(self, path):
+        os.remove(path)
+        self._update_gauges()
+
+    def quarantine(self, path):
+        """Move a segment that could not be read to its end out of the journal."""
+        directory = os.path.join(self.directory, 'quarantine')
+        os.makedirs(directory, exist_ok=True)
+        # Segment numbers can be reused once the journal is empty
+        target = os.path.join(directory, f'{int(time.time())}-{os.path.basename(path)}')
+        os.replace(path, target)
+        metrics.incr('spool.quarantined')
+        print(f"Spool: moved {path} to {target}")
+        self._update_gauges()
+
+    def size(self):
+        sizes = [os.path.getsize(self._path(seq)) for seq in self._sequences()]
+        return len(sizes), sum(sizes)
+
+    def _update_gauges(self):
+        segments, size = self.size()
+        metrics.set_gauge('spool.segments', segments)
+        metrics.set_gauge('spool.bytes', size)
+
+
+def _claim_directory(root):
+    """Give each worker process its own journal directory under `root`."""
+    if fcntl is None:
+        return os.path.join(root, 'slot-0'), None
+    slot = 0
+    while True:
+        directory = os.path.join(root, f'slot-{slot}')
+        os.makedirs(directory, exist_ok=True)
+        lock_file = open(os.path.join(directory, '.lock'), 'w')
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            return directory, lock_file
+        except OSError:
+            lock_file.close()
+            slot += 1
+
+
+_journal = None
+_journal_lock_file = None
+
+
+def get_journal():
+    global _journal, _journal_lock_file
+    if _journal is None:
+        directory, _journal_lock_file = _claim_directory(SPOOL_DIR)
+        _journal = Journal(directory)
+    return _journal
+
+
+def spool_message(sender_email, receiver_email, content, msg_type):
+    """Journal a message that could not be written to the database; returns its spool id."""
+    spool_id = uuid.uuid4().hex
+    get_journal().append({
+        'spool_id': spool_id,
+        'sender_email': sender_email,
+        'receiver_email': receiver_email,
+        'content': content,
+        'msg_type': msg_type,
+        'sent_at': round(time.time(), 3),
+    })
+    return spool_id
+
+
+def replay(store, is_unavailable, on_stored, sleep=time.sleep):
+    """Drain sealed segments into the database in batches.
+
+    `store(records)` must be idempotent on spool_id and return (record, message_id)
+    pairs for the records it actually inserted; `on_stored` is called with each.
+    Stops early, leaving the segment in place, while the database is unavailable.
+    A batch rejected for any other reason is retried record by record so that a
+    single bad record is dropped instead of blocking the journal. Segments that
+    could not be read to their end are quarantined rather than deleted.
+    """
+    journal = get_journal()
+    for path in journal.sealed_segments():
+        records, intact = Journal.scan(path)
+        for start in range(0, len(records), REPLAY_BATCH):
+            batch = records[start:start + REPLAY_BATCH]
+            began = time.monotonic()
+            try:
+                stored = store(batch)
+            except Exception as e:
+                if is_unavailable(e):
+                    return
+                print(f"Spool replay batch rejected, retrying one by one: {e}")
+                stored = []
+                for record in batch:
+                    try:
+                        stored.extend(store([record]))
+                    except Exception as record_error:
+                        if is_unavailable(record_error):
+                            return
+                        metrics.incr('spool.dropped')
+                        print(f"Spool: dropping record {record['spool_id']}: {record_error}")
+
+            for record, message_id in stored:
+                try:
+                    on_stored(record, message_id)
+                except Exception as e:
+                    print(f"Spool: stored message {message_id} but could not notify: {e}")
+            metrics.incr('spool.replayed', len(batch))
+            metrics.set_gauge('spool.replay_rate', round(len(batch) / max(time.monotonic() - began, 1e-6)))
+            sleep(REPLAY_INTERVAL)
+        if intact:
+            journal.remove(path)
+        else:
+            journal.quarantine(path)
+
+
+def start_replayer(socketio, store, is_unavailable, on_stored):
+    def run():
+        while True:
+            socketio.sleep(REPLAY_INTERVAL * 4)
+            try:
+                replay(store, is_unavailable, on_stored, sleep=socketio.sleep)
+            except Exception as e:
+                print(f"Spool replayer error: {e}")
+
+    socketio.start_background_task(run)
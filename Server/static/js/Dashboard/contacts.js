@@ -112,10 +112,11 @@ function updateContactsList(contacts) {
 }
 
 /**
- * Loads pending contact requests
+ * Loads pending contact requests from the contacts snapshot.
+ * The browser revalidates it with If-None-Match, so an unchanged list costs a 304.
  */
 function loadPendingRequests() {
-  fetch('/api/contact-requests', {
+  fetch('/api/contacts/snapshot', {
     credentials: 'include',
     headers: {'X-CSRF-TOKEN': getCookie('csrf_access_token')}
   })
@@ -124,7 +125,7 @@ function loadPendingRequests() {
     const requestsContainer = document.getElementById('contact-requests');
     requestsContainer.innerHTML = '';
 
-    data.requests.forEach(req => {
+    data.incoming.forEach(req => {
       console.debug('[CONTACT] Request:', req);
 
       const requestEl = createRequestElement(req);
@@ -132,11 +133,24 @@ function loadPendingRequests() {
     });
 
     document.getElementById('requests-section').style.display =
-      data.requests.length > 0 ? 'block' : 'none';
+      data.incoming.length > 0 ? 'block' : 'none';
   })
   .catch(err => console.error('[CONTACT] Failed to load requests:', err));
 }
 
+/**
+ * Adds a single pending request pushed over the socket, without refetching
+ * @param {Object} request - Contact request data ({ id, requester_email })
+ */
+function addPendingRequest(request) {
+  const requestsContainer = document.getElementById('contact-requests');
+  requestsContainer
+    .querySelectorAll(`[data-requester-id="${CSS.escape(request.requester_email)}"]`)
+    .forEach(el => el.remove());
+  requestsContainer.appendChild(createRequestElement(request));
+  document.getElementById('requests-section').style.display = 'block';
+}
+
 /**
  * Creates a contact request element
  * @param {Object} request - Contact request data
@@ -230,5 +244,6 @@ export {
   initializeAddContactForm,
   updateContactsList,
   loadPendingRequests,
+  addPendingRequest,
   loadContacts
 };
\ No newline at end of file
@@ -57,12 +57,36 @@ async function sendMessageViaSocket() {
 
     // Clear input
     newMsgInput.value = '';
+    setTyping(false);
 
   } catch (error) {
     console.error('[MSG] Error sending message:', error);
   }
 }
 
+// The server coalesces typing updates, so only state changes are sent
+let typingContact = null;
+let typingTimer = null;
+
+/**
+ * Tell the current contact whether we are typing
+ * @param {boolean} typing
+ */
+function setTyping(typing) {
+  clearTimeout(typingTimer);
+  const contact = typing ? window.currentContactEmail : null;
+  if (typingContact && typingContact !== contact) {
+    socket.emit('typing', { contact_email: typingContact, typing: false });
+  }
+  if (contact && contact !== typingContact) {
+    socket.emit('typing', { contact_email: contact, typing: true });
+  }
+  typingContact = contact;
+  if (typing) {
+    typingTimer = setTimeout(() => setTyping(false), 3000);
+  }
+}
+
 /**
  * Set up message sending functionality
  */
@@ -78,6 +102,7 @@ function setupSendMessage() {
     msgInput.addEventListener('keypress', (e) => {
       if (e.key === 'Enter') sendMessageViaSocket();
     });
+    msgInput.addEventListener('input', () => setTyping(msgInput.value.length > 0));
   }
 }
 
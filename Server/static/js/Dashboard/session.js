@@ -0,0 +1,60 @@
+// Server/static/js/Dashboard/session.js
+import { socket } from './socketHandlers.js';
+import { getCookie } from '../utils.js';
+
+// Refresh this long before the access token expires
+const REFRESH_MARGIN_MS = 60 * 1000;
+// Retry delay after losing a refresh race to another tab
+const RACE_RETRY_MS = 500;
+let refreshTimer = null;
+
+/**
+ * Schedule a silent refresh ahead of the access token's expiry
+ * @param {number} expiresAt - Expiry as a Unix timestamp (seconds)
+ */
+function scheduleRefresh(expiresAt) {
+  clearTimeout(refreshTimer);
+  const delay = Math.max(0, expiresAt * 1000 - Date.now() - REFRESH_MARGIN_MS);
+  refreshTimer = setTimeout(refreshSession, delay);
+}
+
+/**
+ * Trade the refresh cookie for new tokens, then move the live socket onto
+ * the refreshed session with the ticket issued for it
+ */
+async function refreshSession() {
+  try {
+    const response = await fetch('/session/refresh', {
+      method: 'POST',
+      credentials: 'include',
+      headers: {
+        'Content-Type': 'application/json',
+        'X-CSRF-TOKEN': getCookie('csrf_access_token')
+      },
+      body: JSON.stringify({ sid: socket.id })
+    });
+    if (response.status === 401) {
+      // Session revoked or expired: a real login is needed
+      window.location.href = '/';
+      return;
+    }
+    if (response.status === 409) {
+      // Another tab refreshed at the same time; retry with the cookies it got
+      refreshTimer = setTimeout(refreshSession, RACE_RETRY_MS);
+      return;
+    }
+    if (!response.ok) {
+      throw new Error(`Refresh failed: ${response.status}`);
+    }
+    const data = await response.json();
+    if (data.socket_ticket) {
+      socket.emit('reauthenticate', { ticket: data.socket_ticket });
+    }
+    scheduleRefresh(data.expires_at);
+  } catch (err) {
+    console.error('[AUTH] Session refresh error:', err);
+    refreshTimer = setTimeout(refreshSession, 10 * 1000);
+  }
+}
+
+export { scheduleRefresh, refreshSession };
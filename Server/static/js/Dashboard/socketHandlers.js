@@ -1,5 +1,5 @@
 // Server/static/js/Dashboard/socketHandlers.js
-import { loadPendingRequests } from './contacts.js';
+import { loadPendingRequests, addPendingRequest } from './contacts.js';
 import { appendMessage } from './conversation.js';
 import { showNotification } from '../notificationHandler.js';
 import { getCookie } from '../utils.js';
@@ -9,6 +9,7 @@ import {getSessionByContact, saveSession} from "./DoubleRatchet/sessionStorage.j
 import { performX3DHasRecipient } from "./DoubleRatchet/contactCrypto.js";
 import {arrayBufferToBase64, base64ToArrayBuffer, deletePreKey, getPreKey, loadKeyMaterial} from "../KeyStorage.js";
 import {Session} from "./DoubleRatchet/session.js";
+import { scheduleRefresh, refreshSession } from './session.js';
 
 // Initialize socket connection with auth token
 const socket = io('/', {
@@ -46,6 +47,22 @@ function setupConnectionEvents() {
     alert(`Error: ${error.error}`);
   });
 
+  // Access token lifetime of this connection, refreshed silently before it ends
+  socket.on('session', ({expires_at}) => scheduleRefresh(expires_at));
+
+  socket.on('auth_expired', () => {
+    console.warn('[WS] Access token expired, refreshing session');
+    refreshSession();
+  });
+
+  socket.on('reauthenticated', ({status, error}) => {
+    if (status !== 'success') console.error('[WS] Re-authentication failed:', error);
+  });
+
+  socket.on('rate_limited', ({event, retry_after}) => {
+    console.warn(`[WS] Rate limited on ${event}, retry in ${retry_after}s`);
+  });
+
   socket.on('disconnect', () => {
     console.debug('[WS] Disconnected');
     const statusEl = document.createElement('div');
@@ -227,10 +244,28 @@ async function updateSentMessageWithId(id) {
 function setupContactEvents() {
   socket.on('contact_request', (data) => {
     console.debug('[WS] Received contact request from:', data.from);
-    loadPendingRequests();
+    if (data.request_id) {
+      addPendingRequest({ id: data.request_id, requester_email: data.from });
+    } else {
+      loadPendingRequests();
+    }
     showNotification(`New contact request from ${data.from}`);
   });
 
+  // Coalesced presence: { online: {email: bool}, typing: {email: bool} }
+  socket.on('presence', ({online, typing}) => {
+    for (const [email, isOnline] of Object.entries(online || {})) {
+      const li = document.querySelector(`.contact-item[data-contact-email="${CSS.escape(email)}"]`);
+      if (!li) continue;
+      li.classList.toggle('online', isOnline);
+      if (!isOnline) li.classList.remove('typing');
+    }
+    for (const [email, isTyping] of Object.entries(typing || {})) {
+      const li = document.querySelector(`.contact-item[data-contact-email="${CSS.escape(email)}"]`);
+      if (li) li.classList.toggle('typing', isTyping);
+    }
+  });
+
   socket.on('contact_request_response', (data) => {
     console.debug('[WS] Contact request response:', data.from, "with status:", data.status);
 
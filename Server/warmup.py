@@ -0,0 +1,155 @@
+import hashlib
+import os
+import threading
+import time
+
+from Server import metrics
+
+# Work done once per process before it reports ready on /readyz, so the
+# first requests routed to it don't pay for connecting to every database,
+# compiling templates or loading the public keys of active users.
+#
+# The database step is required and retried until it succeeds; the others
+# only save latency, so a failure is reported but does not hold readiness.
+WARMUP_PRIME_USERS = int(os.getenv('WARMUP_PRIME_USERS', 1000))
+RETRY_INTERVAL = 2
+
+_ready = threading.Event()
+_lock = threading.Lock()
+_steps = {}
+_manifest = {}
+
+
+def is_ready():
+    return _ready.is_set()
+
+
+def status():
+    """Per-step status ('pending', 'ok' or 'failed') with timings in ms."""
+    with _lock:
+        return {name: dict(step) for name, step in _steps.items()}
+
+
+def get_manifest():
+    """Static files seen at warm-up: path relative to the static folder -> size and hash."""
+    return _manifest
+
+
+def _run(name, func, *args):
+    start = time.perf_counter()
+    try:
+        detail = func(*args)
+        state = {'status': 'ok'}
+        if detail is not None:
+            state['detail'] = detail
+    except Exception as e:
+        print(f"Warm-up step {name} failed: {e}")
+        state = {'status': 'failed', 'error': str(e)}
+    state['ms'] = round((time.perf_counter() - start) * 1000, 1)
+    metrics.set_gauge(f'warmup.{name}.ms', state['ms'])
+    with _lock:
+        _steps[name] = state
+    return state['status'] == 'ok'
+
+
+def warm_databases():
+    """Open the connection pools of the primary, replicas and shards."""
+    from Server.database import get_db_cnx, open_connection
+    from Server.replicas import get_replica_pool
+    from Server.sharding import get_router
+
+    cnx = get_db_cnx()
+    cursor = cnx.cursor()
+    try:
+        cursor.execute("SELECT 1")
+        cursor.fetchall()
+    finally:
+        cursor.close()
+        cnx.close()
+
+    replicas = get_replica_pool()
+    replicas.check(open_connection)
+
+    router = get_router()
+    shards = [name for name, dsn in router.shards.items() if dsn]
+    for name in shards:
+        router.connect(name).close()
+    router.invalidate()
+    router.locate(0)
+    return {'replicas': len(replicas.replicas), 'shards': len(shards)}
+
+
+def compile_templates(app):
+    names = app.jinja_env.list_templates(extensions=['html'])
+    for name in names:
+        app.jinja_env.get_template(name)
+    return {'templates': len(names)}
+
+
+def prime_key_cache():
+    """Cache the public keys of the users with a live session."""
+    from Server import key_cache
+    from Server.database import get_db_cnx
+
+    cnx = get_db_cnx(read_only=True)
+    cursor = cnx.cursor()
+    try:
+        cursor.execute(
+            """
+            SELECT u.email FROM users u
+            JOIN refresh_tokens t ON t.user_id = u.id
+            WHERE t.revoked_at IS NULL AND t.used_at IS NULL AND t.expires_at > NOW()
+            GROUP BY u.id, u.email
+            ORDER BY MAX(t.created_at) DESC
+            LIMIT %s
+            """,
+            (min(WARMUP_PRIME_USERS, key_cache.MAX_BUNDLES),)
+        )
+        emails = [email for (email,) in cursor.fetchall()]
+    finally:
+        cursor.close()
+        cnx.close()
+    return {'users': key_cache.prime(emails)}
+
+
+def load_static_manifest(app):
+    """Read every static file once, which also leaves them in the page cache."""
+    manifest = {}
+    total = 0
+    for root, _, files in os.walk(app.static_folder):
+        for filename in files:
+            path = os.path.join(root, filename)
+            with open(path, 'rb') as f:
+                content = f.read()
+            manifest[os.path.relpath(path, app.static_folder).replace(os.sep, '/')] = {
+                'size': len(content),
+                'hash': hashlib.sha256(content).hexdigest()[:16],
+            }
+            total += len(content)
+    _manifest.clear()
+    _manifest.update(manifest)
+    return {'files': len(manifest), 'bytes': total}
+
+
+def start_warmup(app, socketio):
+    with _lock:
+        for name in ('database', 'templates', 'key_cache', 'static'):
+            _steps[name] = {'status': 'pending'}
+    metrics.set_gauge('warmup.ready', 0)
+
+    def run():
+        start = time.perf_counter()
+        with app.app_context():
+            while not _run('database', warm_databases):
+                socketio.sleep(RETRY_INTERVAL)
+            _run('templates', compile_templates, app)
+            _run('key_cache', prime_key_cache)
+            _run('static', load_static_manifest, app)
+
+        total = (time.perf_counter() - start) * 1000
+        metrics.set_gauge('warmup.total.ms', round(total, 1))
+        metrics.set_gauge('warmup.ready', 1)
+        _ready.set()
+        print(f"Warm-up done in {total:.0f} ms")
+
+    socketio.start_background_task(run)
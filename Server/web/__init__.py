@@ -1,2 +1,3 @@
 from Server.web.auth import auth_bp
-from Server.web.home import home_bp
\ No newline at end of file
+from Server.web.home import home_bp
+from Server.web.ops import ops_bp
\ No newline at end of file
@@ -1,20 +1,55 @@
-from Server.database import get_db_cnx
+from Server.database import get_db_cnx, is_db_unavailable
+from Server.sharding import get_router, get_shard_cnx
+from Server import refresh_tokens, socket_auth
 import os
 import json
 import hashlib
+from urllib.parse import urlparse
 
 from datetime import timedelta
 from flask import (
     Blueprint, render_template, redirect, url_for,
-    flash, request, current_app
+    flash, request, current_app, jsonify
 )
 from .forms import RegistrationForm
 from datetime import timedelta
-from flask_jwt_extended import create_access_token, set_access_cookies
+from flask_jwt_extended import create_access_token, set_access_cookies, unset_jwt_cookies, decode_token
 
 
 auth_bp = Blueprint('auth', __name__)
 
+ACCESS_TOKEN_TTL = timedelta(minutes=int(os.getenv('ACCESS_TOKEN_MINUTES', 15)))
+REFRESH_COOKIE = 'refresh_token'
+# The refresh token is only sent to the session routes
+SESSION_PATH = '/session'
+
+
+def _access_token(user_id, email):
+    return create_access_token(
+        identity=str(user_id),
+        additional_claims={'email': email},
+        expires_delta=ACCESS_TOKEN_TTL
+    )
+
+
+def _set_session_cookies(resp, access_token, refresh_token):
+    set_access_cookies(resp, access_token)
+    resp.set_cookie(
+        REFRESH_COOKIE, refresh_token,
+        max_age=refresh_tokens.REFRESH_TOKEN_TTL,
+        path=SESSION_PATH,
+        httponly=True,
+        secure=current_app.config.get('JWT_COOKIE_SECURE'),
+        samesite=current_app.config.get('JWT_COOKIE_SAMESITE')
+    )
+    return resp
+
+
+def _end_session(resp):
+    unset_jwt_cookies(resp)
+    resp.delete_cookie(REFRESH_COOKIE, path=SESSION_PATH)
+    return resp
+
 @auth_bp.route('/register', methods=['POST'])
 def register():
     form = RegistrationForm()
@@ -64,11 +99,24 @@ def register():
         user_id = cursor.lastrowid
 
         prekeys = json.loads(prekeys_json)
-        for pk in prekeys:
-            cursor.execute("""
-                INSERT INTO prekeys (user_id, prekey_id, prekey)
-                VALUES (%s, %s, %s)
-            """, (user_id, pk['prekey_id'], pk['prekey']))
+        prekey_rows = [(user_id, pk['prekey_id'], pk['prekey']) for pk in prekeys]
+        insert_prekeys = """
+            INSERT INTO prekeys (user_id, prekey_id, prekey)
+            VALUES (%s, %s, %s)
+        """
+        if not get_router().sharded:
+            cursor.executemany(insert_prekeys, prekey_rows)
+        else:
+            # Prekeys live on the user's shard: commit them first so a
+            # committed user always has prekeys
+            shard_cnx = get_shard_cnx(user_id, write=True)
+            shard_cursor = shard_cnx.cursor()
+            try:
+                shard_cursor.executemany(insert_prekeys, prekey_rows)
+                shard_cnx.commit()
+            finally:
+                shard_cursor.close()
+                shard_cnx.close()
 
         cnx.commit()
         flash('Registration successful! You can now log in.', 'success')
@@ -88,12 +136,20 @@ def login():
     email = request.form['email']
     password = request.form['password']
     pepper = current_app.config.get('PASSWORD_PEPPER', '').encode()
-    cnx = get_db_cnx()
+    cnx = get_db_cnx(read_only=True)
     cursor = cnx.cursor()
 
     try:
         cursor.execute('SELECT id, email, pwdhash, salt FROM users WHERE email = %s', (email,))
         row = cursor.fetchone()
+        if not row:
+            # A user who just registered may not have reached the replicas yet
+            cursor.close()
+            cnx.close()
+            cnx = get_db_cnx()
+            cursor = cnx.cursor()
+            cursor.execute('SELECT id, email, pwdhash, salt FROM users WHERE email = %s', (email,))
+            row = cursor.fetchone()
         if row:
             user_id, user_email, stored_hash, stored_salt = row
             salt = bytes.fromhex(stored_salt)
@@ -102,14 +158,13 @@ def login():
             ).hex()
 
             if candidate == stored_hash:
-                access_token = create_access_token(
-                    identity = str(user_id),
-                    additional_claims = {'email': user_email},
-                    expires_delta=timedelta(hours=1)
+                # From here on the session is kept alive by refresh tokens,
+                # the password is only hashed again on the next real login
+                return _set_session_cookies(
+                    redirect(url_for('home.dashboard')),
+                    _access_token(user_id, user_email),
+                    refresh_tokens.issue(user_id)
                 )
-                resp = redirect(url_for('home.dashboard'))
-                set_access_cookies(resp, access_token)
-                return resp
 
         flash('Invalid credentials', 'error')
         return redirect(url_for('index'))
@@ -122,4 +177,81 @@ def login():
 
     finally:
         cursor.close()
-        cnx.close()
\ No newline at end of file
+        cnx.close()
+
+
+@auth_bp.route(f'{SESSION_PATH}/refresh', methods=['POST'])
+def refresh_session():
+    """Silently trade the refresh cookie for a new access token and refresh token.
+
+    Both only travel as cookies. Given the page's Socket.IO id (`{sid}`),
+    the answer carries a ticket re-authenticating that connection in place.
+    Exempt from the form CSRF check, whose token expires with long-lived
+    pages; the page echoes the JWT CSRF cookie instead.
+    """
+    csrf_cookie = request.cookies.get('csrf_access_token')
+    if not csrf_cookie or request.headers.get('X-CSRF-TOKEN') != csrf_cookie:
+        return jsonify({'status': 'error', 'message': 'Missing CSRF token'}), 403
+    try:
+        session = refresh_tokens.rotate(request.cookies.get(REFRESH_COOKIE))
+    except refresh_tokens.RefreshRaced:
+        # Another tab refreshed first and its cookies are on their way: keep them
+        return jsonify({'status': 'error', 'message': 'Refresh already in progress'}), 409
+    except Exception as e:
+        print(f"Error refreshing session: {e}")
+        return jsonify({'status': 'error', 'message': 'Internal error'}), 500
+    if not session:
+        return _end_session(jsonify({'status': 'error', 'message': 'Session expired'})), 401
+
+    user_id, email, refresh_token = session
+    access_token = _access_token(user_id, email)
+    expires_at = decode_token(access_token)['exp']
+    body = {'status': 'success', 'expires_at': expires_at}
+    sid = (request.get_json(silent=True) or {}).get('sid')
+    if isinstance(sid, str) and sid:
+        body['socket_ticket'] = socket_auth.issue_ticket(sid, user_id, email, expires_at)
+    return _set_session_cookies(jsonify(body), access_token, refresh_token)
+
+
+def _is_local_path(url):
+    """True if `url` can only lead to a page of this site."""
+    # Browsers read a backslash as '/' and drop tabs and newlines, so
+    # '/\\evil.com' would become the protocol-relative '//evil.com'
+    if not url.startswith('/') or '\\' in url or any(ord(c) < 0x20 for c in url):
+        return False
+    parsed = urlparse(url)
+    return not parsed.scheme and not parsed.netloc
+
+
+@auth_bp.route(f'{SESSION_PATH}/resume')
+def resume_session():
+    """Refresh the session on a page load whose access token expired, then go back."""
+    next_url = request.args.get('next', '')
+    if not _is_local_path(next_url):
+        next_url = url_for('home.dashboard')
+    try:
+        session = refresh_tokens.rotate(request.cookies.get(REFRESH_COOKIE))
+    except refresh_tokens.RefreshRaced:
+        # Another tab just refreshed: go back with the cookies it received
+        return redirect(next_url)
+    except Exception as e:
+        print(f"Error resuming session: {e}")
+        if not is_db_unavailable(e):
+            raise
+        # The refresh token may well be valid: keep it for the next attempt
+        return 'Service temporarily unavailable, please try again.', 503, {'Retry-After': '5'}
+    if not session:
+        return _end_session(redirect(url_for('index')))
+
+    user_id, email, refresh_token = session
+    return _set_session_cookies(redirect(next_url), _access_token(user_id, email), refresh_token)
+
+
+@auth_bp.route(f'{SESSION_PATH}/logout', methods=['POST'])
+def logout():
+    """Revoke the current session and clear its cookies."""
+    try:
+        refresh_tokens.revoke(request.cookies.get(REFRESH_COOKIE))
+    except Exception as e:
+        print(f"Error revoking session: {e}")
+    return _end_session(redirect(url_for('index')))
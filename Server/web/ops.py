@@ -0,0 +1,36 @@
+import hmac
+import os
+
+from flask import Blueprint, request, jsonify, abort
+
+from Server import metrics, warmup
+from Server.spool import get_journal
+
+ops_bp = Blueprint('ops', __name__)
+
+
+@ops_bp.route('/metrics')
+def metrics_view():
+    # Only exposed when METRICS_TOKEN is configured, and only to its holder
+    token = os.getenv('METRICS_TOKEN')
+    if not token or not hmac.compare_digest(request.headers.get('X-Metrics-Token', ''), token):
+        abort(404)
+
+    segments, size = get_journal().size()
+    metrics.set_gauge('spool.segments', segments)
+    metrics.set_gauge('spool.bytes', size)
+    return jsonify(metrics.snapshot())
+
+
+@ops_bp.route('/livez')
+def livez():
+    # The process is up and serving; says nothing about its dependencies
+    return jsonify({'status': 'ok'})
+
+
+@ops_bp.route('/readyz')
+def readyz():
+    # Ready once warm-up has finished, i.e. the databases are reachable
+    ready = warmup.is_ready()
+    body = {'status': 'ready' if ready else 'warming_up', 'steps': warmup.status()}
+    return jsonify(body), 200 if ready else 503
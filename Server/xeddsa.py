@@ -0,0 +1,52 @@
+import base64
+
+from cryptography.exceptions import InvalidSignature
+from cryptography.hazmat.primitives.asymmetric.ed25519 import Ed25519PublicKey
+
+# Verification of the signatures made by libsignal's curve25519 sign
+# (XEdDSA): the Montgomery identity key is converted to its Edwards form,
+# whose sign bit the signer stored in the top bit of the signature, and the
+# result is checked as a plain Ed25519 signature.
+_P = 2 ** 255 - 19
+KEY_TYPE_DJB = 0x05
+
+
+def _edwards_key(montgomery_key, sign_bit):
+    u = int.from_bytes(montgomery_key, 'little') & ((1 << 255) - 1)
+    if u + 1 == _P:
+        raise ValueError('Invalid public key')
+    y = (u - 1) * pow(u + 1, _P - 2, _P) % _P
+    return (y | (sign_bit << 255)).to_bytes(32, 'little')
+
+
+def _raw_key(key):
+    """Strip the type byte libsignal prefixes public keys with."""
+    if len(key) == 33 and key[0] == KEY_TYPE_DJB:
+        return key[1:]
+    if len(key) != 32:
+        raise ValueError('Public keys are 32 bytes + 1 format byte')
+    return key
+
+
+def verify_signature(identity_key, message, signature):
+    """Check an XEdDSA signature of `message` (bytes) by a Curve25519 identity key."""
+    if len(signature) != 64:
+        return False
+    try:
+        public_key = Ed25519PublicKey.from_public_bytes(_edwards_key(_raw_key(identity_key), signature[63] >> 7))
+        public_key.verify(signature[:63] + bytes([signature[63] & 0x7F]), message)
+        return True
+    except (InvalidSignature, ValueError):
+        return False
+
+
+def verify_signed_prekey(identity_key_b64, signed_prekey_b64, signature_b64):
+    """Check that a Base64 signed prekey was signed by the Base64 identity key."""
+    try:
+        identity_key = base64.b64decode(identity_key_b64, validate=True)
+        signed_prekey = base64.b64decode(signed_prekey_b64, validate=True)
+        signature = base64.b64decode(signature_b64, validate=True)
+    except (ValueError, TypeError):
+        return False
+    # libsignal signs the signed prekey with its type byte
+    return len(signed_prekey) == 33 and verify_signature(identity_key, signed_prekey, signature)
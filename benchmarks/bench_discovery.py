@@ -0,0 +1,101 @@
+"""Contact discovery benchmark: one batched hash lookup vs one lookup per identifier.
+
+Run from the repository root against a scratch database:
+
+    python -m benchmarks.bench_discovery
+
+Seeds BENCH_DISCOVERY_USERS throw-away @bench.invalid users, then looks up
+batches of 10k hashes of which BENCH_DISCOVERY_HIT_RATE are registered. The
+per-identifier lookup is timed on a sample and scaled to the batch size.
+Everything it created is removed afterwards.
+"""
+import os
+import statistics
+import time
+
+from dotenv import load_dotenv
+
+# Before importing Server: its modules read their settings at import time
+load_dotenv()
+
+from Server.database import get_db_cnx, email_hash, find_registered  # noqa: E402
+
+USERS = int(os.getenv('BENCH_DISCOVERY_USERS', 50000))
+BATCH = 10000
+HIT_RATE = float(os.getenv('BENCH_DISCOVERY_HIT_RATE', 0.1))
+SAMPLE = 500
+ROUNDS = int(os.getenv('BENCH_ROUNDS', 5))
+
+
+def seed():
+    cnx = get_db_cnx()
+    cursor = cnx.cursor()
+    try:
+        for start in range(0, USERS, 5000):
+            cursor.executemany(
+                "INSERT INTO users (email, pwdhash, salt, identity_public_key, signed_prekey, signed_prekey_signature)"
+                " VALUES (%s, 'x', 'x', 'x', 'x', 'x')",
+                [(f'bench-discovery-{i}@bench.invalid',) for i in range(start, min(start + 5000, USERS))]
+            )
+        cnx.commit()
+    finally:
+        cursor.close()
+        cnx.close()
+
+
+def cleanup():
+    cnx = get_db_cnx()
+    cursor = cnx.cursor()
+    try:
+        cursor.execute("DELETE FROM users WHERE email LIKE 'bench-discovery-%'")
+        cnx.commit()
+    finally:
+        cursor.close()
+        cnx.close()
+
+
+def address_book():
+    hits = int(BATCH * HIT_RATE)
+    registered = [f'bench-discovery-{i * (USERS // max(hits, 1))}@bench.invalid' for i in range(hits)]
+    unknown = [f'bench-discovery-unknown-{i}@bench.invalid' for i in range(BATCH - hits)]
+    return [email_hash(email) for email in registered + unknown], hits
+
+
+def lookup_one(hash_value):
+    cnx = get_db_cnx(read_only=True)
+    cursor = cnx.cursor()
+    try:
+        cursor.execute("SELECT 1 FROM users WHERE email_hash = %s", (hash_value,))
+        return cursor.fetchone() is not None
+    finally:
+        cursor.close()
+        cnx.close()
+
+
+def main():
+    seed()
+    try:
+        hashes, hits = address_book()
+
+        batched = []
+        for _ in range(ROUNDS):
+            start = time.perf_counter()
+            found = find_registered(hashes)
+            batched.append((time.perf_counter() - start) * 1000)
+        assert len(found) == hits, f'expected {hits} registered, found {len(found)}'
+
+        start = time.perf_counter()
+        for hash_value in hashes[::BATCH // SAMPLE]:
+            lookup_one(hash_value)
+        per_identifier = (time.perf_counter() - start) * 1000 / SAMPLE
+
+        batched_ms = statistics.median(batched)
+        one_by_one_ms = per_identifier * BATCH
+        print(f"{'identifiers':>12} {'registered':>11} {'batched ms':>11} {'one-by-one ms':>14} {'speedup':>8}")
+        print(f"{BATCH:>12} {hits:>11} {batched_ms:>11.1f} {one_by_one_ms:>14.0f} {one_by_one_ms / batched_ms:>7.1f}x")
+    finally:
+        cleanup()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,112 @@
+"""Group fan-out benchmark: one batched INSERT vs one INSERT + commit per member.
+
+Run from the repository root against a scratch database:
+
+    python -m benchmarks.bench_group_fanout
+
+DB_CONNECTION_STRING is read from the environment (or .env). The benchmark
+creates throw-away users under @bench.invalid and removes them afterwards.
+"""
+import json
+import os
+import statistics
+import time
+
+from dotenv import load_dotenv
+
+# Before importing Server: its modules read their settings at import time
+load_dotenv()
+
+from Server.database import get_db_cnx, store_group_messages  # noqa: E402
+
+GROUP_SIZES = (10, 100, 1000)
+ROUNDS = int(os.getenv('BENCH_ROUNDS', 5))
+CIPHERTEXT = json.dumps({'header': 'h' * 88, 'ciphertext': 'c' * 512, 'iv': 'i' * 24, 'mac': 'm' * 44})
+
+
+def seed_group(size):
+    cnx = get_db_cnx()
+    cursor = cnx.cursor()
+    try:
+        emails = [f'bench-fanout-{size}-{i}@bench.invalid' for i in range(size)]
+        cursor.executemany(
+            "INSERT INTO users (email, pwdhash, salt, identity_public_key, signed_prekey, signed_prekey_signature)"
+            " VALUES (%s, 'x', 'x', 'x', 'x', 'x')",
+            [(email,) for email in emails]
+        )
+        first_id = cursor.lastrowid
+        cursor.execute("INSERT INTO conversation_groups (name, created_by) VALUES (%s, %s)", (f'bench-{size}', first_id))
+        group_id = cursor.lastrowid
+        cursor.executemany(
+            "INSERT INTO group_members (group_id, user_id) VALUES (%s, %s)",
+            [(group_id, first_id + i) for i in range(size)]
+        )
+        cnx.commit()
+        return group_id, [(email, first_id + i) for i, email in enumerate(emails)]
+    finally:
+        cursor.close()
+        cnx.close()
+
+
+def drop_group(group_id):
+    cnx = get_db_cnx()
+    cursor = cnx.cursor()
+    try:
+        cursor.execute("DELETE FROM messages WHERE group_id = %s", (group_id,))
+        cursor.execute("DELETE FROM messages WHERE sender_email LIKE 'bench-fanout-%'")
+        cursor.execute("DELETE FROM conversation_groups WHERE id = %s", (group_id,))
+        cursor.execute("DELETE FROM users WHERE email LIKE 'bench-fanout-%'")
+        cnx.commit()
+    finally:
+        cursor.close()
+        cnx.close()
+
+
+def send_batched(sender, group_id, recipients, emitted):
+    ids = store_group_messages(sender, group_id, [(email, user_id, CIPHERTEXT) for email, user_id in recipients])
+    for (email, _), message_id in zip(recipients, ids):
+        emitted.append((email, message_id))
+
+
+def send_one_by_one(sender, group_id, recipients, emitted):
+    # What a client has to do today: one send_message event per member
+    for email, _ in recipients:
+        cnx = get_db_cnx()
+        cursor = cnx.cursor()
+        try:
+            cursor.execute(
+                "INSERT INTO messages (sender_email, receiver_email, content) VALUES (%s, %s, %s)",
+                (sender, email, CIPHERTEXT)
+            )
+            cnx.commit()
+            emitted.append((email, cursor.lastrowid))
+        finally:
+            cursor.close()
+            cnx.close()
+
+
+def timed(fn, *args):
+    timings = []
+    for _ in range(ROUNDS):
+        emitted = []
+        start = time.perf_counter()
+        fn(*args, emitted)
+        timings.append((time.perf_counter() - start) * 1000)
+    return statistics.median(timings)
+
+
+def main():
+    print(f"{'members':>8} {'batched ms':>12} {'one-by-one ms':>14} {'speedup':>8}")
+    for size in GROUP_SIZES:
+        group_id, members = seed_group(size)
+        try:
+            sender, recipients = members[0][0], members[1:]
+            batched = timed(send_batched, sender, group_id, recipients)
+            naive = timed(send_one_by_one, sender, group_id, recipients)
+            print(f"{size:>8} {batched:>12.1f} {naive:>14.1f} {naive / batched:>7.1f}x")
+        finally:
+            drop_group(group_id)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,106 @@
+"""History paging benchmark: keyset cursor vs OFFSET at increasing scroll depth.
+
+Run from the repository root against a scratch database:
+
+    python -m benchmarks.bench_history
+
+Seeds BENCH_HISTORY_SIZE messages between two throw-away @bench.invalid users
+and removes them afterwards.
+"""
+import os
+import statistics
+import time
+
+from dotenv import load_dotenv
+
+# Before importing Server: its modules read their settings at import time
+load_dotenv()
+
+from Server.database import get_db_cnx, get_conversation_page, encode_cursor  # noqa: E402
+
+HISTORY_SIZE = int(os.getenv('BENCH_HISTORY_SIZE', 100000))
+PAGE = 50
+ROUNDS = int(os.getenv('BENCH_ROUNDS', 5))
+ALICE, BOB = 'bench-history-a@bench.invalid', 'bench-history-b@bench.invalid'
+
+
+def seed():
+    cnx = get_db_cnx()
+    cursor = cnx.cursor()
+    try:
+        cursor.executemany(
+            "INSERT INTO users (email, pwdhash, salt, identity_public_key, signed_prekey, signed_prekey_signature)"
+            " VALUES (%s, 'x', 'x', 'x', 'x', 'x')",
+            [(ALICE,), (BOB,)]
+        )
+        for start in range(0, HISTORY_SIZE, 5000):
+            rows = [
+                (ALICE, BOB, 'c' * 256) if i % 2 else (BOB, ALICE, 'c' * 256)
+                for i in range(start, min(start + 5000, HISTORY_SIZE))
+            ]
+            cursor.executemany(
+                "INSERT INTO messages (sender_email, receiver_email, content) VALUES (%s, %s, %s)", rows
+            )
+        cnx.commit()
+        cursor.execute(
+            "SELECT timestamp, id FROM messages WHERE sender_email IN (%s, %s) ORDER BY timestamp, id",
+            (ALICE, BOB)
+        )
+        return cursor.fetchall()
+    finally:
+        cursor.close()
+        cnx.close()
+
+
+def cleanup():
+    cnx = get_db_cnx()
+    cursor = cnx.cursor()
+    try:
+        cursor.execute("DELETE FROM messages WHERE sender_email IN (%s, %s)", (ALICE, BOB))
+        cursor.execute("DELETE FROM users WHERE email IN (%s, %s)", (ALICE, BOB))
+        cnx.commit()
+    finally:
+        cursor.close()
+        cnx.close()
+
+
+def offset_page(offset):
+    cnx = get_db_cnx()
+    cursor = cnx.cursor()
+    try:
+        cursor.execute(
+            """SELECT id, sender_email, content, timestamp FROM messages
+               WHERE (sender_email = %s AND receiver_email = %s) OR (sender_email = %s AND receiver_email = %s)
+               ORDER BY timestamp DESC, id DESC LIMIT %s OFFSET %s""",
+            (ALICE, BOB, BOB, ALICE, PAGE, offset)
+        )
+        return cursor.fetchall()
+    finally:
+        cursor.close()
+        cnx.close()
+
+
+def timed(fn, *args):
+    timings = []
+    for _ in range(ROUNDS):
+        start = time.perf_counter()
+        fn(*args)
+        timings.append((time.perf_counter() - start) * 1000)
+    return statistics.median(timings)
+
+
+def main():
+    rows = seed()
+    try:
+        print(f"{'depth':>8} {'keyset ms':>10} {'offset ms':>10}")
+        for depth in (0, HISTORY_SIZE // 10, HISTORY_SIZE // 2, HISTORY_SIZE - PAGE):
+            before = encode_cursor(*rows[-depth]) if depth else None
+            keyset = timed(get_conversation_page, ALICE, BOB, before, None, PAGE)
+            offset = timed(offset_page, depth)
+            print(f"{depth:>8} {keyset:>10.2f} {offset:>10.2f}")
+    finally:
+        cleanup()
+
+
+if __name__ == '__main__':
+    main()
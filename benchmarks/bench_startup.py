@@ -0,0 +1,99 @@
+"""Startup benchmark: import time per module and time to build the app.
+
+Run from the repository root:
+
+    python -m benchmarks.bench_startup [--json PATH] [--baseline PATH]
+
+Each round imports Server.app in a fresh interpreter under `-X importtime`
+and then calls create_app(). Prints the slowest modules by cumulative import
+time with the Server.* modules. --json saves the medians so a later run can
+be compared against them with --baseline. No database is needed: warm-up
+runs in the background and is not part of what is measured here.
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+ROUNDS = int(os.getenv('BENCH_ROUNDS', 5))
+TOP = 15
+
+PROGRAM = """
+import time
+start = time.perf_counter()
+import Server.app
+imported = time.perf_counter()
+Server.app.create_app()
+print(f'{(imported - start) * 1000:.3f} {(time.perf_counter() - imported) * 1000:.3f}')
+"""
+
+
+def run_once():
+    result = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', PROGRAM],
+        capture_output=True, text=True, check=True
+    )
+    modules = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        self_us, cumulative_us, name = line[len('import time:'):].split('|')
+        modules[name.strip()] = (int(self_us) / 1000, int(cumulative_us) / 1000)
+    import_ms, create_app_ms = map(float, result.stdout.split()[-2:])
+    return import_ms, create_app_ms, modules
+
+
+def measure():
+    runs = [run_once() for _ in range(ROUNDS)]
+    names = set().union(*(modules for _, _, modules in runs))
+    modules = {}
+    for name in names:
+        samples = [m[name] for _, _, m in runs if name in m]
+        modules[name] = {
+            'self_ms': round(statistics.median(s for s, _ in samples), 3),
+            'cumulative_ms': round(statistics.median(c for _, c in samples), 3),
+        }
+    return {
+        'import_ms': round(statistics.median(r[0] for r in runs), 3),
+        'create_app_ms': round(statistics.median(r[1] for r in runs), 3),
+        'modules': modules,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--json', help='write the results to this file')
+    parser.add_argument('--baseline', help='compare against results saved with --json')
+    args = parser.parse_args()
+
+    results = measure()
+    baseline = {}
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+
+    def delta(current, previous):
+        return f'{current - previous:>+9.1f}' if previous is not None else f"{'':>9}"
+
+    modules = results['modules']
+    slowest = sorted(modules, key=lambda name: modules[name]['cumulative_ms'], reverse=True)[:TOP]
+    ours = sorted(name for name in modules if name.split('.')[0] == 'Server' and name not in slowest)
+
+    print(f"{'module':<45} {'self ms':>8} {'cumul. ms':>10} {'Δ cumul.':>9}")
+    for name in slowest + ours:
+        previous = baseline.get('modules', {}).get(name, {}).get('cumulative_ms')
+        print(f"{name:<45} {modules[name]['self_ms']:>8.1f} {modules[name]['cumulative_ms']:>10.1f} "
+              f"{delta(modules[name]['cumulative_ms'], previous)}")
+    print()
+    for key, label in (('import_ms', 'import Server.app'), ('create_app_ms', 'create_app()')):
+        print(f"{label:<45} {'':>8} {results[key]:>10.1f} {delta(results[key], baseline.get(key))}")
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,166 @@
+"""Sharding harness: message placement and user moves across the configured shards.
+
+Run from the repository root against scratch databases:
+
+    python -m benchmarks.shard_harness
+
+DB_CONNECTION_STRING and DB_SHARD_CONNECTION_STRINGS (at least two shards,
+created from Server/databases/shard.sql) are read from the environment (or
+.env). The harness registers throw-away @bench.invalid users, checks that
+every message lands on its recipient's shard, moves some users to another
+shard with Server.rebalance and checks their messages and prekeys followed
+them. Everything it created is removed afterwards.
+"""
+import os
+import time
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+from Server.database import get_db_cnx, store_group_messages, get_conversation_page  # noqa: E402
+from Server.sharding import get_router, bump_directory_version  # noqa: E402
+from Server import rebalance  # noqa: E402
+
+USERS = int(os.getenv('BENCH_SHARD_USERS', 200))
+MESSAGES_PER_USER = 5
+
+
+def seed_users(router):
+    cnx = get_db_cnx()
+    cursor = cnx.cursor()
+    try:
+        emails = [f'bench-shard-{i}@bench.invalid' for i in range(USERS)]
+        cursor.executemany(
+            "INSERT INTO users (email, pwdhash, salt, identity_public_key, signed_prekey, signed_prekey_signature)"
+            " VALUES (%s, 'x', 'x', 'x', 'x', 'x')",
+            [(email,) for email in emails]
+        )
+        cnx.commit()
+        cursor.execute("SELECT id, email FROM users WHERE email LIKE 'bench-shard-%' ORDER BY id")
+        users = cursor.fetchall()
+    finally:
+        cursor.close()
+        cnx.close()
+
+    for name, user_ids in _by_shard(router, users).items():
+        shard = router.connect(name)
+        shard_cursor = shard.cursor()
+        try:
+            shard_cursor.executemany(
+                "INSERT INTO prekeys (user_id, prekey_id, prekey) VALUES (%s, %s, 'x')",
+                [(user_id, i) for user_id in user_ids for i in range(3)]
+            )
+            shard.commit()
+        finally:
+            shard_cursor.close()
+            shard.close()
+    return users
+
+
+def _by_shard(router, users):
+    shards = {}
+    for user_id, _ in users:
+        shards.setdefault(router.locate(user_id)[0], []).append(user_id)
+    return shards
+
+
+def send_messages(users):
+    sender = users[0][1]
+    started = time.perf_counter()
+    for _ in range(MESSAGES_PER_USER):
+        store_group_messages(sender, None, [(email, user_id, 'c' * 256) for user_id, email in users[1:]])
+    return (time.perf_counter() - started) * 1000
+
+
+def count_on(router, name, sql, params):
+    cnx = router.connect(name)
+    cursor = cnx.cursor()
+    try:
+        cursor.execute(sql, params)
+        return cursor.fetchone()[0]
+    finally:
+        cursor.close()
+        cnx.close()
+
+
+def check_placement(router, users):
+    """Return the number of users whose rows are not all on their own shard."""
+    misplaced = 0
+    for user_id, email in users[1:]:
+        home, _ = router.locate(user_id)
+        for name in router.shards:
+            messages = count_on(router, name, "SELECT COUNT(*) FROM messages WHERE receiver_email = %s", (email,))
+            prekeys = count_on(router, name, "SELECT COUNT(*) FROM prekeys WHERE user_id = %s", (user_id,))
+            expected = (MESSAGES_PER_USER, 3) if name == home else (0, 0)
+            if (messages, prekeys) != expected:
+                misplaced += 1
+                print(f"  user {user_id} on {name}: {messages} messages, {prekeys} prekeys, expected {expected}")
+    return misplaced
+
+
+def cleanup(router, users):
+    emails = tuple(email for _, email in users)
+    user_ids = tuple(user_id for user_id, _ in users)
+    placeholders = ', '.join(['%s'] * len(users))
+    for name in router.shards:
+        cnx = router.connect(name)
+        cursor = cnx.cursor()
+        try:
+            cursor.execute(f"DELETE FROM messages WHERE receiver_email IN ({placeholders})", emails)
+            cursor.execute(f"DELETE FROM prekeys WHERE user_id IN ({placeholders})", user_ids)
+            cnx.commit()
+        finally:
+            cursor.close()
+            cnx.close()
+
+    cnx = get_db_cnx()
+    cursor = cnx.cursor()
+    try:
+        cursor.execute(f"DELETE FROM shard_directory WHERE user_id IN ({placeholders})", user_ids)
+        bump_directory_version(cursor)
+        cursor.execute(f"DELETE FROM users WHERE id IN ({placeholders})", user_ids)
+        cnx.commit()
+    finally:
+        cursor.close()
+        cnx.close()
+
+
+def main():
+    router = get_router()
+    if not router.sharded:
+        raise SystemExit('Set DB_SHARD_CONNECTION_STRINGS to at least two shards')
+
+    users = seed_users(router)
+    try:
+        elapsed = send_messages(users)
+        print(f"Stored {MESSAGES_PER_USER * (len(users) - 1)} messages in {elapsed:.0f} ms")
+        for name, user_ids in sorted(_by_shard(router, users[1:]).items()):
+            print(f"  {name}: {len(user_ids)} users")
+        misplaced = check_placement(router, users)
+        print(f"Placement: {'ok' if not misplaced else f'{misplaced} misplaced'}")
+
+        # Move a tenth of the recipients to the next shard over
+        names = list(router.shards)
+        moved = users[1:][::10]
+        by_target = {}
+        for user_id, email in moved:
+            current = router.locate(user_id)[0]
+            by_target.setdefault(names[(names.index(current) + 1) % len(names)], []).append((user_id, email))
+        started = time.perf_counter()
+        for target, batch in by_target.items():
+            rebalance.rebalance(router, batch, target)
+        router.invalidate()
+        print(f"Moved {len(moved)} users in {time.perf_counter() - started:.1f} s")
+
+        misplaced = check_placement(router, users)
+        print(f"Placement after move: {'ok' if not misplaced else f'{misplaced} misplaced'}")
+
+        page = get_conversation_page(moved[0][1], users[0][1])
+        print(f"History of a moved user: {len(page)} messages")
+    finally:
+        cleanup(router, users)
+
+
+if __name__ == '__main__':
+    main()
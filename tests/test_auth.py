@@ -0,0 +1,15 @@
+import pytest
+
+from Server.web.auth import _is_local_path
+
+
+@pytest.mark.parametrize('url', ['/dashboard', '/contacts?tab=pending', '/a//b'])
+def test_paths_of_this_site_are_accepted(url):
+    assert _is_local_path(url)
+
+
+@pytest.mark.parametrize('url', [
+    '', 'dashboard', 'https://evil.com', '//evil.com', '/\\evil.com', '/\t/evil.com', '/\n/evil.com',
+])
+def test_other_sites_are_rejected(url):
+    assert not _is_local_path(url)
@@ -0,0 +1,76 @@
+import mysql.connector
+import pytest
+
+from Server import database
+
+
+class Connection:
+    """Inserts like a server whose ids go up by `step` from `first_id`."""
+
+    server_host = 'db'
+    server_port = 3306
+
+    def __init__(self, step, first_id=101, affected=None):
+        self.step = step
+        self.first_id = first_id
+        self.affected = affected
+        self.queries = []
+        self.committed = False
+
+    def cursor(self):
+        return Cursor(self)
+
+    def commit(self):
+        self.committed = True
+
+    def rollback(self):
+        pass
+
+
+class Cursor:
+
+    def __init__(self, cnx):
+        self.cnx = cnx
+
+    def execute(self, query, params=None):
+        self.cnx.queries.append(query)
+
+    def fetchone(self):
+        return (self.cnx.step,)
+
+    def executemany(self, query, rows):
+        self.lastrowid = self.cnx.first_id
+        self.rowcount = len(rows) if self.cnx.affected is None else self.cnx.affected
+
+    def close(self):
+        pass
+
+
+def rows(n):
+    return [('a@x', f'm{i}@x', '{}', 1, None, None) for i in range(n)]
+
+
+@pytest.fixture(autouse=True)
+def no_cached_steps(monkeypatch):
+    monkeypatch.setattr(database, '_id_steps', {})
+
+
+@pytest.mark.parametrize('step, expected', [(1, [101, 102, 103]), (2, [101, 103, 105])])
+def test_ids_follow_the_auto_increment_step(step, expected):
+    cnx = Connection(step)
+    assert database._insert_messages(cnx, rows(3)) == expected
+    assert cnx.committed
+
+
+def test_step_is_read_once_per_server():
+    cnx = Connection(1)
+    database._insert_messages(cnx, rows(2))
+    database._insert_messages(cnx, rows(2))
+    assert len(cnx.queries) == 1
+
+
+def test_short_insert_is_refused():
+    cnx = Connection(1, affected=2)
+    with pytest.raises(mysql.connector.errors.DataError):
+        database._insert_messages(cnx, rows(3))
+    assert not cnx.committed
@@ -0,0 +1,93 @@
+import pytest
+
+from Server.presence import PresenceTracker
+
+
+class Redis:
+    """The few Redis commands the tracker uses; keys expire only when told to."""
+
+    def __init__(self):
+        self.data = {}
+
+    def hset(self, key, field, value):
+        self.data.setdefault(key, {})[field.encode()] = str(value).encode()
+
+    def hdel(self, key, field):
+        self.data.get(key, {}).pop(field.encode(), None)
+
+    def hgetall(self, key):
+        return dict(self.data.get(key, {}))
+
+    def set(self, key, value, ex=None):
+        self.data[key] = value
+
+    def expire(self, key, seconds):
+        return key in self.data
+
+    def exists(self, key):
+        return int(key in self.data)
+
+    def delete(self, key):
+        self.data.pop(key, None)
+
+    def sadd(self, key, member):
+        self.data.setdefault(key, set()).add(member.encode())
+
+    def srem(self, key, member):
+        self.data.get(key, set()).discard(member.encode())
+
+    def smembers(self, key):
+        return set(self.data.get(key, set()))
+
+    def stop(self, tracker):
+        """Let a worker's heartbeat expire."""
+        del self.data[f'presence:worker:{tracker.worker_id}']
+
+
+@pytest.fixture
+def redis():
+    return Redis()
+
+
+def workers(redis, n):
+    trackers = [PresenceTracker(redis) for _ in range(n)]
+    for tracker in trackers:
+        tracker.heartbeat()
+    return trackers
+
+
+def test_connections_are_counted_per_worker(redis):
+    a, b = workers(redis, 2)
+    a.connected(1, 'u@x')
+    b.connected(1, 'u@x')
+    a.disconnected(1, 'u@x')
+    assert a._is_connected('1')
+    b.disconnected(1, 'u@x')
+    assert not a._is_connected('1')
+
+
+def test_connections_of_a_stopped_worker_stop_counting(redis):
+    a, b = workers(redis, 2)
+    b.connected(1, 'u@x')
+    redis.stop(b)
+    assert not a._is_connected('1')
+
+
+def test_stopped_worker_is_settled_by_a_live_one(redis):
+    a, b = workers(redis, 2)
+    b.connected(1, 'u@x')
+    redis.stop(b)
+    a.heartbeat()
+    assert a._pending['1'][0] == 'u@x'
+    assert redis.hgetall('presence:connections:1') == {}
+    assert b.worker_id.encode() not in redis.smembers('presence:workers')
+
+
+def test_worker_publishes_its_connections_again_after_a_missed_heartbeat(redis):
+    a, b = workers(redis, 2)
+    b.connected(1, 'u@x')
+    redis.stop(b)
+    a.heartbeat()
+    b.heartbeat()
+    assert a._is_connected('1')
+    assert b._pending['1'][0] == 'u@x'
@@ -0,0 +1,82 @@
+import pytest
+
+from Server import rate_limit
+from Server.rate_limit import MemoryBackend, RateLimiter, parse_budgets
+
+
+class Clock:
+
+    def __init__(self):
+        self.now = 1000.0
+
+    def monotonic(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(rate_limit, 'time', clock)
+    return clock
+
+
+def test_bursts_up_to_capacity_then_refills(clock):
+    backend = MemoryBackend()
+    assert all(backend.consume('k', 5, 1)[0] for _ in range(5))
+    allowed, retry_after = backend.consume('k', 5, 1)
+    assert not allowed and retry_after == pytest.approx(1)
+    clock.now += 2
+    assert backend.consume('k', 5, 1)[0]
+    assert backend.consume('k', 5, 1)[0]
+    assert not backend.consume('k', 5, 1)[0]
+
+
+def test_refill_never_exceeds_capacity(clock):
+    backend = MemoryBackend()
+    backend.consume('k', 5, 1)
+    clock.now += 3600
+    assert sum(backend.consume('k', 5, 1)[0] for _ in range(10)) == 5
+
+
+def test_cost_is_taken_in_one_go(clock):
+    backend = MemoryBackend()
+    assert backend.consume('k', 100, 1, cost=60)[0]
+    allowed, retry_after = backend.consume('k', 100, 1, cost=60)
+    # A refused call takes nothing
+    assert not allowed and retry_after == pytest.approx(20)
+    assert backend.consume('k', 100, 1, cost=40)[0]
+
+
+def test_buckets_are_evicted_least_recently_used_first(clock, monkeypatch):
+    backend = MemoryBackend()
+    monkeypatch.setattr(backend, 'MAX_BUCKETS', 3)
+    for key in 'abc':
+        backend.consume(key, 1, 0.001)
+    backend.consume('a', 1, 0.001)
+    backend.consume('d', 1, 0.001)
+    assert list(backend._buckets) == ['c', 'a', 'd']
+    # 'a' is still empty, 'b' was forgotten and starts full again
+    assert not backend.consume('a', 1, 0.001)[0]
+    assert backend.consume('b', 1, 0.001)[0]
+
+
+def test_limiter_keys_buckets_by_name_and_user(clock):
+    limiter = RateLimiter(backend=MemoryBackend(), budgets={'keys': (2, 60), 'keys_target': (1, 3600)})
+    assert limiter.hit('keys', 'alice') == (True, 0)
+    assert limiter.hit('keys', 'alice') == (True, 0)
+    assert limiter.hit('keys', 'alice') == (False, 30)
+    assert limiter.hit('keys', 'bob')[0]
+    assert limiter.hit('keys_target', 'carol')[0]
+    assert not limiter.hit('keys_target', 'carol')[0]
+
+
+def test_limiter_fails_open(clock):
+    class Broken:
+        def consume(self, *args, **kwargs):
+            raise ConnectionError('redis down')
+    assert RateLimiter(backend=Broken(), budgets={}).hit('keys', 'alice') == (True, 0)
+
+
+def test_parse_budgets():
+    assert parse_budgets('keys=5/60, discover=100/86400,') == {'keys': (5, 60.0), 'discover': (100, 86400.0)}
+    assert parse_budgets(None) == {}
@@ -0,0 +1,86 @@
+import pytest
+
+from Server import refresh_tokens
+from Server.refresh_tokens import RefreshRaced
+
+
+class Connection:
+    """Answers rotate()'s token lookup with `row` and records what follows."""
+
+    def __init__(self, row):
+        self.row = row
+        self.statements = []
+        self.committed = False
+        self.rolled_back = False
+
+    def cursor(self, dictionary=False):
+        return self
+
+    def execute(self, sql, params=()):
+        self.statements.append(' '.join(sql.split()))
+
+    def fetchone(self):
+        return self.row
+
+    def commit(self):
+        self.committed = True
+
+    def rollback(self):
+        self.rolled_back = True
+
+    def close(self):
+        pass
+
+
+def token_row(**state):
+    row = {'id': 1, 'user_id': 7, 'family': 'f' * 32, 'email': 'a@x',
+           'expired': 0, 'revoked': 0, 'used': 0, 'recently_used': 0}
+    row.update(state)
+    return row
+
+
+@pytest.fixture
+def connect(monkeypatch):
+    def connect(row):
+        cnx = Connection(row)
+        monkeypatch.setattr(refresh_tokens, 'get_db_cnx', lambda: cnx)
+        return cnx
+    return connect
+
+
+def test_rotation_trades_the_token_for_a_new_one(connect):
+    cnx = connect(token_row())
+    user_id, email, new_token = refresh_tokens.rotate('old')
+    assert (user_id, email) == (7, 'a@x')
+    assert new_token and new_token != 'old'
+    assert any(s.startswith('UPDATE refresh_tokens SET used_at') for s in cnx.statements)
+    assert any(s.startswith('INSERT INTO refresh_tokens') for s in cnx.statements)
+    assert cnx.committed
+
+
+@pytest.mark.parametrize('state', [{'expired': 1}, {'revoked': 1}])
+def test_dead_tokens_are_refused(connect, state):
+    cnx = connect(token_row(**state))
+    assert refresh_tokens.rotate('old') is None
+    assert not cnx.committed
+
+
+def test_unknown_or_missing_tokens_are_refused(connect):
+    connect(None)
+    assert refresh_tokens.rotate('unknown') is None
+    assert refresh_tokens.rotate('') is None
+
+
+def test_reuse_revokes_the_whole_session(connect):
+    cnx = connect(token_row(used=1, recently_used=0))
+    assert refresh_tokens.rotate('old') is None
+    assert any(s.startswith('UPDATE refresh_tokens SET revoked_at') and 'family' in s for s in cnx.statements)
+    assert cnx.committed
+
+
+def test_reuse_within_the_grace_window_is_a_race(connect):
+    cnx = connect(token_row(used=1, recently_used=1))
+    with pytest.raises(RefreshRaced):
+        refresh_tokens.rotate('old')
+    assert not any('revoked_at' in s and s.startswith('UPDATE') for s in cnx.statements)
+    assert not cnx.committed and cnx.rolled_back
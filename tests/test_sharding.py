@@ -0,0 +1,106 @@
+from collections import Counter
+
+import pytest
+
+from Server import sharding
+from Server.sharding import HashRing, ShardRouter, parse_shards
+
+NAMES = ['shard0', 'shard1', 'shard2']
+
+
+def test_lookup_is_stable():
+    assert [HashRing(NAMES).lookup(i) for i in range(100)] == [HashRing(NAMES).lookup(i) for i in range(100)]
+
+
+def test_keys_are_spread_over_every_shard():
+    ring = HashRing(NAMES)
+    counts = Counter(ring.lookup(i) for i in range(30000))
+    assert set(counts) == set(NAMES)
+    assert min(counts.values()) > 30000 / len(NAMES) * 0.7
+
+
+def test_adding_a_shard_only_moves_keys_to_it():
+    before, after = HashRing(NAMES), HashRing(NAMES + ['shard3'])
+    moved = [i for i in range(30000) if before.lookup(i) != after.lookup(i)]
+    assert all(after.lookup(i) == 'shard3' for i in moved)
+    assert len(moved) < 30000 / 4 * 1.3
+
+
+def test_parse_shards_keeps_the_order():
+    assert parse_shards(' b=mysql://h/b , a=mysql://h/a,') == [('b', 'mysql://h/b'), ('a', 'mysql://h/a')]
+    assert parse_shards(None) == []
+
+
+def test_unsharded_router_lives_on_the_primary():
+    router = ShardRouter([])
+    assert router.shards == {'shard0': None}
+    assert router.locate(42) == ('shard0', False)
+
+
+def test_id_ranges_do_not_overlap():
+    router = ShardRouter([(name, 'dsn') for name in NAMES])
+    floors = [router.id_floor(name) for name in NAMES]
+    assert floors == sorted(floors)
+    assert floors[1] - floors[0] == 1 << sharding.SHARD_ID_BITS
+
+
+class Directory:
+    """shard_directory and its version row, as _query_primary sees them."""
+
+    def __init__(self):
+        self.entries = {}
+        self.version = 0
+        self.queries = 0
+
+    def query(self, sql, params=()):
+        self.queries += 1
+        if 'shard_directory_version' in sql:
+            return (self.version,)
+        return self.entries.get(params[0])
+
+
+@pytest.fixture
+def directory(monkeypatch):
+    directory = Directory()
+    monkeypatch.setattr(sharding, '_query_primary', directory.query)
+    return directory
+
+
+@pytest.fixture
+def router():
+    return ShardRouter([(name, 'dsn') for name in NAMES])
+
+
+def test_directory_overrides_the_ring(directory, router):
+    user = next(i for i in range(100) if router.ring.lookup(i) != 'shard2')
+    directory.entries[user] = ('shard2', 0)
+    assert router.locate(user) == ('shard2', False)
+    assert router.locate(user + 1000)[0] == router.ring.lookup(user + 1000)
+
+
+def test_entries_are_cached_until_the_version_changes(directory, router):
+    directory.entries[7] = ('shard1', 0)
+    router.locate(7)
+    queries = directory.queries
+    assert router.locate(7) == ('shard1', False)
+    assert directory.queries == queries
+
+    directory.entries[7] = ('shard2', 1)
+    directory.version += 1
+    router._checked_at -= sharding.DIRECTORY_REFRESH
+    assert router.locate(7) == ('shard2', True)
+
+
+def test_cache_is_bounded(directory, router, monkeypatch):
+    monkeypatch.setattr(sharding, 'DIRECTORY_CACHE_SIZE', 10)
+    for user in range(50):
+        router.locate(user)
+    assert len(router._entries) == 10
+
+
+def test_failed_lookup_is_not_routed_by_the_ring(router, monkeypatch):
+    def down(sql, params=()):
+        raise ConnectionError('primary down')
+    monkeypatch.setattr(sharding, '_query_primary', down)
+    with pytest.raises(ConnectionError):
+        router.locate(7)
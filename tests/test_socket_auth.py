@@ -0,0 +1,41 @@
+import pytest
+from flask import Flask
+
+from Server import socket_auth
+
+
+@pytest.fixture
+def app():
+    app = Flask(__name__)
+    app.config['SECRET_KEY'] = 'test'
+    with app.app_context():
+        yield app
+
+
+def test_ticket_is_redeemed_by_its_connection(app):
+    ticket = socket_auth.issue_ticket('sid1', 7, 'a@x', 1234)
+    assert socket_auth.redeem_ticket('sid1', ticket) == {'sid': 'sid1', 'sub': '7', 'email': 'a@x', 'exp': 1234}
+
+
+def test_ticket_is_refused_for_another_connection(app):
+    ticket = socket_auth.issue_ticket('sid1', 7, 'a@x', 1234)
+    assert socket_auth.redeem_ticket('sid2', ticket) is None
+
+
+@pytest.mark.parametrize('ticket', [None, '', 'forged', 123])
+def test_invalid_tickets_are_refused(app, ticket):
+    assert socket_auth.redeem_ticket('sid1', ticket) is None
+
+
+def test_ticket_signed_with_another_secret_is_refused(app):
+    ticket = socket_auth.issue_ticket('sid1', 7, 'a@x', 1234)
+    app.config['SECRET_KEY'] = 'other'
+    assert socket_auth.redeem_ticket('sid1', ticket) is None
+
+
+def test_expired_tokens_are_not_identities():
+    socket_auth.bind('sid1', 7, 'a@x', 0)
+    assert socket_auth.identity('sid1') is None
+    assert socket_auth.identity('sid1', allow_expired=True) == ('7', 'a@x')
+    assert socket_auth.unbind('sid1') == ('7', 'a@x')
+    assert socket_auth.identity('sid1', allow_expired=True) is None
@@ -0,0 +1,101 @@
+import mysql.connector
+import pytest
+from flask import Flask, request
+
+from Server import outbox, socket_events
+from Server.circuit_breaker import CircuitBreaker, OPEN
+
+
+class SocketIO:
+    """Collects the handlers register_handlers() attaches."""
+
+    def __init__(self):
+        self.handlers = {}
+
+    def on(self, event):
+        def decorator(f):
+            self.handlers[event] = f
+            return f
+        return decorator
+
+
+class Cursor:
+    lastrowid = 7
+
+    def execute(self, query, params=None):
+        pass
+
+    def close(self):
+        pass
+
+
+class Connection:
+
+    def __init__(self, commit_error=None):
+        self.commit_error = commit_error
+
+    def cursor(self):
+        return Cursor()
+
+    def commit(self):
+        if self.commit_error:
+            raise self.commit_error
+
+    def rollback(self):
+        pass
+
+    def close(self):
+        pass
+
+
+@pytest.fixture
+def breaker(monkeypatch):
+    breaker = CircuitBreaker('test', failure_threshold=2)
+    monkeypatch.setattr(socket_events, 'shard_breaker', lambda user_id: breaker)
+    return breaker
+
+
+@pytest.fixture
+def send(monkeypatch, breaker):
+    emitted = []
+    monkeypatch.setattr(socket_events, '_identity', lambda: ('1', 'a@x'))
+    monkeypatch.setattr(socket_events, 'get_id_from_email', lambda email: 2)
+    monkeypatch.setattr(socket_events, 'emit', lambda event, data: emitted.append((event, data)))
+    monkeypatch.setattr(socket_events, 'spool_message', lambda *args: 'spool1')
+    monkeypatch.setattr(outbox, 'enqueue', lambda *args, **kwargs: None)
+    monkeypatch.setattr(outbox, 'notify', lambda: None)
+
+    socketio = SocketIO()
+    socket_events.register_handlers(socketio)
+
+    def send(cnx):
+        monkeypatch.setattr(socket_events, 'get_shard_cnx', lambda user_id, write=False: cnx)
+        with Flask(__name__).test_request_context():
+            request.sid = 'sid1'
+            socketio.handlers['send_message']({'receiver': 'b@x', 'ciphertext': {'body': 'x'}})
+        return emitted.pop()
+    return send
+
+
+def test_sent_message_is_acknowledged(send):
+    assert send(Connection()) == ('message_sent', {'status': 'success', 'messageId': 7})
+
+
+def test_failed_commit_is_spooled(send):
+    error = mysql.connector.errors.OperationalError('Lost connection to MySQL server during query')
+    assert send(Connection(commit_error=error)) == ('message_sent', {'status': 'queued', 'spoolId': 'spool1'})
+
+
+def test_query_error_is_not_spooled(send):
+    error = mysql.connector.errors.ProgrammingError('You have an error in your SQL syntax')
+    event, data = send(Connection(commit_error=error))
+    assert event == 'message_sent' and data['status'] == 'error'
+
+
+def test_stalled_queries_open_the_breaker(send, breaker):
+    error = mysql.connector.errors.OperationalError('Lost connection to MySQL server during query')
+    for _ in range(2):
+        # Each checkout succeeds before the query fails
+        breaker.record_connected()
+        send(Connection(commit_error=error))
+    assert breaker.state == OPEN
@@ -0,0 +1,192 @@
+import os
+
+import pytest
+
+from Server import spool
+from Server.spool import Journal, HEADER
+
+
+def record(n):
+    return {'spool_id': f'id{n}', 'sender_email': 'a@x', 'receiver_email': 'b@x', 'content': '{}', 'msg_type': 'message'}
+
+
+@pytest.fixture
+def journal(tmp_path, monkeypatch):
+    journal = Journal(str(tmp_path))
+    monkeypatch.setattr(spool, '_journal', journal)
+    return journal
+
+
+def test_records_round_trip(journal):
+    for n in range(3):
+        journal.append(record(n))
+    [segment] = journal.sealed_segments()
+    assert list(Journal.read(segment)) == [record(n) for n in range(3)]
+
+
+def test_active_segment_is_not_sealed_until_it_has_data(journal):
+    assert journal.sealed_segments() == []
+    journal.append(record(0))
+    assert len(journal.sealed_segments()) == 1
+    # The next append opens a new segment, which stays unsealed until read
+    journal.append(record(1))
+    assert len(os.listdir(journal.directory)) == 2
+
+
+def test_segments_roll_over(journal, monkeypatch):
+    monkeypatch.setattr(spool, 'SEGMENT_BYTES', 1)
+    for n in range(3):
+        journal.append(record(n))
+    segments = journal.sealed_segments()
+    assert len(segments) == 3
+    assert [list(Journal.read(path)) for path in segments] == [[record(n)] for n in range(3)]
+
+
+def test_torn_tail_is_ignored(journal):
+    for n in range(2):
+        journal.append(record(n))
+    [segment] = journal.sealed_segments()
+    with open(segment, 'r+b') as f:
+        f.truncate(os.path.getsize(segment) - 3)
+    assert Journal.scan(segment) == ([record(0)], False)
+
+
+def test_torn_header_is_ignored(journal):
+    journal.append(record(0))
+    [segment] = journal.sealed_segments()
+    with open(segment, 'ab') as f:
+        f.write(HEADER.pack(10, 0)[:5])
+    assert Journal.scan(segment) == ([record(0)], False)
+
+
+def corrupt(segment, marker):
+    with open(segment, 'r+b') as f:
+        f.seek(f.read().index(marker))
+        f.write(b'XX')
+
+
+def test_corrupt_record_is_skipped_alone(journal):
+    for n in range(3):
+        journal.append(record(n))
+    [segment] = journal.sealed_segments()
+    corrupt(segment, b'id1')
+    assert Journal.scan(segment) == ([record(0), record(2)], True)
+
+
+def test_length_past_the_end_stops_the_segment(journal):
+    for n in range(3):
+        journal.append(record(n))
+    [segment] = journal.sealed_segments()
+    with open(segment, 'r+b') as f:
+        data = f.read()
+        f.seek(data.index(b'{"spool_id":"id1"') - HEADER.size)
+        f.write(HEADER.pack(len(data), 0))
+    assert Journal.scan(segment) == ([record(0)], False)
+
+
+class Table:
+    """Stand-in for the messages table, unique on spool_id like the real one."""
+
+    def __init__(self):
+        self.rows = {}
+
+    def store(self, records):
+        stored = []
+        for r in records:
+            if r['spool_id'] not in self.rows:
+                self.rows[r['spool_id']] = len(self.rows) + 1
+                stored.append((r, self.rows[r['spool_id']]))
+        return stored
+
+
+def no_sleep(seconds):
+    pass
+
+
+def test_replay_stores_and_removes_segments(journal):
+    for n in range(5):
+        journal.append(record(n))
+    table, delivered = Table(), []
+    spool.replay(table.store, lambda e: False, lambda r, i: delivered.append(i), sleep=no_sleep)
+    assert sorted(table.rows) == [f'id{n}' for n in range(5)]
+    assert delivered == [1, 2, 3, 4, 5]
+    assert journal.sealed_segments() == []
+
+
+def test_replay_after_a_crash_does_not_duplicate(journal):
+    for n in range(3):
+        journal.append(record(n))
+    table, delivered = Table(), []
+
+    # Crash after the rows are stored but before the segment is removed
+    def crash(path):
+        raise RuntimeError('crash')
+    journal.remove = crash
+    with pytest.raises(RuntimeError):
+        spool.replay(table.store, lambda e: False, lambda r, i: delivered.append(i), sleep=no_sleep)
+    del journal.remove
+
+    spool.replay(table.store, lambda e: False, lambda r, i: delivered.append(i), sleep=no_sleep)
+    assert len(table.rows) == 3
+    assert delivered == [1, 2, 3]
+    assert journal.sealed_segments() == []
+
+
+def test_replay_keeps_the_segment_while_the_database_is_down(journal):
+    journal.append(record(0))
+
+    class Down(Exception):
+        pass
+
+    def store(records):
+        raise Down()
+    spool.replay(store, lambda e: isinstance(e, Down), lambda r, i: None, sleep=no_sleep)
+    assert len(journal.sealed_segments()) == 1
+
+
+def test_replay_drops_only_the_bad_record(journal):
+    for n in range(3):
+        journal.append(record(n))
+    table = Table()
+
+    def store(records):
+        if any(r['spool_id'] == 'id1' for r in records):
+            raise ValueError('Unknown recipient')
+        return table.store(records)
+    spool.replay(store, lambda e: False, lambda r, i: None, sleep=no_sleep)
+    assert sorted(table.rows) == ['id0', 'id2']
+    assert journal.sealed_segments() == []
+
+
+def test_spooled_message_keeps_its_send_time(journal, monkeypatch):
+    monkeypatch.setattr(spool.time, 'time', lambda: 1700000000.12345)
+    spool_id = spool.spool_message('a@x', 'b@x', '{}', 'message')
+    [segment] = journal.sealed_segments()
+    [stored] = Journal.read(segment)
+    assert stored['spool_id'] == spool_id
+    assert stored['sent_at'] == 1700000000.123
+
+
+def test_replay_keeps_the_records_after_a_corrupt_one(journal):
+    for n in range(3):
+        journal.append(record(n))
+    [segment] = journal.sealed_segments()
+    corrupt(segment, b'id1')
+    table = Table()
+    spool.replay(table.store, lambda e: False, lambda r, i: None, sleep=no_sleep)
+    assert sorted(table.rows) == ['id0', 'id2']
+    assert journal.sealed_segments() == []
+
+
+def test_replay_quarantines_a_segment_it_cannot_read_to_the_end(journal):
+    for n in range(2):
+        journal.append(record(n))
+    [segment] = journal.sealed_segments()
+    with open(segment, 'r+b') as f:
+        f.truncate(os.path.getsize(segment) - 3)
+    table = Table()
+    spool.replay(table.store, lambda e: False, lambda r, i: None, sleep=no_sleep)
+    assert sorted(table.rows) == ['id0']
+    assert journal.sealed_segments() == []
+    [quarantined] = os.listdir(os.path.join(journal.directory, 'quarantine'))
+    assert quarantined.endswith(os.path.basename(segment))
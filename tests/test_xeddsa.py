@@ -0,0 +1,80 @@
+import base64
+
+import pytest
+from cryptography.hazmat.primitives.asymmetric.ed25519 import Ed25519PrivateKey
+from cryptography.hazmat.primitives.serialization import Encoding, PublicFormat
+
+from Server.xeddsa import verify_signature, verify_signed_prekey
+
+P = 2 ** 255 - 19
+
+
+def xeddsa_pair():
+    """A signing key and its identity key in libsignal's form (0x05 + Montgomery u)."""
+    private_key = Ed25519PrivateKey.generate()
+    edwards = private_key.public_key().public_bytes(Encoding.Raw, PublicFormat.Raw)
+    y = int.from_bytes(edwards, 'little') & ((1 << 255) - 1)
+    u = (1 + y) * pow(1 - y, P - 2, P) % P
+    return private_key, bytes([0x05]) + u.to_bytes(32, 'little'), edwards[31] >> 7
+
+
+def sign(private_key, sign_bit, message):
+    # XEdDSA carries the Edwards sign bit in the top bit of the signature
+    signature = bytearray(private_key.sign(message))
+    signature[63] |= sign_bit << 7
+    return bytes(signature)
+
+
+@pytest.fixture
+def pair():
+    return xeddsa_pair()
+
+
+def b64(data):
+    return base64.b64encode(data).decode()
+
+
+def test_valid_signature(pair):
+    private_key, identity_key, sign_bit = pair
+    assert verify_signature(identity_key, b'message', sign(private_key, sign_bit, b'message'))
+    # Also without the type byte
+    assert verify_signature(identity_key[1:], b'message', sign(private_key, sign_bit, b'message'))
+
+
+def test_other_message_or_key_fails(pair):
+    private_key, identity_key, sign_bit = pair
+    signature = sign(private_key, sign_bit, b'message')
+    assert not verify_signature(identity_key, b'messagf', signature)
+    assert not verify_signature(xeddsa_pair()[1], b'message', signature)
+
+
+def test_tampered_signature_fails(pair):
+    private_key, identity_key, sign_bit = pair
+    signature = bytearray(sign(private_key, sign_bit, b'message'))
+    signature[0] ^= 1
+    assert not verify_signature(identity_key, b'message', bytes(signature))
+    assert not verify_signature(identity_key, b'message', bytes(signature[:63]))
+
+
+def test_wrong_sign_bit_fails(pair):
+    private_key, identity_key, sign_bit = pair
+    assert not verify_signature(identity_key, b'message', sign(private_key, 1 - sign_bit, b'message'))
+
+
+def test_malformed_keys_fail(pair):
+    private_key, identity_key, sign_bit = pair
+    signature = sign(private_key, sign_bit, b'message')
+    assert not verify_signature(identity_key[:20], b'message', signature)
+    assert not verify_signature(bytes([0x05]) + (P - 1).to_bytes(32, 'little'), b'message', signature)
+
+
+def test_signed_prekey(pair):
+    private_key, identity_key, sign_bit = pair
+    signed_prekey = xeddsa_pair()[1]
+    signature = sign(private_key, sign_bit, signed_prekey)
+    assert verify_signed_prekey(b64(identity_key), b64(signed_prekey), b64(signature))
+    # libsignal signs the prekey with its type byte
+    unprefixed = sign(private_key, sign_bit, signed_prekey[1:])
+    assert not verify_signed_prekey(b64(identity_key), b64(signed_prekey[1:]), b64(unprefixed))
+    assert not verify_signed_prekey(b64(identity_key), b64(signed_prekey), 'not base64!')
+    assert not verify_signed_prekey(None, b64(signed_prekey), b64(signature))